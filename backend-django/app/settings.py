@@ -130,6 +130,96 @@ EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD')
 DEFAULT_FROM_EMAIL = os.getenv('DEFAULT_FROM_EMAIL')
 FILE_LOG = os.getenv('FILE_LOG')
 
+# Vues asynchrones (envoi, test SMTP, boîte de réception) à activer quand l'application est servie en ASGI (uvicorn app.asgi:application)
+MAIL_ASYNC_VIEWS = os.getenv('MAIL_ASYNC_VIEWS', 'False') == 'True'
+
+# Envoi de campagnes : nombre de messages envoyés avant de rouvrir la session SMTP
+SMTP_RECONNECT_EVERY = int(os.getenv('SMTP_RECONNECT_EVERY', 100))
+CAMPAIGN_DEFAULT_CONCURRENCY = int(os.getenv('CAMPAIGN_DEFAULT_CONCURRENCY', 4))  # sessions SMTP parallèles par campagne
+SMTP_MAX_CONNECTIONS_PER_HOST = int(os.getenv('SMTP_MAX_CONNECTIONS_PER_HOST', 8))  # sessions simultanées max par relais
+SMTP_CONNECT_TIMEOUT = float(os.getenv('SMTP_CONNECT_TIMEOUT', 10))  # secondes, établissement de la connexion et bannière
+SMTP_READ_TIMEOUT = float(os.getenv('SMTP_READ_TIMEOUT', 30))  # secondes, attente maximale d'une réponse du serveur
+SMTP_RATE_LIMIT = float(os.getenv('SMTP_RATE_LIMIT', 0))  # messages/seconde par compte SMTP (0 = illimité)
+
+# Régulation adaptative (AIMD) par relais SMTP, pilotée par les réponses 421/451
+SMTP_HOST_MAX_RATE = float(os.getenv('SMTP_HOST_MAX_RATE', 100))  # messages/seconde, débit de départ et plafond (0 = illimité)
+SMTP_HOST_MIN_RATE = float(os.getenv('SMTP_HOST_MIN_RATE', 0.5))  # messages/seconde, plancher
+AIMD_DECREASE_FACTOR = float(os.getenv('AIMD_DECREASE_FACTOR', 0.5))  # facteur appliqué sur 421/451
+AIMD_INCREASE_EVERY = int(os.getenv('AIMD_INCREASE_EVERY', 50))  # succès consécutifs avant d'augmenter d'un pas
+AIMD_RATE_STEP = float(os.getenv('AIMD_RATE_STEP', 1))  # messages/seconde ajoutés à chaque pas
+AIMD_COOLDOWN = float(os.getenv('AIMD_COOLDOWN', 2))  # secondes minimum entre deux réductions
+
+# Nombre de templates compilés gardés en cache par processus
+TEMPLATE_CACHE_SIZE = int(os.getenv('TEMPLATE_CACHE_SIZE', 256))
+# Nombre de corps de mail analysés (HTML, version texte) gardés en cache par processus
+BODY_ANALYSIS_CACHE_SIZE = int(os.getenv('BODY_ANALYSIS_CACHE_SIZE', 1024))
+
+# Pool de connexions SMTP partagé par le processus
+SMTP_POOL_MAX_SIZE = int(os.getenv('SMTP_POOL_MAX_SIZE', 4))  # connexions max par compte SMTP
+SMTP_POOL_IDLE_TIMEOUT = float(os.getenv('SMTP_POOL_IDLE_TIMEOUT', 60))  # secondes
+SMTP_POOL_ACQUIRE_TIMEOUT = float(os.getenv('SMTP_POOL_ACQUIRE_TIMEOUT', 30))  # secondes
+
+# STARTTLS : contexte TLS partagé par le processus et reprise des sessions TLS par relais
+SMTP_TLS_CA_FILE = os.getenv('SMTP_TLS_CA_FILE') or None  # certificats d'autorité (PEM) à la place du magasin système
+SMTP_TLS_SESSION_CACHE_SIZE = int(os.getenv('SMTP_TLS_SESSION_CACHE_SIZE', 1024))  # relais dont la dernière session TLS est gardée
+
+# Tests d'identifiants SMTP (écran de configuration)
+SMTP_PROBE_CACHE_TTL = float(os.getenv('SMTP_PROBE_CACHE_TTL', 300))  # secondes pendant lesquelles un test réussi n'est pas refait
+SMTP_PROBE_CACHE_SIZE = int(os.getenv('SMTP_PROBE_CACHE_SIZE', 1024))  # profils SMTP gardés en cache
+SMTP_PROBE_WORKERS = int(os.getenv('SMTP_PROBE_WORKERS', 16))  # profils testés simultanément en mode lot
+SMTP_PROBE_MAX_BATCH = int(os.getenv('SMTP_PROBE_MAX_BATCH', 50))  # profils par appel à /mail/testsmtp/batch/
+
+# File d'envoi (outbox) vidée par `python manage.py send_outbox`
+OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', 50))
+OUTBOX_ASYNC_BATCH_SIZE = int(os.getenv('OUTBOX_ASYNC_BATCH_SIZE', 500))  # emails réservés par lot par send_outbox --async, envoyés en parallèle
+OUTBOX_POLL_INTERVAL = float(os.getenv('OUTBOX_POLL_INTERVAL', 1))  # secondes
+OUTBOX_LEASE_SECONDS = int(os.getenv('OUTBOX_LEASE_SECONDS', 300))  # délai avant de reprendre un envoi interrompu
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', 6))  # tentatives avant de classer l'email en rejet (dead)
+OUTBOX_RETRY_BASE_SECONDS = float(os.getenv('OUTBOX_RETRY_BASE_SECONDS', 60))  # délai avant la 2e tentative, doublé ensuite
+OUTBOX_RETRY_MAX_SECONDS = float(os.getenv('OUTBOX_RETRY_MAX_SECONDS', 3600))  # délai maximum entre deux tentatives
+OUTBOX_SECRET_KEY = os.getenv('OUTBOX_SECRET_KEY', SECRET_KEY)  # clé de chiffrement des mots de passe SMTP de la file
+
+
+# Journal des envois écrit par lots (voir mailapp.deliverylog)
+DELIVERY_LOG_BATCH_SIZE = int(os.getenv('DELIVERY_LOG_BATCH_SIZE', 500))  # lignes en attente avant écriture
+DELIVERY_LOG_FLUSH_MS = float(os.getenv('DELIVERY_LOG_FLUSH_MS', 1000))  # délai maximum avant écriture
+
+# Liste d'exclusion (rebonds, désinscriptions) gardée en mémoire par chaque processus
+SUPPRESSION_REFRESH_SECONDS = float(os.getenv('SUPPRESSION_REFRESH_SECONDS', 30))  # intervalle de rafraîchissement depuis la base
+
+# Listes de campagnes
+CAMPAIGN_PAGE_SIZE = int(os.getenv('CAMPAIGN_PAGE_SIZE', 50))  # campagnes par page
+CAMPAIGN_MEMBERS_PAGE_SIZE = int(os.getenv('CAMPAIGN_MEMBERS_PAGE_SIZE', 500))  # emails cibles par page
+CAMPAIGN_MAX_PAGE_SIZE = int(os.getenv('CAMPAIGN_MAX_PAGE_SIZE', 5000))  # limite maximale demandée par page
+CAMPAIGN_IMPORT_CHUNK_SIZE = int(os.getenv('CAMPAIGN_IMPORT_CHUNK_SIZE', 10000))  # lignes chargées par COPY lors d'un import
+
+# Validation des adresses
+EMAIL_VALIDATION_CHECK_DOMAINS = os.getenv('EMAIL_VALIDATION_CHECK_DOMAINS', 'True') == 'True'  # rejette les domaines inexistants
+EMAIL_VALIDATION_RESOLVER = os.getenv('EMAIL_VALIDATION_RESOLVER', 'auto')  # 'auto' ou chemin d'une classe (ex. mailapp.validation.AcceptAllResolver)
+EMAIL_DOMAIN_CACHE_TTL = float(os.getenv('EMAIL_DOMAIN_CACHE_TTL', 3600))  # durée de vie d'une réponse DNS en cache
+EMAIL_DOMAIN_CACHE_SIZE = int(os.getenv('EMAIL_DOMAIN_CACHE_SIZE', 50000))  # domaines gardés en cache
+EMAIL_DNS_TIMEOUT = float(os.getenv('EMAIL_DNS_TIMEOUT', 3))  # délai maximum d'une requête MX
+EMAIL_DNS_WORKERS = int(os.getenv('EMAIL_DNS_WORKERS', 16))  # résolutions simultanées
+EMAIL_VALIDATION_MAX_BATCH = int(os.getenv('EMAIL_VALIDATION_MAX_BATCH', 10000))  # adresses par appel à /mail/validate/
+
+# Boîte de réception IMAP
+MAILBOX_PAGE_SIZE = int(os.getenv('MAILBOX_PAGE_SIZE', 50))  # messages par page
+MAILBOX_PREVIEW_BYTES = int(os.getenv('MAILBOX_PREVIEW_BYTES', 2048))  # octets du corps récupérés pour l'aperçu
+MAILBOX_PREVIEW_CHARS = int(os.getenv('MAILBOX_PREVIEW_CHARS', 500))  # longueur de l'aperçu renvoyé
+MAILBOX_SEARCH_BODY_BYTES = int(os.getenv('MAILBOX_SEARCH_BODY_BYTES', 64 * 1024))  # octets du corps indexés pour la recherche
+MAILBOX_SEARCH_INDEX_BATCH = int(os.getenv('MAILBOX_SEARCH_INDEX_BATCH', 100))  # messages dont le corps est récupéré et indexé à chaque recherche
+MAILBOX_MAX_PAGE_SIZE = int(os.getenv('MAILBOX_MAX_PAGE_SIZE', 200))  # limite maximale demandée par page
+MAILBOX_INITIAL_SYNC = int(os.getenv('MAILBOX_INITIAL_SYNC', 200))  # messages récents mis en cache à la première synchronisation
+MAILBOX_BODY_MAX_BYTES = int(os.getenv('MAILBOX_BODY_MAX_BYTES', 1024 * 1024))  # octets max récupérés par partie texte d'un message
+MAILBOX_PART_CHUNK_BYTES = int(os.getenv('MAILBOX_PART_CHUNK_BYTES', 256 * 1024))  # taille des morceaux lus lors du téléchargement d'une pièce jointe
+MAILBOX_MESSAGE_CACHE_SIZE = int(os.getenv('MAILBOX_MESSAGE_CACHE_SIZE', 256))  # messages analysés gardés en mémoire
+MAILBOX_SEARCH_CONFIG = os.getenv('MAILBOX_SEARCH_CONFIG', 'simple')  # configuration Postgres de la recherche plein texte
+
+# Pool de sessions IMAP partagé par le processus
+IMAP_POOL_MAX_SIZE = int(os.getenv('IMAP_POOL_MAX_SIZE', 4))  # sessions max par compte IMAP
+IMAP_POOL_IDLE_TIMEOUT = float(os.getenv('IMAP_POOL_IDLE_TIMEOUT', 300))  # secondes
+IMAP_POOL_ACQUIRE_TIMEOUT = float(os.getenv('IMAP_POOL_ACQUIRE_TIMEOUT', 30))  # secondes
+
 
 DATABASES = {
     'default': {
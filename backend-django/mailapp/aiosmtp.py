@@ -0,0 +1,210 @@
+import asyncio
+import base64
+import re
+import smtplib
+import ssl
+from email.message import Message
+from typing import Dict, Iterable, Optional, Tuple, Union
+
+_LINE_ENDINGS = re.compile(rb'\r\n|\n|\r')
+_LEADING_DOT = re.compile(rb'(?m)^\.')
+
+
+def _encode_message(message: Union[bytes, Message]) -> bytes:
+    """
+    Prépare le contenu de DATA : fins de ligne CRLF, points en début de ligne
+    doublés (RFC 5321 §4.5.2) et terminaison <CRLF>.<CRLF>.
+    """
+    if isinstance(message, Message):
+        # Politique du message conservée (compat32 : pas de ré-analyse des entêtes)
+        message = message.as_bytes()
+    data = _LEADING_DOT.sub(b'..', _LINE_ENDINGS.sub(b'\r\n', message))
+    if not data.endswith(b'\r\n'):
+        data += b'\r\n'
+    return data + b'.\r\n'
+
+
+class AsyncSMTP:
+    """
+    Client SMTP asyncio minimal (EHLO, STARTTLS, AUTH PLAIN/LOGIN, envoi, QUIT).
+
+    Même interface et mêmes exceptions que smtplib.SMTP pour les commandes
+    utilisées par Mailer : les erreurs sont classées par Mailer._classify_error
+    comme pour les envois synchrones. Une conversation lente n'occupe qu'une
+    coroutine, pas un thread.
+
+    :param timeout: Délai maximum (secondes) de chaque réponse du serveur.
+    :param connect_timeout: Délai maximum de connexion (par défaut `timeout`).
+    """
+
+    def __init__(self, host: str, port: int, timeout: Optional[float] = None, connect_timeout: Optional[float] = None):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout or timeout
+        self.esmtp_features: Dict[str, str] = {}
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+
+    async def __aenter__(self) -> 'AsyncSMTP':
+        return self
+
+    async def __aexit__(self, *exc_info):
+        if exc_info[0] is None:
+            await self.quit()
+        else:
+            self.close()
+
+    async def _wait(self, awaitable):
+        # asyncio.timeout plutôt que wait_for : pas de tâche créée pour chaque lecture
+        async with asyncio.timeout(self.timeout):
+            return await awaitable
+
+    async def connect(self) -> Tuple[int, bytes]:
+        try:
+            async with asyncio.timeout(self.connect_timeout):
+                self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        except asyncio.TimeoutError as exc:
+            raise smtplib.SMTPConnectError(-1, f"Connection to {self.host}:{self.port} timed out".encode()) from exc
+        code, message = await self.getreply()
+        if code != 220:
+            self.close()
+            raise smtplib.SMTPConnectError(code, message)
+        return code, message
+
+    async def getreply(self) -> Tuple[int, bytes]:
+        lines = []
+        while True:
+            try:
+                line = await self._wait(self._reader.readline())
+            except asyncio.TimeoutError as exc:
+                self.close()
+                raise smtplib.SMTPServerDisconnected("Timed out waiting for the server reply") from exc
+            if not line:
+                self.close()
+                raise smtplib.SMTPServerDisconnected("Connection unexpectedly closed")
+            lines.append(line[4:].strip())
+            if line[3:4] != b'-':
+                break
+        try:
+            code = int(line[:3])
+        except ValueError:
+            code = -1
+        return code, b'\n'.join(lines)
+
+    async def docmd(self, command: str, argument: str = '') -> Tuple[int, bytes]:
+        if self._writer is None:
+            raise smtplib.SMTPServerDisconnected("Please run connect() first")
+        line = f'{command} {argument}'.rstrip() if argument else command
+        self._writer.write(line.encode('ascii') + b'\r\n')
+        await self._wait(self._writer.drain())
+        return await self.getreply()
+
+    async def ehlo(self, name: str = 'localhost') -> Tuple[int, bytes]:
+        code, message = await self.docmd('EHLO', name)
+        if code != 250:
+            raise smtplib.SMTPHeloError(code, message)
+        self.esmtp_features = {}
+        for line in message.decode('latin-1').split('\n')[1:]:
+            keyword, _, params = line.partition(' ')
+            self.esmtp_features[keyword.lower()] = params
+        return code, message
+
+    async def starttls(self, context: Optional[ssl.SSLContext] = None) -> Tuple[int, bytes]:
+        if 'starttls' not in self.esmtp_features:
+            raise smtplib.SMTPNotSupportedError("STARTTLS extension not supported by server.")
+        code, message = await self.docmd('STARTTLS')
+        if code != 220:
+            raise smtplib.SMTPResponseException(code, message)
+        await self._wait(self._writer.start_tls(context or ssl.create_default_context(), server_hostname=self.host))
+        # Les extensions annoncées avant TLS ne sont plus valables (RFC 3207)
+        await self.ehlo()
+        return code, message
+
+    async def login(self, user: str, password: str) -> Tuple[int, bytes]:
+        methods = self.esmtp_features.get('auth', '').upper().split()
+        if 'PLAIN' in methods or not methods:
+            token = base64.b64encode(f'\0{user}\0{password}'.encode()).decode('ascii')
+            code, message = await self.docmd('AUTH', f'PLAIN {token}')
+        else:
+            code, message = await self.docmd('AUTH', 'LOGIN')
+            if code == 334:
+                code, message = await self.docmd(base64.b64encode(user.encode()).decode('ascii'))
+            if code == 334:
+                code, message = await self.docmd(base64.b64encode(password.encode()).decode('ascii'))
+        if code not in (235, 503):
+            raise smtplib.SMTPAuthenticationError(code, message)
+        return code, message
+
+    async def sendmail(self, from_addr: str, to_addrs: Iterable[str], message: Union[bytes, Message]) -> Dict[str, Tuple[int, bytes]]:
+        """
+        :return: Les destinataires refusés, comme smtplib.SMTP.sendmail.
+        """
+        code, reply = await self.docmd('MAIL', f'FROM:<{from_addr}>')
+        if code != 250:
+            await self.rset()
+            raise smtplib.SMTPSenderRefused(code, reply, from_addr)
+        refused = {}
+        to_addrs = list(to_addrs)
+        for recipient in to_addrs:
+            code, reply = await self.docmd('RCPT', f'TO:<{recipient}>')
+            if code not in (250, 251):
+                refused[recipient] = (code, reply)
+        if len(refused) == len(to_addrs):
+            await self.rset()
+            raise smtplib.SMTPRecipientsRefused(refused)
+        code, reply = await self.docmd('DATA')
+        if code != 354:
+            await self.rset()
+            raise smtplib.SMTPDataError(code, reply)
+        self._writer.write(_encode_message(message))
+        await self._wait(self._writer.drain())
+        code, reply = await self.getreply()
+        if code != 250:
+            await self.rset()
+            raise smtplib.SMTPDataError(code, reply)
+        return refused
+
+    async def rset(self):
+        try:
+            await self.docmd('RSET')
+        except smtplib.SMTPServerDisconnected:
+            pass
+
+    async def noop(self) -> Tuple[int, bytes]:
+        return await self.docmd('NOOP')
+
+    async def quit(self):
+        try:
+            await self.docmd('QUIT')
+        except (smtplib.SMTPServerDisconnected, OSError):
+            pass
+        finally:
+            self.close()
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+
+
+async def open_async_smtp(smtp_auth, timeout: Optional[float] = None, connect_timeout: Optional[float] = None,
+                          tls_context: Optional[ssl.SSLContext] = None) -> AsyncSMTP:
+    """
+    Ouvre une session SMTP asynchrone authentifiée (STARTTLS si demandé),
+    équivalent de connections.open_smtp.
+
+    :param tls_context: Contexte TLS de STARTTLS (par défaut un nouveau contexte
+        par connexion). asyncio ne permet pas de reprendre une session TLS.
+    """
+    server = AsyncSMTP(smtp_auth['smtp_server'], smtp_auth['smtp_port'], timeout=timeout, connect_timeout=connect_timeout)
+    await server.connect()
+    try:
+        await server.ehlo()
+        if smtp_auth['is_tls']:
+            await server.starttls(tls_context)
+        await server.login(smtp_auth['smtp_user'], smtp_auth['smtp_passwd'])
+    except BaseException:
+        server.close()
+        raise
+    return server
@@ -0,0 +1,309 @@
+import hashlib
+import logging
+import smtplib
+import threading
+import time
+from imaplib import IMAP4, IMAP4_SSL
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from typing import Any, Dict, Hashable, Iterator
+from django.conf import settings
+from .exceptions import ConnectionPoolTimeoutException
+from .tls import starttls, tls_sessions
+
+logger = logging.getLogger(__name__)
+
+
+class PooledConnection:
+    """
+    Connexion empruntée à un pool, avec les informations nécessaires à sa gestion.
+    """
+    __slots__ = ('key', 'params', 'conn', 'created_at', 'last_used')
+
+    def __init__(self, key: Hashable, params: Dict[str, Any], conn: Any):
+        self.key = key
+        self.params = params
+        self.conn = conn
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+
+
+class ConnectionPool:
+    """
+    Pool générique de connexions réutilisables, partagé par tout le processus.
+
+    Les connexions sont regroupées par clé (serveur, port, utilisateur...). Pour
+    chaque clé, au plus `max_size` connexions sont ouvertes simultanément ; les
+    connexions inactives depuis plus de `idle_timeout` secondes sont fermées et
+    une connexion est vérifiée (`_is_alive`) avant d'être réutilisée.
+
+    Une connexion empruntée n'est jamais partagée : elle appartient à
+    l'appelant jusqu'à `release`.
+    """
+
+    def __init__(self, max_size: int, idle_timeout: float, acquire_timeout: float):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.acquire_timeout = acquire_timeout
+        self._cond = threading.Condition()
+        self._idle = defaultdict(deque)  # clé -> connexions disponibles (la plus récente à droite)
+        self._open = defaultdict(int)    # clé -> nombre de connexions ouvertes (empruntées + disponibles)
+
+    # Points d'extension à implémenter par les pools spécialisés
+    def _key(self, params: Dict[str, Any]) -> Hashable:
+        raise NotImplementedError
+
+    def _connect(self, params: Dict[str, Any]) -> Any:
+        raise NotImplementedError
+
+    def _is_alive(self, conn: Any) -> bool:
+        raise NotImplementedError
+
+    def _close(self, conn: Any):
+        raise NotImplementedError
+
+    def _is_disconnect(self, exc: Exception) -> bool:
+        # Indique si l'exception rend la connexion inutilisable
+        return isinstance(exc, OSError)
+
+    def _expired_locked(self) -> list:
+        # Retire les connexions inactives trop anciennes (appelé avec le verrou)
+        now = time.monotonic()
+        expired = []
+        for key, idle in self._idle.items():
+            while idle and now - idle[0].last_used > self.idle_timeout:
+                expired.append(idle.popleft())
+                self._open[key] -= 1
+        if expired:
+            self._cond.notify_all()
+        return expired
+
+    def _close_quietly(self, pooled: PooledConnection):
+        try:
+            self._close(pooled.conn)
+        except Exception as exc:
+            logger.debug(f"Error while closing pooled connection: {exc}")
+
+    def acquire(self, params: Dict[str, Any]) -> PooledConnection:
+        """
+        Emprunte une connexion vivante pour `params`, en ouvre une nouvelle si
+        nécessaire, ou attend qu'une connexion se libère si le pool est plein.
+        """
+        key = self._key(params)
+        deadline = time.monotonic() + self.acquire_timeout
+        with self._cond:
+            while True:
+                expired = self._expired_locked()
+                idle = self._idle.get(key)
+                if idle:
+                    pooled = idle.pop()
+                    break
+                if self._open[key] < self.max_size:
+                    self._open[key] += 1
+                    pooled = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise ConnectionPoolTimeoutException("No pooled connection available before timeout")
+                self._cond.wait(remaining)
+
+        for old in expired:
+            self._close_quietly(old)
+
+        if pooled is not None:
+            if self._is_alive(pooled.conn):
+                pooled.params = params
+                return pooled
+            logger.info("Discarding dead pooled connection")
+            self._close_quietly(pooled)
+
+        # La place est réservée dans `_open` : on ouvre une connexion neuve
+        try:
+            return PooledConnection(key, params, self._connect(params))
+        except Exception:
+            with self._cond:
+                self._open[key] -= 1
+                self._cond.notify()
+            raise
+
+    def reconnect(self, pooled: PooledConnection):
+        """
+        Remplace la connexion sous-jacente par une nouvelle, sans libérer la place
+        occupée dans le pool.
+        """
+        self._close_quietly(pooled)
+        try:
+            pooled.conn = self._connect(pooled.params)
+        except Exception:
+            pooled.conn = None
+            raise
+        pooled.created_at = pooled.last_used = time.monotonic()
+
+    def release(self, pooled: PooledConnection, discard: bool = False):
+        """
+        Rend une connexion au pool, ou la ferme si `discard` est vrai.
+        """
+        if discard or pooled.conn is None:
+            if pooled.conn is not None:
+                self._close_quietly(pooled)
+            with self._cond:
+                self._open[pooled.key] -= 1
+                self._cond.notify()
+            return
+        pooled.last_used = time.monotonic()
+        with self._cond:
+            self._idle[pooled.key].append(pooled)
+            expired = self._expired_locked()
+            self._cond.notify()
+        for old in expired:
+            self._close_quietly(old)
+
+    @contextmanager
+    def connection(self, params: Dict[str, Any]) -> Iterator[PooledConnection]:
+        """
+        Emprunte une connexion le temps d'un bloc `with`. Une exception réseau
+        levée dans le bloc provoque la fermeture de la connexion.
+        """
+        pooled = self.acquire(params)
+        discard = False
+        try:
+            yield pooled
+        except Exception as exc:
+            discard = self._is_disconnect(exc)
+            raise
+        finally:
+            self.release(pooled, discard=discard)
+
+    def clear(self):
+        """
+        Ferme toutes les connexions disponibles.
+        """
+        with self._cond:
+            idle = [pooled for queue in self._idle.values() for pooled in queue]
+            for pooled in idle:
+                self._open[pooled.key] -= 1
+            self._idle.clear()
+            self._cond.notify_all()
+        for pooled in idle:
+            self._close_quietly(pooled)
+
+
+def open_smtp(smtp_auth: Dict[str, Any]) -> smtplib.SMTP:
+    """
+    Ouvre une session SMTP authentifiée (STARTTLS si demandé). La connexion est
+    bornée par SMTP_CONNECT_TIMEOUT, chaque réponse du serveur par SMTP_READ_TIMEOUT :
+    un relais injoignable ou muet ne bloque pas le thread appelant.
+
+    STARTTLS utilise le contexte TLS partagé et reprend la dernière session TLS
+    du relais : une reconnexion en cours de campagne évite la poignée de main complète.
+    """
+    host, port = smtp_auth['smtp_server'], smtp_auth['smtp_port']
+    server = smtplib.SMTP(host, port, timeout=settings.SMTP_CONNECT_TIMEOUT)
+    try:
+        server.sock.settimeout(settings.SMTP_READ_TIMEOUT)
+        if smtp_auth['is_tls']:
+            starttls(server, host, port)
+        server.login(smtp_auth['smtp_user'], smtp_auth['smtp_passwd'])
+        if smtp_auth['is_tls']:
+            # En TLS 1.3 le ticket de session n'arrive qu'après les premiers échanges chiffrés
+            tls_sessions.store(host, port, server.sock)
+    except Exception:
+        server.close()
+        raise
+    return server
+
+
+class SMTPConnectionPool(ConnectionPool):
+    """
+    Pool de sessions SMTP authentifiées, indexé par (serveur, port, utilisateur, TLS).
+    Une empreinte du mot de passe fait aussi partie de la clé, pour ne jamais
+    resservir une session ouverte avec d'autres identifiants.
+    """
+
+    def _key(self, smtp_auth: Dict[str, Any]) -> Hashable:
+        passwd_digest = hashlib.sha256(smtp_auth['smtp_passwd'].encode()).hexdigest()
+        return (smtp_auth['smtp_server'], smtp_auth['smtp_port'], smtp_auth['smtp_user'],
+                bool(smtp_auth['is_tls']), passwd_digest)
+
+    def _connect(self, smtp_auth: Dict[str, Any]) -> smtplib.SMTP:
+        return open_smtp(smtp_auth)
+
+    def _is_alive(self, server: smtplib.SMTP) -> bool:
+        try:
+            return server.noop()[0] == 250
+        except Exception:
+            return False
+
+    def _close(self, server: smtplib.SMTP):
+        try:
+            server.quit()
+        except Exception:
+            server.close()
+
+    def _is_disconnect(self, exc: Exception) -> bool:
+        # Les erreurs SMTP avec code de réponse laissent la session utilisable
+        if isinstance(exc, smtplib.SMTPServerDisconnected):
+            return True
+        return isinstance(exc, OSError) and not isinstance(exc, smtplib.SMTPException)
+
+
+def open_imap(imap_config: Dict[str, Any]) -> IMAP4:
+    """
+    Ouvre une session IMAP authentifiée (SSL si demandé).
+    """
+    if imap_config['use_ssl']:
+        imap_server = IMAP4_SSL(imap_config['imap_server'], imap_config['imap_port'])
+    else:
+        imap_server = IMAP4(imap_config['imap_server'], imap_config['imap_port'])
+    try:
+        imap_server.login(imap_config['username'], imap_config['password'])
+    except Exception:
+        imap_server.shutdown()
+        raise
+    return imap_server
+
+
+class IMAPConnectionPool(ConnectionPool):
+    """
+    Pool de sessions IMAP authentifiées, indexé par (serveur, port, utilisateur, SSL)
+    et une empreinte du mot de passe. Une session n'est prêtée qu'à une requête à
+    la fois : l'appelant doit refaire son SELECT, la boîte sélectionnée par
+    l'emprunteur précédent n'étant pas garantie.
+    """
+
+    def _key(self, imap_config: Dict[str, Any]) -> Hashable:
+        passwd_digest = hashlib.sha256(imap_config['password'].encode()).hexdigest()
+        return (imap_config['imap_server'], imap_config['imap_port'], imap_config['username'],
+                bool(imap_config['use_ssl']), passwd_digest)
+
+    def _connect(self, imap_config: Dict[str, Any]) -> IMAP4:
+        return open_imap(imap_config)
+
+    def _is_alive(self, imap_server: IMAP4) -> bool:
+        try:
+            return imap_server.noop()[0] == 'OK'
+        except Exception:
+            return False
+
+    def _close(self, imap_server: IMAP4):
+        try:
+            imap_server.logout()
+        except Exception:
+            imap_server.shutdown()
+
+    def _is_disconnect(self, exc: Exception) -> bool:
+        # Un refus de commande (NO/BAD) laisse la session utilisable, pas une coupure
+        return isinstance(exc, (IMAP4.abort, OSError))
+
+
+smtp_pool = SMTPConnectionPool(
+    max_size=settings.SMTP_POOL_MAX_SIZE,
+    idle_timeout=settings.SMTP_POOL_IDLE_TIMEOUT,
+    acquire_timeout=settings.SMTP_POOL_ACQUIRE_TIMEOUT
+)
+
+imap_pool = IMAPConnectionPool(
+    max_size=settings.IMAP_POOL_MAX_SIZE,
+    idle_timeout=settings.IMAP_POOL_IDLE_TIMEOUT,
+    acquire_timeout=settings.IMAP_POOL_ACQUIRE_TIMEOUT
+)
@@ -0,0 +1,57 @@
+import base64
+import hashlib
+import logging
+from django.conf import settings
+
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+except ImportError:  # cryptography est optionnel : mot de passe stocké en clair à défaut
+    Fernet = None
+
+logger = logging.getLogger(__name__)
+
+_FERNET_PREFIX = 'fernet:'
+_PLAIN_PREFIX = 'plain:'
+_fernet = None
+_warned = False
+
+
+def _get_fernet():
+    global _fernet
+    if _fernet is None:
+        # Clé Fernet dérivée de OUTBOX_SECRET_KEY (SECRET_KEY par défaut)
+        digest = hashlib.sha256(settings.OUTBOX_SECRET_KEY.encode('utf-8')).digest()
+        _fernet = Fernet(base64.urlsafe_b64encode(digest))
+    return _fernet
+
+
+def seal(password: str) -> str:
+    """
+    Chiffre un mot de passe SMTP avant de l'écrire en base (Fernet, paquet
+    `cryptography`). Sans `cryptography`, le mot de passe est gardé tel quel et
+    un avertissement est journalisé.
+    """
+    global _warned
+    if Fernet is None:
+        if not _warned:
+            logger.warning("cryptography is not installed: outbox SMTP passwords are stored unencrypted")
+            _warned = True
+        return _PLAIN_PREFIX + password
+    return _FERNET_PREFIX + _get_fernet().encrypt(password.encode('utf-8')).decode('ascii')
+
+
+def unseal(secret: str) -> str:
+    """
+    Déchiffre un mot de passe écrit par seal. Lève ValueError si le secret est
+    vide, illisible ou chiffré avec une autre clé.
+    """
+    if secret.startswith(_PLAIN_PREFIX):
+        return secret[len(_PLAIN_PREFIX):]
+    if not secret.startswith(_FERNET_PREFIX):
+        raise ValueError("No stored SMTP password")
+    if Fernet is None:
+        raise ValueError("cryptography is required to decrypt the stored SMTP password")
+    try:
+        return _get_fernet().decrypt(secret[len(_FERNET_PREFIX):].encode('ascii')).decode('utf-8')
+    except InvalidToken as exc:
+        raise ValueError("Stored SMTP password cannot be decrypted with OUTBOX_SECRET_KEY") from exc
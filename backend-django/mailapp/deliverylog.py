@@ -0,0 +1,116 @@
+import atexit
+import logging
+import threading
+import time
+from collections import Counter
+from typing import List, Optional
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils.timezone import now
+from .models import CampaignMail, CampaignStats, DeliveryRecord
+
+logger = logging.getLogger(__name__)
+
+
+class DeliveryLog:
+    """
+    Tampon d'écriture des DeliveryRecord.
+
+    Les résultats d'envoi sont accumulés en mémoire puis écrits par bulk_create
+    dès que `batch_size` lignes sont en attente, ou au plus tard toutes les
+    `flush_interval` millisecondes par un thread d'arrière-plan : l'envoi d'un
+    message ne coûte pas d'aller-retour en base. Les compteurs CampaignStats sont
+    incrémentés dans la même transaction, une requête par campagne du lot.
+
+    Un lot dont l'écriture échoue est perdu (et journalisé) plutôt que
+    conservé indéfiniment en mémoire.
+    """
+
+    def __init__(self, batch_size: int, flush_interval: float):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._pending: List[DeliveryRecord] = []
+        self._flusher: Optional[threading.Thread] = None
+
+    def _start_flusher(self):
+        # Appelé sous self._lock
+        if self._flusher is not None and self._flusher.is_alive():
+            return
+        self._flusher = threading.Thread(target=self._run_flusher, name='delivery-log', daemon=True)
+        self._flusher.start()
+        atexit.register(self.flush)
+
+    def _run_flusher(self):
+        while True:
+            time.sleep(self.flush_interval / 1000)
+            if self._pending:
+                close_old_connections()
+                self.flush()
+
+    def record(self, recipient: str, status: str, smtp_code: Optional[int] = None,
+               latency: Optional[float] = None, campaign_id: Optional[int] = None,
+               template_id: Optional[int] = None, attempts: int = 1):
+        """
+        Ajoute le résultat d'un envoi au tampon.
+
+        :param latency: Durée de la transaction SMTP, en secondes.
+        """
+        record = DeliveryRecord(
+            recipient=recipient[:255],
+            campaign_id=campaign_id,
+            template_id=template_id,
+            status=status,
+            smtp_code=smtp_code,
+            latency_ms=round(latency * 1000) if latency is not None else None,
+            attempts=attempts,
+            created_at=now()
+        )
+        with self._lock:
+            self._pending.append(record)
+            full = len(self._pending) >= self.batch_size
+            self._start_flusher()
+        if full:
+            self.flush()
+
+    def flush(self) -> int:
+        """
+        Écrit les résultats en attente et met à jour les compteurs des campagnes.
+
+        :return: Le nombre de lignes écrites.
+        """
+        with self._lock:
+            batch, self._pending = self._pending, []
+        if not batch:
+            return 0
+        counters = Counter((record.campaign_id, record.status) for record in batch if record.campaign_id is not None)
+        try:
+            with transaction.atomic():
+                DeliveryRecord.objects.bulk_create(batch)
+                # Une campagne supprimée pendant l'envoi n'a plus de compteurs
+                campaign_ids = set(CampaignMail.objects.filter(
+                    id__in={campaign_id for campaign_id, _ in counters}
+                ).values_list('id', flat=True)) if counters else set()
+                CampaignStats.objects.bulk_create(
+                    [CampaignStats(campaign_id=campaign_id) for campaign_id in campaign_ids],
+                    ignore_conflicts=True
+                )
+                for campaign_id in campaign_ids:
+                    increments = {
+                        status: F(status) + counters[(campaign_id, status)]
+                        for status in (DeliveryRecord.STATUS_SENT, DeliveryRecord.STATUS_DEFERRED, DeliveryRecord.STATUS_FAILED)
+                        if counters[(campaign_id, status)]
+                    }
+                    CampaignStats.objects.filter(campaign_id=campaign_id).update(updated_at=now(), **increments)
+        except Exception as exc:
+            logger.error(f"Failed to write {len(batch)} delivery record(s) for reason: {exc}")
+            return 0
+        return len(batch)
+
+
+# Tampon partagé par le processus
+delivery_log = DeliveryLog(
+    batch_size=settings.DELIVERY_LOG_BATCH_SIZE,
+    flush_interval=settings.DELIVERY_LOG_FLUSH_MS
+)
@@ -1,8 +1,36 @@
 class SendMailException(Exception):
     pass
 
+class TransientSendException(SendMailException):
+    """Échec temporaire (réponse SMTP 4xx, coupure réseau) : l'envoi peut être retenté"""
+    def __init__(self, message: str = '', smtp_code: int = None):
+        super().__init__(message)
+        self.smtp_code = smtp_code
+
+class PermanentSendException(SendMailException):
+    """Échec définitif (réponse SMTP 5xx) : inutile de retenter"""
+    def __init__(self, message: str = '', smtp_code: int = None):
+        super().__init__(message)
+        self.smtp_code = smtp_code
+
+class SuppressedRecipientException(PermanentSendException):
+    """Destinataire présent dans la liste d'exclusion : l'email n'est pas envoyé"""
+    pass
+
 class SMTPAuthentificationException(Exception):
     pass
 
 class RemoteServerSMTPException(Exception):
-    pass
\ No newline at end of file
+    pass
+
+class ConnectionPoolTimeoutException(Exception):
+    pass
+
+class MessageNotFoundException(Exception):
+    pass
+
+class InvalidTargetsException(Exception):
+    """Aucune adresse valide dans une liste de remplacement : les membres de la campagne ne sont pas modifiés"""
+    def __init__(self, invalid):
+        super().__init__(f"No valid email address among {len(invalid)} target(s)")
+        self.invalid = invalid
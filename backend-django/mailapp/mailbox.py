@@ -0,0 +1,571 @@
+import base64
+import binascii
+import logging
+import quopri
+import re
+from email import message_from_bytes
+from email.header import decode_header, make_header
+from email.parser import BytesHeaderParser
+from imaplib import IMAP4
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple, TypeVar
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from .connections import imap_pool
+from .exceptions import MessageNotFoundException
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+# Entêtes récupérés pour la liste des messages (les deux derniers servent à décoder l'aperçu)
+HEADER_FIELDS = 'SUBJECT FROM DATE CONTENT-TYPE CONTENT-TRANSFER-ENCODING'
+
+# Début de réponse FETCH : "<numéro de séquence> ("
+_FETCH_START = re.compile(rb'^(\d+) \(')
+# Section BODY[...] dont la valeur est un littéral {n}
+_LITERAL_SECTION = re.compile(rb'BODY\[([^\]]*)\](?:<\d+>)? \{\d+\}$')
+# Section BODY[...] dont la valeur est une chaîne ou NIL
+_INLINE_SECTION = re.compile(rb'BODY\[([^\]]*)\](?:<\d+>)? ("(?:[^"\\]|\\.)*"|NIL)')
+_UID = re.compile(rb'UID (\d+)')
+_FLAGS = re.compile(rb'FLAGS \(([^)]*)\)')
+_TAGS = re.compile(r'<[^>]+>')
+_STATUS_ITEM = re.compile(rb'(MESSAGES|UNSEEN) (\d+)')
+_LITERAL_MARKER = re.compile(rb'\{\d+\}$')
+
+# Entêtes seuls : le corps n'est ni lu ni découpé en parties
+_header_parser = BytesHeaderParser()
+
+
+def with_imap_session(imap_config: Dict[str, Any], operation: Callable[[IMAP4], T]) -> T:
+    """
+    Exécute `operation(imap_server)` sur une session du pool IMAP. Si le serveur
+    a coupé la session, elle est rouverte et l'opération retentée une fois.
+    """
+    with imap_pool.connection(imap_config) as pooled:
+        try:
+            return operation(pooled.conn)
+        except IMAP4.abort as exc:
+            logger.info(f"IMAP session dropped by server, reconnecting: {exc}")
+            imap_pool.reconnect(pooled)
+            return operation(pooled.conn)
+
+
+def quote_mailbox(name: str) -> str:
+    """
+    Nom de dossier tel qu'envoyé au serveur : imaplib ne met pas les arguments
+    entre guillemets, ce qui casse les noms contenant des espaces.
+    """
+    return '"' + name.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def list_folders(imap_server: IMAP4) -> List[str]:
+    """
+    Noms des dossiers sélectionnables du compte (commande LIST).
+    """
+    result, data = imap_server.list()
+    if result != 'OK':
+        raise IMAP4.error(f"LIST failed: {data}")
+    folders = []
+    for line in data:
+        if line is None:
+            continue
+        if isinstance(line, tuple):
+            line = _join_literals([line])
+        # (\HasNoChildren) "/" "INBOX"
+        flags, pos = _parse_list(line, 0)
+        _, pos = _parse_list(line, pos)
+        name, _ = _parse_list(line, pos)
+        if name and not any(flag.lower() in ('\\noselect', '\\nonexistent') for flag in flags or []):
+            folders.append(name)
+    return folders
+
+
+def folder_status(imap_server: IMAP4, folder: str) -> Dict[str, int]:
+    """
+    Nombre de messages et de messages non lus d'un dossier, sans le sélectionner (STATUS).
+    """
+    result, data = imap_server.status(quote_mailbox(folder), '(MESSAGES UNSEEN)')
+    if result != 'OK':
+        raise IMAP4.error(f"STATUS {folder} failed: {data}")
+    counts = dict(_STATUS_ITEM.findall(data[0] if isinstance(data[0], bytes) else _join_literals(data)))
+    return {
+        'messages': int(counts.get(b'MESSAGES', 0)),
+        'unseen': int(counts.get(b'UNSEEN', 0)),
+    }
+
+
+def _response_int(imap_server: IMAP4, code: str) -> Optional[int]:
+    # Valeur d'un code de réponse de SELECT (UIDVALIDITY, UIDNEXT)
+    _, data = imap_server.response(code)
+    if not data or data[0] is None:
+        return None
+    try:
+        return int(data[-1])
+    except ValueError:
+        return None
+
+
+def select_folder(imap_server: IMAP4, folder: str) -> Tuple[int, int, Optional[int]]:
+    """
+    Sélectionne un dossier en lecture seule.
+
+    :return: Le tuple (nombre de messages, UIDVALIDITY, UIDNEXT ou None).
+    """
+    result, data = imap_server.select(quote_mailbox(folder), readonly=True)
+    if result != 'OK':
+        raise IMAP4.error(f"SELECT {folder} failed: {data}")
+    return int(data[0]), _response_int(imap_server, 'UIDVALIDITY') or 0, _response_int(imap_server, 'UIDNEXT')
+
+
+def list_fetch_items(preview_bytes: Optional[int] = None) -> str:
+    """
+    Éléments FETCH d'une liste de messages : UID, drapeaux, quelques entêtes et
+    le début du corps, sans télécharger le message complet ni ses pièces jointes.
+    """
+    preview_bytes = preview_bytes or settings.MAILBOX_PREVIEW_BYTES
+    return f'(UID FLAGS BODY.PEEK[HEADER.FIELDS ({HEADER_FIELDS})] BODY.PEEK[TEXT]<0.{preview_bytes}>)'
+
+
+def _parse_atoms(text: bytes, message: Dict[str, Any]):
+    uid = _UID.search(text)
+    if uid:
+        message['uid'] = int(uid.group(1))
+    flags = _FLAGS.search(text)
+    if flags:
+        message['flags'] = flags.group(1).decode(errors='replace').split()
+    for section, value in _INLINE_SECTION.findall(text):
+        message['sections'][section.decode(errors='replace').upper()] = \
+            b'' if value == b'NIL' else value[1:-1].replace(b'\\"', b'"').replace(b'\\\\', b'\\')
+
+
+def parse_fetch_response(data: List[Any]) -> Dict[int, Dict[str, Any]]:
+    """
+    Regroupe par numéro de séquence une réponse FETCH portant sur plusieurs messages.
+
+    imaplib renvoie une liste mêlant des tuples (texte précédant un littéral,
+    littéral) et des fragments de texte : les littéraux sont rangés par section
+    (ex. 'TEXT', 'HEADER.FIELDS (...)'), l'UID et les drapeaux sont lus dans le texte.
+
+    :return: {séquence: {'uid', 'flags', 'sections': {section: octets}}}
+    """
+    messages: Dict[int, Dict[str, Any]] = {}
+    current = None
+    for item in data:
+        if item is None:
+            continue
+        text = item[0] if isinstance(item, tuple) else item
+        start = _FETCH_START.match(text)
+        if start:
+            current = messages.setdefault(int(start.group(1)), {'uid': None, 'flags': [], 'sections': {}})
+        if current is None:
+            continue
+        _parse_atoms(text, current)
+        if isinstance(item, tuple):
+            section = _LITERAL_SECTION.search(text)
+            if section:
+                current['sections'][section.group(1).decode(errors='replace').upper()] = item[1]
+    return messages
+
+
+def decode_mime_header(value: Optional[str]) -> str:
+    """
+    Décode un entête encodé RFC 2047 (=?utf-8?...?=), tous fragments compris.
+    """
+    if not value:
+        return ''
+    try:
+        return str(make_header(decode_header(value)))
+    except (UnicodeDecodeError, LookupError, binascii.Error):
+        return value
+
+
+def _decode_partial_payload(part) -> bytes:
+    # Décode une partie éventuellement tronquée par la récupération partielle
+    payload = part.get_payload()
+    if not isinstance(payload, str):
+        return b''
+    encoding = (part.get('Content-Transfer-Encoding') or '').strip().lower()
+    raw = payload.encode('ascii', errors='ignore') if encoding in ('base64', 'quoted-printable') \
+        else payload.encode('utf-8', errors='surrogateescape')
+    if encoding == 'base64':
+        compact = re.sub(rb'[^A-Za-z0-9+/=]', b'', raw)
+        compact = compact[:len(compact) // 4 * 4]
+        try:
+            return base64.b64decode(compact)
+        except binascii.Error:
+            return b''
+    if encoding == 'quoted-printable':
+        return quopri.decodestring(raw)
+    return raw
+
+
+def extract_preview(header: bytes, text: bytes, limit: Optional[int] = None) -> str:
+    """
+    Construit l'aperçu texte d'un message à partir de ses entêtes de contenu et
+    du début (tronqué) de son corps.
+    """
+    limit = limit or settings.MAILBOX_PREVIEW_CHARS
+    message = message_from_bytes(header.rstrip(b'\r\n') + b'\r\n\r\n' + text)
+    fallback = None
+    for part in message.walk():
+        if part.is_multipart():
+            continue
+        content_type = part.get_content_type()
+        if content_type == 'text/plain':
+            fallback = part
+            break
+        if content_type == 'text/html' and fallback is None:
+            fallback = part
+    if fallback is None:
+        return ''
+    charset = fallback.get_content_charset() or 'utf-8'
+    try:
+        preview = _decode_partial_payload(fallback).decode(charset, errors='replace')
+    except LookupError:
+        preview = _decode_partial_payload(fallback).decode('utf-8', errors='replace')
+    if fallback.get_content_type() == 'text/html':
+        preview = _TAGS.sub(' ', preview)
+    return ' '.join(preview.split())[:limit]
+
+
+def summarize(sequence: int, fetched: Dict[str, Any], with_text: bool = False) -> Dict[str, Any]:
+    """
+    Construit l'entrée de liste d'un message à partir de sa réponse FETCH.
+
+    :param with_text: Ajoute `body_text`, tout le texte récupéré du corps (pour l'index de recherche).
+    """
+    sections = fetched['sections']
+    header = next((value for key, value in sections.items() if key.startswith('HEADER')), b'')
+    text = sections.get('TEXT', b'')
+    headers = _header_parser.parsebytes(header)
+    summary = {
+        'id': str(sequence),
+        'uid': fetched['uid'],
+        'subject': decode_mime_header(headers['subject']),
+        'sender': decode_mime_header(headers['from']),
+        'date': headers['date'],
+        'seen': '\\Seen' in fetched['flags'],
+    }
+    if with_text:
+        body_text = extract_preview(header, text, limit=len(text))
+        summary['body'] = body_text[:settings.MAILBOX_PREVIEW_CHARS]
+        summary['body_text'] = body_text
+    else:
+        summary['body'] = extract_preview(header, text)
+    return summary
+
+
+def fetch_summaries(imap_server: IMAP4, message_set: str, uid: bool = False,
+                    with_text: bool = False) -> List[Dict[str, Any]]:
+    """
+    Récupère en une seule commande FETCH les résumés de tous les messages de
+    `message_set` (ex. '51:100'), triés du plus ancien au plus récent.
+
+    :param with_text: Récupère MAILBOX_SEARCH_BODY_BYTES octets du corps au lieu
+        de l'aperçu, et ajoute `body_text` aux résumés (voir summarize).
+    """
+    items = list_fetch_items(settings.MAILBOX_SEARCH_BODY_BYTES if with_text else None)
+    if uid:
+        result, data = imap_server.uid('FETCH', message_set, items)
+    else:
+        result, data = imap_server.fetch(message_set, items)
+    if result != 'OK':
+        raise IMAP4.error(f"FETCH failed: {data}")
+    fetched = parse_fetch_response(data)
+    return [summarize(sequence, fetched[sequence], with_text) for sequence in sorted(fetched)]
+
+
+def _join_literals(data: List[Any]) -> bytes:
+    """
+    Reconstitue une réponse FETCH sur une seule ligne, les littéraux {n} étant
+    remplacés par des chaînes entre guillemets.
+    """
+    chunks = []
+    for item in data:
+        if item is None:
+            continue
+        if isinstance(item, tuple):
+            text, literal = item
+            chunks.append(_LITERAL_MARKER.sub(b'', text))
+            chunks.append(b'"' + literal.replace(b'\\', b'\\\\').replace(b'"', b'\\"') + b'"')
+        else:
+            chunks.append(item)
+    return b''.join(chunks)
+
+
+def _parse_list(data: bytes, pos: int):
+    """
+    Lit une expression IMAP (liste parenthésée, chaîne, NIL ou atome) à partir de `pos`.
+
+    :return: Le tuple (valeur, position suivante).
+    """
+    while data[pos:pos + 1] == b' ':
+        pos += 1
+    char = data[pos:pos + 1]
+    if char == b'(':
+        items, pos = [], pos + 1
+        while True:
+            while data[pos:pos + 1] == b' ':
+                pos += 1
+            if data[pos:pos + 1] in (b')', b''):
+                return items, pos + 1
+            item, pos = _parse_list(data, pos)
+            items.append(item)
+    if char == b'"':
+        value, pos = bytearray(), pos + 1
+        while pos < len(data) and data[pos:pos + 1] != b'"':
+            if data[pos:pos + 1] == b'\\':
+                pos += 1
+            value += data[pos:pos + 1]
+            pos += 1
+        return bytes(value).decode('utf-8', errors='replace'), pos + 1
+    end = pos
+    while end < len(data) and data[end:end + 1] not in (b' ', b'(', b')'):
+        end += 1
+    atom = data[pos:end].decode('ascii', errors='replace')
+    return (None if atom.upper() == 'NIL' else atom), end
+
+
+def fetch_attributes(data: List[Any]) -> Dict[int, Dict[str, Any]]:
+    """
+    Analyse complète d'une réponse FETCH : chaque réponse (une par message) est
+    lue comme une liste IMAP de paires nom/valeur, les littéraux étant rattachés
+    à leur réponse. Contrairement à parse_fetch_response, les valeurs structurées
+    (BODYSTRUCTURE, FLAGS) sont rendues en listes.
+
+    :return: {séquence: {nom d'attribut en majuscules: valeur}}
+    """
+    responses: List[List[Any]] = []
+    for item in data:
+        if item is None:
+            continue
+        text = item[0] if isinstance(item, tuple) else item
+        if _FETCH_START.match(text) or not responses:
+            responses.append([])
+        responses[-1].append(item)
+    attributes = {}
+    for response in responses:
+        line = _join_literals(response)
+        start = _FETCH_START.match(line)
+        if not start:
+            continue
+        items, _ = _parse_list(line, start.end() - 1)
+        attributes[int(start.group(1))] = {
+            str(name).upper(): value for name, value in zip(items[::2], items[1::2])
+        }
+    return attributes
+
+
+def _params(value) -> Dict[str, str]:
+    # Liste de paramètres ("CHARSET" "utf-8" ...) -> dictionnaire
+    if not isinstance(value, list):
+        return {}
+    return {str(key).lower(): val for key, val in zip(value[::2], value[1::2]) if key is not None}
+
+
+def parse_bodystructure(structure: list, part: str = '') -> List[Dict[str, Any]]:
+    """
+    Aplatit un BODYSTRUCTURE en liste de parties feuilles, avec leur numéro de
+    section IMAP ('1', '1.2'...), type, paramètres, encodage, taille et nom de fichier.
+    """
+    if structure and isinstance(structure[0], list):
+        # multipart : les sous-parties précèdent le sous-type
+        parts = []
+        for index, child in enumerate(structure):
+            if not isinstance(child, list):
+                break
+            parts.extend(parse_bodystructure(child, f'{part}.{index + 1}' if part else str(index + 1)))
+        return parts
+    maintype, subtype = (structure[0] or '').lower(), (structure[1] or '').lower()
+    params = _params(structure[2])
+    # Position de la disposition : après les lignes (text), l'enveloppe (message/rfc822) ou la taille
+    if maintype == 'text':
+        disposition_index = 9
+    elif (maintype, subtype) == ('message', 'rfc822'):
+        disposition_index = 11
+    else:
+        disposition_index = 8
+    disposition = structure[disposition_index] if len(structure) > disposition_index else None
+    disposition_type, disposition_params = None, {}
+    if isinstance(disposition, list) and disposition:
+        disposition_type = (disposition[0] or '').lower()
+        disposition_params = _params(disposition[1] if len(disposition) > 1 else None)
+    filename = disposition_params.get('filename') or params.get('name')
+    return [{
+        'part': part or '1',
+        'content_type': f'{maintype}/{subtype}',
+        'charset': params.get('charset'),
+        'encoding': (structure[5] or '7bit').lower(),
+        'size': int(structure[6]) if str(structure[6]).isdigit() else 0,
+        'filename': decode_mime_header(filename) if filename else None,
+        'attachment': disposition_type == 'attachment' or bool(filename),
+    }]
+
+
+def decode_part(raw: bytes, encoding: str, charset: Optional[str]) -> str:
+    """
+    Décode le contenu d'une partie texte selon son Content-Transfer-Encoding et son
+    charset. Le contenu peut être tronqué par la récupération partielle.
+    """
+    if encoding == 'base64':
+        # Partie éventuellement tronquée (<0.MAILBOX_BODY_MAX_BYTES>) : quantum incomplet écarté
+        compact = re.sub(rb'[^A-Za-z0-9+/=]', b'', raw)
+        try:
+            raw = base64.b64decode(compact[:len(compact) // 4 * 4])
+        except binascii.Error:
+            raw = b''
+    elif encoding == 'quoted-printable':
+        raw = quopri.decodestring(raw)
+    try:
+        return raw.decode(charset or 'utf-8', errors='replace')
+    except LookupError:
+        return raw.decode('utf-8', errors='replace')
+
+
+def _fetch_structure(imap_server: IMAP4, uid: int, extra_items: str = '') -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    # FETCH du BODYSTRUCTURE d'un message (et d'éléments supplémentaires), aplati en parties
+    items = f'UID FLAGS BODYSTRUCTURE {extra_items}'.strip()
+    result, data = imap_server.uid('FETCH', str(uid), f'({items})')
+    if result != 'OK':
+        raise IMAP4.error(f"FETCH failed: {data}")
+    fetched = next(iter(parse_fetch_response(data).values()), None)
+    if fetched is None or fetched['uid'] != uid:
+        raise MessageNotFoundException(f"Message {uid} not found")
+    attributes = next(
+        (attributes for attributes in fetch_attributes(data).values() if attributes.get('UID') == str(uid)), {}
+    )
+    structure = attributes.get('BODYSTRUCTURE')
+    if not isinstance(structure, list):
+        raise IMAP4.error(f"FETCH returned no BODYSTRUCTURE for message {uid}")
+    return fetched, parse_bodystructure(structure)
+
+
+def fetch_message(imap_server: IMAP4, uid: int) -> Dict[str, Any]:
+    """
+    Récupère un message à la demande : entêtes et structure d'abord, puis
+    uniquement ses parties texte (tronquées à MAILBOX_BODY_MAX_BYTES) ; les
+    pièces jointes sont listées sans être téléchargées. Le dossier doit être sélectionné.
+    """
+    fetched, parts = _fetch_structure(imap_server, uid, 'BODY.PEEK[HEADER]')
+    headers = _header_parser.parsebytes(fetched['sections'].get('HEADER', b''))
+
+    text_parts = {}
+    for part in parts:
+        if not part['attachment'] and part['content_type'] in ('text/plain', 'text/html'):
+            text_parts.setdefault(part['content_type'], part)
+    body = {'text/plain': '', 'text/html': ''}
+    truncated = False
+    if text_parts:
+        limit = settings.MAILBOX_BODY_MAX_BYTES
+        items = ' '.join(f"BODY.PEEK[{part['part']}]<0.{limit}>" for part in text_parts.values())
+        result, data = imap_server.uid('FETCH', str(uid), f'({items})')
+        if result != 'OK':
+            raise IMAP4.error(f"FETCH failed: {data}")
+        sections = next(iter(parse_fetch_response(data).values()), {'sections': {}})['sections']
+        for content_type, part in text_parts.items():
+            raw = sections.get(part['part'], b'')
+            truncated = truncated or part['size'] > limit
+            body[content_type] = decode_part(raw, part['encoding'], part['charset'])
+
+    return {
+        'id': str(uid),
+        'uid': uid,
+        'subject': decode_mime_header(headers['subject']),
+        'sender': decode_mime_header(headers['from']),
+        'to': decode_mime_header(headers['to']),
+        'cc': decode_mime_header(headers['cc']),
+        'date': headers['date'],
+        'seen': '\\Seen' in fetched['flags'],
+        'text': body['text/plain'],
+        'html': body['text/html'],
+        'truncated': truncated,
+        'attachments': [
+            {key: part[key] for key in ('part', 'filename', 'content_type', 'size')}
+            for part in parts if part['attachment'] or part['content_type'] not in ('text/plain', 'text/html')
+        ],
+    }
+
+
+def _decode_stream(chunks: Iterator[bytes], encoding: str) -> Iterator[bytes]:
+    """
+    Décode au fil de l'eau le Content-Transfer-Encoding d'une partie lue par morceaux :
+    seule la fin incomplète d'un morceau (quantum base64, ligne quoted-printable)
+    est gardée pour le suivant.
+    """
+    pending = b''
+    for chunk in chunks:
+        if encoding == 'base64':
+            pending += re.sub(rb'[^A-Za-z0-9+/=]', b'', chunk)
+            size = len(pending) // 4 * 4
+            decoded, pending = pending[:size], pending[size:]
+            if decoded:
+                yield base64.b64decode(decoded)
+        elif encoding == 'quoted-printable':
+            pending += chunk
+            cut = pending.rfind(b'\n') + 1
+            decoded, pending = pending[:cut], pending[cut:]
+            if decoded:
+                yield quopri.decodestring(decoded)
+        else:
+            yield chunk
+    if pending and encoding == 'quoted-printable':
+        yield quopri.decodestring(pending)
+
+
+def stream_part(imap_config: Dict[str, Any], uid: int, part: str, folder: str = 'INBOX') -> Iterator[Any]:
+    """
+    Générateur de téléchargement d'une partie de message.
+
+    Le premier élément produit est la description de la partie (type, nom de
+    fichier, encodage, taille) : l'appelant le lit avec next() avant de répondre,
+    ce qui lève MessageNotFoundException si le message ou la partie n'existe pas.
+    Viennent ensuite les octets décodés, lus par morceaux de
+    MAILBOX_PART_CHUNK_BYTES (BODY.PEEK[part]<offset.longueur>) : la mémoire
+    utilisée ne dépend pas de la taille de la pièce jointe. La session IMAP reste
+    empruntée au pool jusqu'à la fin (ou l'abandon) du téléchargement.
+    """
+    with imap_pool.connection(imap_config) as pooled:
+        imap_server = pooled.conn
+        select_folder(imap_server, folder)
+        _, parts = _fetch_structure(imap_server, uid)
+        info = next((candidate for candidate in parts if candidate['part'] == part), None)
+        if info is None:
+            raise MessageNotFoundException(f"Part {part} of message {uid} not found")
+        yield info
+
+        def chunks():
+            chunk_size = settings.MAILBOX_PART_CHUNK_BYTES
+            offset = 0
+            while True:
+                result, data = imap_server.uid('FETCH', str(uid), f'(BODY.PEEK[{part}]<{offset}.{chunk_size}>)')
+                if result != 'OK':
+                    raise IMAP4.error(f"FETCH failed: {data}")
+                fetched = next(iter(parse_fetch_response(data).values()), {'sections': {}})
+                chunk = fetched['sections'].get(part, b'')
+                if chunk:
+                    yield chunk
+                if len(chunk) < chunk_size:
+                    return
+                offset += len(chunk)
+
+        yield from _decode_stream(chunks(), info['encoding'])
+
+
+async def aiter_stream(stream: Iterator[bytes]) -> AsyncIterator[bytes]:
+    """
+    Itérateur asynchrone sur un téléchargement de stream_part, pour une réponse
+    servie en ASGI : Django lit entièrement en mémoire le contenu synchrone d'une
+    StreamingHttpResponse avant de l'envoyer. Chaque morceau est lu dans un
+    thread (lectures IMAP bloquantes) et envoyé avant la lecture du suivant.
+    Le générateur est fermé, et la session IMAP rendue au pool, à la fin ou à
+    l'abandon du téléchargement.
+    """
+    done = object()
+    try:
+        while True:
+            chunk = await sync_to_async(next, thread_sensitive=False)(stream, done)
+            if chunk is done:
+                return
+            yield chunk
+    finally:
+        await sync_to_async(stream.close, thread_sensitive=False)()
@@ -1,7 +1,10 @@
+import hashlib
 import smtplib
 import uuid
 import logging
 import re
+import time
+from typing import Any, Dict, Iterable, Optional, Tuple
 #from pydantic import BaseModel
 from rest_framework import serializers
 from email.utils import formataddr, formatdate
@@ -9,7 +12,20 @@ from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from bs4 import BeautifulSoup
 from django.conf import settings
-from .exceptions import SMTPAuthentificationException, RemoteServerSMTPException, SendMailException
+from .exceptions import SMTPAuthentificationException, RemoteServerSMTPException, SendMailException, ConnectionPoolTimeoutException, \
+    TransientSendException, PermanentSendException, SuppressedRecipientException
+from .throttle import host_throttles
+from .templating import CompiledTemplate
+from .mime import PreparedMessage
+from .cache import LRUCache
+from .connections import smtp_pool, PooledConnection
+from .suppression import suppression_list, BOUNCE_CODES
+from .models import Suppression, DeliveryRecord
+from .aiosmtp import open_async_smtp
+from asgiref.sync import sync_to_async
+from .deliverylog import delivery_log
+from .probe import cached_probe, remember_probe, forget_probe
+from .tls import shared_context
 
 # Configuration du logger
 logging.basicConfig(
@@ -22,6 +38,12 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Nombre maximum d'échecs détaillés renvoyés dans le rapport d'une campagne
+MAX_REPORTED_FAILURES = 100
+
+# Analyse des corps de mail (HTML ou non, version texte), par empreinte du contenu
+_body_analysis = LRUCache(maxsize=settings.BODY_ANALYSIS_CACHE_SIZE)
+
 class AuthentificationSMTPSerializer(serializers.Serializer):
     smtp_server = serializers.CharField()
     smtp_port = serializers.IntegerField()
@@ -38,6 +60,14 @@ class EmailObjSerializer(serializers.Serializer):
     body = serializers.CharField()
 
 
+class CampaignSendSerializer(serializers.Serializer):
+    smtp_auth = AuthentificationSMTPSerializer()
+    template_id = serializers.IntegerField()
+    sender = serializers.CharField(required=False)
+    concurrency = serializers.IntegerField(required=False, min_value=1)  # sessions SMTP parallèles
+    rate_limit = serializers.FloatField(required=False, min_value=0)  # messages/seconde pour le compte
+
+
 class Mailer:
     def __init__(self):
         pass
@@ -52,65 +82,357 @@ class Mailer:
     def _convert_html_to_text(self, html: str) -> str:
         # Utilise BeautifulSoup pour convertir le HTML en texte brut
         soup = BeautifulSoup(html, "html.parser")
-        return soup.get_text()  # Récupère tout le texte sans balises HTML
+        for tag in soup(["script", "style", "head"]):
+            tag.decompose()
+        return soup.get_text("\n", strip=True)  # Récupère tout le texte sans balises HTML
 
-    def test_connection(self, email_auth: AuthentificationSMTPSerializer):
+    def _analyse_body(self, body: str) -> Tuple[bool, Optional[str]]:
+        """
+        Détermine si le corps est du HTML et, si oui, sa version texte brut.
+        Le résultat est mis en cache par empreinte du contenu : l'analyse
+        BeautifulSoup n'est faite qu'une fois par corps distinct.
+
+        :return: Le tuple (is_html, texte brut ou None).
+        """
+        key = hashlib.sha256(body.encode('utf-8')).digest()
+        analysis = _body_analysis.get(key)
+        if analysis is None:
+            is_html = self._is_html(body)
+            analysis = (is_html, self._convert_html_to_text(body) if is_html else None)
+            _body_analysis.set(key, analysis)
+        return analysis
+
+    def _raise_connection_error(self, smtp_auth, exc: Exception):
+        # Distingue un serveur injoignable d'un refus d'authentification
+        unreachable = isinstance(exc, (smtplib.SMTPConnectError, smtplib.SMTPServerDisconnected)) \
+            or not isinstance(exc, smtplib.SMTPException)
+        if unreachable:
+            logger.error(f"Failed connection to server {smtp_auth['smtp_server']} on port {smtp_auth['smtp_port']} for reason: {exc}")
+            raise RemoteServerSMTPException
+        logger.error(f"Failed authentication to server {smtp_auth['smtp_server']} on port {smtp_auth['smtp_port']} for reason: {exc}")
+        forget_probe(smtp_auth)
+        raise SMTPAuthentificationException
+
+    def _acquire(self, smtp_auth) -> PooledConnection:
         try:
-            remote_conn = False
-            # Utilisation de validated_data pour accéder aux données validées
-            email_data = email_auth.validated_data  # Accéder aux données validées
-            
-            with smtplib.SMTP(email_data['smtp_server'], email_data['smtp_port']) as server:
-                remote_conn = True
-                if email_data['is_tls']:  # Vérifier si TLS est activé
-                    server.starttls()
-                server.login(email_data['smtp_user'], email_data['smtp_passwd'])
+            return smtp_pool.acquire(smtp_auth)
+        except ConnectionPoolTimeoutException:
+            raise
         except Exception as exc:
-            if remote_conn:
-                logger.error(f"Failed authentication to server {email_data['smtp_server']} on port {email_data['smtp_port']} for reason: {exc}")
-                raise SMTPAuthentificationException
-            else:
-                logger.error(f"Failed connection to server {email_data['smtp_server']} on port {email_data['smtp_port']} for reason: {exc}")
-                raise RemoteServerSMTPException
-
-    def send_mail(self, email_obj: EmailObjSerializer):
-        smtp_server = email_obj['smtp_auth']['smtp_server']
-        smtp_port = email_obj['smtp_auth']['smtp_port']
-        username_mail = email_obj['smtp_auth']['smtp_user']
-        password_mail = email_obj['smtp_auth']['smtp_passwd']
-        sender_name = email_obj['sender']
-        recipient_mail = email_obj['recipient']
-        subject = email_obj['subject']
-        body = email_obj['body']
+            self._raise_connection_error(smtp_auth, exc)
+
+    def _classify_error(self, exc: Exception) -> SendMailException:
+        """
+        Classe une erreur d'envoi selon le code de réponse SMTP : 4xx et coupures
+        réseau sont temporaires, 5xx sont définitives.
+        """
+        if isinstance(exc, SendMailException):
+            return exc
+        smtp_code = None
+        if isinstance(exc, smtplib.SMTPRecipientsRefused):
+            codes = [code for code, _ in exc.recipients.values()]
+            # Un seul refus définitif suffit à rendre l'envoi définitivement impossible
+            smtp_code = max(codes) if codes else None
+        elif isinstance(exc, smtplib.SMTPResponseException):
+            smtp_code = exc.smtp_code
+        elif isinstance(exc, (smtplib.SMTPServerDisconnected, ConnectionPoolTimeoutException)) \
+                or (isinstance(exc, OSError) and not isinstance(exc, smtplib.SMTPException)):
+            return TransientSendException(str(exc))
+        if smtp_code is not None and 400 <= smtp_code < 500:
+            return TransientSendException(str(exc), smtp_code=smtp_code)
+        return PermanentSendException(str(exc), smtp_code=smtp_code)
+
+    def _transmit(self, pooled: PooledConnection, message, recipient: Optional[str]):
+        if isinstance(message, bytes):
+            # Message déjà sérialisé (PreparedMessage) : envoyé tel quel
+            pooled.conn.sendmail(pooled.params['smtp_user'], [recipient], message)
+        else:
+            pooled.conn.send_message(message)
 
+    def _send_pooled(self, pooled: PooledConnection, message, recipient: Optional[str] = None):
+        # Envoie sur une session du pool, dans les limites du throttle du relais ;
+        # si le serveur a fermé la session entre-temps, on la rouvre et on retente une fois
+        throttle = host_throttles.get(pooled.params['smtp_server'])
+        with throttle.slot():
+            try:
+                try:
+                    self._transmit(pooled, message, recipient)
+                except smtplib.SMTPServerDisconnected:
+                    logger.info("SMTP session dropped by server, reconnecting")
+                    smtp_pool.reconnect(pooled)
+                    self._transmit(pooled, message, recipient)
+            except Exception as exc:
+                error = self._classify_error(exc)
+                throttle.record_failure(error.smtp_code, isinstance(error, TransientSendException))
+                raise
+        throttle.record_success()
+
+    def test_connection(self, email_auth: AuthentificationSMTPSerializer):
+        # Utilisation de validated_data pour accéder aux données validées
+        email_data = email_auth.validated_data  # Accéder aux données validées
+        # Identifiants validés il y a moins de SMTP_PROBE_CACHE_TTL secondes : pas de nouvelle connexion
+        if cached_probe(email_data) is not None:
+            return
+        # La session ouverte pour le test reste dans le pool pour les envois suivants
+        pooled = self._acquire(email_data)
+        smtp_pool.release(pooled)
+        remember_probe(email_data)
+
+    def _build_message(self, smtp_auth, sender_name: str, recipient_mail: str, subject: str, body: str) -> MIMEMultipart:
         # Création du message avec plusieurs parties (HTML et texte brut)
         message = MIMEMultipart("alternative")  # Spécifie qu'il peut y avoir plusieurs formats
 
+        # Définir les entêtes de l'email
+        message["From"] = formataddr((sender_name, smtp_auth['smtp_user']))
+        message["To"] = recipient_mail
+        message["Subject"] = subject
+        message["Date"] = formatdate(localtime=True)
+        message["Message-ID"] = f"<{str(uuid.uuid4())}@{smtp_auth['smtp_server']}>"
+
+        # Ajouter la version HTML ou texte brut selon le cas
+        is_html, text_body = self._analyse_body(body)
+        if is_html:
+            # Si le corps est du HTML, ajouter d'abord la version texte brut puis la version HTML
+            message.attach(MIMEText(text_body, "plain"))  # Version texte brut
+            message.attach(MIMEText(body, "html"))  # Version HTML
+        else:
+            # Si le corps est du texte brut, on l'ajoute directement
+            message.attach(MIMEText(body, "plain"))
+        return message
+
+    def _suppress_bounces(self, recipients):
+        # Les rejets définitifs de boîte (550, 551, 553) ne seront plus retentés
         try:
-            # Définir les entêtes de l'email
-            message["From"] = formataddr((sender_name, username_mail))
-            message["To"] = recipient_mail
-            message["Subject"] = subject
-            message["Date"] = formatdate(localtime=True)
-            message["Message-ID"] = f"<{str(uuid.uuid4())}@{smtp_server}>"
-
-            # Ajouter la version HTML ou texte brut selon le cas
-            if self._is_html(body):
-                # Si le corps est du HTML, ajouter le contenu HTML
-                message.attach(MIMEText(body, "html"))  # Version HTML
-                #text_body = self._convert_html_to_text(body)  # Convertir le HTML en texte brut
-                #message.attach(MIMEText(text_body, "plain"))  # Ajouter aussi la version texte brut
-            else:
-                # Si le corps est du texte brut, on l'ajoute directement
-                message.attach(MIMEText(body, "plain"))
-
-            # Envoi de l'email via le serveur SMTP
-            with smtplib.SMTP(smtp_server, smtp_port) as server:
-                server.starttls()  # Sécurisation de la connexion avec TLS
-                server.login(username_mail, password_mail)  # Connexion au serveur SMTP
-                server.send_message(message)  # Envoyer le message
+            suppression_list.add(recipients, reason=Suppression.REASON_BOUNCE)
+        except Exception as exc:
+            logger.error(f"Failed to record bounced recipient(s) for reason: {exc}")
+
+    def _record_error(self, recipient: str, error: SendMailException, latency: Optional[float] = None,
+                      campaign_id: Optional[int] = None, template_id: Optional[int] = None, attempts: int = 1):
+        status = DeliveryRecord.STATUS_DEFERRED if isinstance(error, TransientSendException) else DeliveryRecord.STATUS_FAILED
+        delivery_log.record(recipient, status, smtp_code=error.smtp_code, latency=latency,
+                            campaign_id=campaign_id, template_id=template_id, attempts=attempts)
+
+    def send_mail(self, email_obj: EmailObjSerializer, attempts: int = 1):
+        """
+        Envoie un email ; le résultat est ajouté au journal des envois (DeliveryRecord).
+
+        :param attempts: Numéro de la tentative d'envoi de ce message, reporté dans le journal.
+        """
+        # Rafraîchie au plus toutes les SUPPRESSION_REFRESH_SECONDS : un worker de longue durée voit les nouvelles exclusions
+        suppression_list.refresh()
+        if suppression_list.is_suppressed(email_obj['recipient']):
+            logger.info(f"Recipient {email_obj['recipient']} is suppressed, mail not sent")
+            raise SuppressedRecipientException("Recipient is in the suppression list")
+        try:
+            message = self._build_message(
+                email_obj['smtp_auth'],
+                email_obj['sender'],
+                email_obj['recipient'],
+                email_obj['subject'],
+                email_obj['body']
+            )
+
+            # Envoi de l'email via une session SMTP du pool
+            started = None
+            with smtp_pool.connection(email_obj['smtp_auth']) as pooled:
+                started = time.monotonic()
+                self._send_pooled(pooled, message)  # Envoyer le message
+                latency = time.monotonic() - started
                 logger.info(f"Email sent successfully: {email_obj}")
 
         except Exception as exc:
             logger.error(f"Failed to send mail for reason: {exc}")
-            raise SendMailException
\ No newline at end of file
+            error = self._classify_error(exc)
+            if isinstance(error, PermanentSendException) and error.smtp_code in BOUNCE_CODES:
+                self._suppress_bounces([email_obj['recipient']])
+            latency = time.monotonic() - started if started is not None else None
+            self._record_error(email_obj['recipient'], error, latency=latency, attempts=attempts)
+            raise error
+        delivery_log.record(email_obj['recipient'], DeliveryRecord.STATUS_SENT, latency=latency, attempts=attempts)
+
+    def send_campaign(self, smtp_auth, sender_name: str, template: CompiledTemplate,
+                      recipients: Iterable[Tuple[str, Dict[str, Any]]], reconnect_every: Optional[int] = None,
+                      rate_limiter=None, report: Optional[Dict[str, Any]] = None,
+                      campaign_id: Optional[int] = None, template_id: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Envoie un template à une liste de destinataires en réutilisant
+        une seule session SMTP authentifiée, empruntée au pool.
+
+        La session est rouverte après `reconnect_every` messages (certains relais
+        limitent le nombre de messages par connexion) ou lorsque le serveur coupe
+        la connexion ; le message en cours est alors retenté une fois.
+
+        :param smtp_auth: Les paramètres SMTP validés.
+        :param template: Le template compilé, rendu pour chaque destinataire.
+        :param recipients: Un itérable de couples (adresse, variables), par exemple un itérateur de queryset.
+        :param rate_limiter: Un TokenBucket optionnel consulté avant chaque envoi.
+        :param report: Un résumé à compléter sur place (conserve les compteurs si l'envoi est interrompu).
+        :param campaign_id: La campagne et le template reportés dans le journal des envois.
+        :return: Un résumé {'sent', 'failed', 'deferred', 'suppressed', 'failures'}.
+        """
+        if reconnect_every is None:
+            reconnect_every = settings.SMTP_RECONNECT_EVERY
+
+        if report is None:
+            report = {}
+        report.setdefault('sent', 0)
+        report.setdefault('failed', 0)
+        report.setdefault('deferred', 0)
+        report.setdefault('suppressed', 0)
+        report.setdefault('failures', [])
+        bounced = []
+
+        def record_failure(recipient, exc, latency):
+            error = self._classify_error(exc)
+            self._record_error(recipient, error, latency=latency, campaign_id=campaign_id, template_id=template_id)
+            transient = isinstance(error, TransientSendException)
+            report['deferred' if transient else 'failed'] += 1
+            if not transient and error.smtp_code in BOUNCE_CODES:
+                bounced.append(recipient)
+            if len(report['failures']) < MAX_REPORTED_FAILURES:
+                report['failures'].append({
+                    'recipient': recipient,
+                    'smtp_code': error.smtp_code,
+                    'transient': transient,
+                    'reason': str(exc)
+                })
+            logger.warning(f"Failed to send campaign mail to {recipient} for reason: {exc}")
+
+        # Entêtes communs et corps encodés une seule fois pour toute la campagne ; les
+        # variables {{ nom }} du HTML se retrouvent telles quelles dans sa version texte
+        is_html, text_body = self._analyse_body(template.body)
+        text_template = CompiledTemplate(template.subject, text_body) if is_html else None
+        prepared = PreparedMessage(smtp_auth, sender_name, template, is_html=is_html, text_template=text_template)
+
+        # Liste d'exclusion consultée en mémoire : aucune requête par destinataire
+        suppression_list.refresh()
+        pooled = self._acquire(smtp_auth)
+        discard = False
+        sent_on_session = 0
+        try:
+            for recipient, variables in recipients:
+                if suppression_list.is_suppressed(recipient):
+                    report['suppressed'] += 1
+                    continue
+                message = prepared.render(recipient, {**variables, 'email': recipient})
+                if reconnect_every and sent_on_session >= reconnect_every:
+                    smtp_pool.reconnect(pooled)
+                    sent_on_session = 0
+                if rate_limiter is not None:
+                    rate_limiter.acquire()
+                started = time.monotonic()
+                try:
+                    self._send_pooled(pooled, message, recipient)
+                except smtplib.SMTPServerDisconnected:
+                    raise
+                except smtplib.SMTPException as exc:
+                    # Refus propre au destinataire : la session reste utilisable
+                    record_failure(recipient, exc, time.monotonic() - started)
+                    continue
+                delivery_log.record(recipient, DeliveryRecord.STATUS_SENT, latency=time.monotonic() - started,
+                                    campaign_id=campaign_id, template_id=template_id)
+                report['sent'] += 1
+                sent_on_session += 1
+        except Exception as exc:
+            discard = True
+            logger.error(f"Campaign sending aborted after {report['sent']} mail(s) for reason: {exc}")
+            raise SendMailException
+        finally:
+            smtp_pool.release(pooled, discard=discard)
+            if bounced:
+                self._suppress_bounces(bounced)
+
+        logger.info(f"Campaign sent: {report['sent']} sent, {report['deferred']} deferred, {report['failed']} failed, "
+                    f"{report['suppressed']} suppressed")
+        return report
+
+
+class AsyncMailer(Mailer):
+    """
+    Variante asyncio de Mailer, pour les vues asynchrones servies en ASGI et le
+    worker `send_outbox --async` (voir outbox.adeliver) : une conversation SMTP
+    lente n'occupe qu'une coroutine au lieu d'un thread, et un seul processus
+    peut en mener des centaines en parallèle vers des relais différents (voir aiosmtp.AsyncSMTP).
+
+    La construction des messages, le classement des erreurs, la liste
+    d'exclusion et le journal des envois sont ceux de Mailer ; les accès à la
+    base qu'ils peuvent déclencher passent par sync_to_async. Chaque envoi
+    ouvre sa propre session (le pool de sessions reste propre aux envois
+    synchrones), dans les limites de concurrence et de débit du throttle du
+    relais, partagées avec les envois synchrones (voir HostThrottle.aslot).
+    """
+
+    def __init__(self, timeout: Optional[float] = None):
+        super().__init__()
+        self.timeout = timeout or settings.SMTP_READ_TIMEOUT
+        self.connect_timeout = settings.SMTP_CONNECT_TIMEOUT
+
+    async def _open(self, smtp_auth):
+        try:
+            return await open_async_smtp(
+                smtp_auth, timeout=self.timeout, connect_timeout=self.connect_timeout, tls_context=shared_context()
+            )
+        except Exception as exc:
+            self._raise_connection_error(smtp_auth, exc)
+
+    async def test_connection(self, email_auth: AuthentificationSMTPSerializer):
+        email_data = email_auth.validated_data
+        if cached_probe(email_data) is not None:
+            return
+        server = await self._open(email_data)
+        await server.quit()
+        remember_probe(email_data)
+
+    async def send_message(self, smtp_auth, message, recipient: str):
+        """
+        Envoie un message déjà construit sur une session dédiée.
+        Lève l'exception SendMailException correspondant à la réponse du serveur.
+        """
+        throttle = host_throttles.get(smtp_auth['smtp_server'])
+        # Au plus SMTP_MAX_CONNECTIONS_PER_HOST sessions (moins après un 421/451) vers le relais
+        async with throttle.aslot():
+            try:
+                server = await open_async_smtp(
+                    smtp_auth, timeout=self.timeout, connect_timeout=self.connect_timeout, tls_context=shared_context()
+                )
+                try:
+                    await server.sendmail(smtp_auth['smtp_user'], [recipient], message)
+                finally:
+                    await server.quit()
+            except Exception as exc:
+                error = self._classify_error(exc)
+                throttle.record_failure(error.smtp_code, isinstance(error, TransientSendException))
+                raise error from exc
+            throttle.record_success()
+
+    async def send_mail(self, email_obj: EmailObjSerializer, attempts: int = 1):
+        """
+        Équivalent asynchrone de Mailer.send_mail.
+        """
+        await sync_to_async(suppression_list.refresh)()
+        if suppression_list.is_suppressed(email_obj['recipient']):
+            logger.info(f"Recipient {email_obj['recipient']} is suppressed, mail not sent")
+            raise SuppressedRecipientException("Recipient is in the suppression list")
+        message = self._build_message(
+            email_obj['smtp_auth'],
+            email_obj['sender'],
+            email_obj['recipient'],
+            email_obj['subject'],
+            email_obj['body']
+        )
+        started = time.monotonic()
+        try:
+            await self.send_message(email_obj['smtp_auth'], message, email_obj['recipient'])
+        except SendMailException as error:
+            logger.error(f"Failed to send mail for reason: {error}")
+            if isinstance(error, PermanentSendException) and error.smtp_code in BOUNCE_CODES:
+                await sync_to_async(self._suppress_bounces)([email_obj['recipient']])
+            await sync_to_async(self._record_error)(
+                email_obj['recipient'], error, latency=time.monotonic() - started, attempts=attempts
+            )
+            raise
+        logger.info(f"Email sent successfully: {email_obj}")
+        await sync_to_async(delivery_log.record)(
+            email_obj['recipient'], DeliveryRecord.STATUS_SENT, latency=time.monotonic() - started, attempts=attempts
+        )
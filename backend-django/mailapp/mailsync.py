@@ -0,0 +1,361 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from imaplib import IMAP4
+from typing import Any, Dict, List, Optional, Tuple
+from django.conf import settings
+from django.db import connections, transaction
+from django.contrib.postgres.search import SearchQuery, SearchVector
+from django.db.models import Value
+from django.db.models.functions import Coalesce, Greatest, Least, NullIf
+from .cache import LRUCache
+from .connections import imap_pool
+from .exceptions import ConnectionPoolTimeoutException
+from .mailbox import (fetch_message, fetch_summaries, folder_status, list_folders, parse_fetch_response,
+                      select_folder, with_imap_session)
+from .models import MailboxFolderState, MailboxMessage
+
+logger = logging.getLogger(__name__)
+
+# Messages complets déjà analysés, par (compte, dossier, UIDVALIDITY, UID)
+_parsed_messages = LRUCache(maxsize=settings.MAILBOX_MESSAGE_CACHE_SIZE)
+
+
+def account_key(imap_config: Dict[str, Any]) -> str:
+    """
+    Identifiant du compte IMAP dans le cache local (sans le mot de passe).
+    """
+    return f"{imap_config['username']}@{imap_config['imap_server']}:{imap_config['imap_port']}"
+
+
+def _insert(state: MailboxFolderState, summaries: List[Dict[str, Any]]):
+    """
+    Enregistre des résumés de messages et les indexe, sans toucher à
+    l'intervalle d'UID en cache. Sans `body_text` (résumés de la liste), le
+    corps sera récupéré et indexé plus tard par `index_bodies`.
+    """
+    MailboxMessage.objects.bulk_create([
+        MailboxMessage(
+            account=state.account,
+            folder=state.folder,
+            uidvalidity=state.uidvalidity,
+            uid=summary['uid'],
+            subject=summary['subject'],
+            sender=summary['sender'],
+            date=summary['date'] or '',
+            seen=summary['seen'],
+            preview=summary['body'],
+            body_text=summary.get('body_text'),
+        )
+        for summary in summaries
+    ], ignore_conflicts=True)
+    _index(state, [summary['uid'] for summary in summaries])
+
+
+def _store(state: MailboxFolderState, summaries: List[Dict[str, Any]]):
+    """
+    Enregistre des résumés de messages et élargit l'intervalle d'UID en cache.
+    """
+    summaries = [summary for summary in summaries if summary['uid']]
+    if not summaries:
+        return
+    _insert(state, summaries)
+    uids = [summary['uid'] for summary in summaries]
+    # Greatest/Least : deux synchronisations concurrentes ne peuvent pas réduire l'intervalle
+    MailboxFolderState.objects.filter(pk=state.pk).update(
+        highest_uid=Greatest('highest_uid', Value(max(uids))),
+        lowest_uid=Least(Coalesce(NullIf('lowest_uid', Value(0)), Value(min(uids))), Value(min(uids))),
+    )
+    state.highest_uid = max(state.highest_uid, max(uids))
+    state.lowest_uid = min(state.lowest_uid, min(uids)) if state.lowest_uid else min(uids)
+
+
+def _index(state: MailboxFolderState, uids: Optional[List[int]] = None):
+    """
+    Calcule l'index plein texte des messages qui n'en ont pas encore (ceux de
+    `uids`, ou tout le dossier) : l'index est tenu à jour au fil des synchronisations.
+    Tant que le corps n'a pas été récupéré, l'aperçu est indexé à sa place.
+    """
+    config = settings.MAILBOX_SEARCH_CONFIG
+    queryset = MailboxMessage.objects.filter(
+        account=state.account, folder=state.folder, uidvalidity=state.uidvalidity, search_vector__isnull=True
+    )
+    if uids is not None:
+        queryset = queryset.filter(uid__in=uids)
+    queryset.update(search_vector=(
+        SearchVector('subject', weight='A', config=config)
+        + SearchVector('sender', weight='B', config=config)
+        + SearchVector(Coalesce('body_text', 'preview'), weight='C', config=config)
+    ))
+
+
+def sync_folder(imap_server: IMAP4, account: str, folder: str = 'INBOX') -> MailboxFolderState:
+    """
+    Sélectionne le dossier et met en cache les messages arrivés depuis la
+    dernière synchronisation : seuls les UID supérieurs au plus haut UID connu
+    sont demandés au serveur.
+
+    À la première synchronisation (ou si l'UIDVALIDITY a changé, ce qui invalide
+    tous les UID), seuls les MAILBOX_INITIAL_SYNC messages les plus récents sont
+    récupérés ; les plus anciens le sont à la demande par `backfill`.
+    """
+    message_count, uidvalidity, uidnext = select_folder(imap_server, folder)
+    state = MailboxFolderState.objects.filter(account=account, folder=folder).first()
+    if state is not None and state.uidvalidity != uidvalidity:
+        logger.info(f"UIDVALIDITY changed for {account} {folder}, dropping cached messages")
+        with transaction.atomic():
+            MailboxMessage.objects.filter(account=account, folder=folder).delete()
+            state.delete()
+        state = None
+
+    if state is None:
+        state, _ = MailboxFolderState.objects.get_or_create(
+            account=account, folder=folder, defaults={'uidvalidity': uidvalidity}
+        )
+        if not message_count:
+            state.complete = True
+            state.save(update_fields=['complete'])
+            return state
+        first = max(1, message_count - settings.MAILBOX_INITIAL_SYNC + 1)
+        _store(state, fetch_summaries(imap_server, f'{first}:{message_count}', ))
+        if first == 1:
+            state.complete = True
+            state.save(update_fields=['complete'])
+        return state
+
+    # UIDNEXT annoncé par SELECT : rien de nouveau, pas de FETCH
+    if not message_count or (uidnext is not None and uidnext <= state.highest_uid + 1):
+        return state
+    # "n:*" renvoie toujours au moins le dernier message, même si son UID est inférieur à n
+    summaries = fetch_summaries(imap_server, f'{state.highest_uid + 1}:*', uid=True)
+    _store(state, [summary for summary in summaries if summary['uid'] > state.highest_uid])
+    return state
+
+
+def backfill(imap_server: IMAP4, state: MailboxFolderState, count: int):
+    """
+    Met en cache jusqu'à `count` messages plus anciens que le plus bas UID connu.
+    Le dossier doit être sélectionné.
+    """
+    if state.complete:
+        return
+    if state.lowest_uid <= 1:
+        older = []
+    else:
+        result, data = imap_server.uid('SEARCH', None, f'UID 1:{state.lowest_uid - 1}')
+        if result != 'OK':
+            raise IMAP4.error(f"UID SEARCH failed: {data}")
+        older = [int(uid) for uid in data[0].split() if int(uid) < state.lowest_uid]
+    batch = older[-count:]
+    if batch:
+        _store(state, fetch_summaries(imap_server, ','.join(map(str, batch)), uid=True))
+    if len(batch) == len(older):
+        state.complete = True
+        MailboxFolderState.objects.filter(pk=state.pk).update(complete=True)
+
+
+def refresh_flags(imap_server: IMAP4, state: MailboxFolderState, messages: List[MailboxMessage]) -> bool:
+    """
+    Relit les drapeaux des messages d'une page (une seule commande FETCH) :
+    met à jour l'état lu/non lu et retire du cache les messages supprimés.
+
+    :return: True si des messages ont été supprimés du cache.
+    """
+    if not messages:
+        return False
+    result, data = imap_server.uid('FETCH', ','.join(str(message.uid) for message in messages), '(UID FLAGS)')
+    if result != 'OK':
+        raise IMAP4.error(f"FETCH failed: {data}")
+    flags = {fetched['uid']: '\\Seen' in fetched['flags'] for fetched in parse_fetch_response(data).values()}
+    changed = [message for message in messages if message.uid in flags and message.seen != flags[message.uid]]
+    for message in changed:
+        message.seen = flags[message.uid]
+    if changed:
+        MailboxMessage.objects.bulk_update(changed, ['seen'])
+    expunged = [message.uid for message in messages if message.uid not in flags]
+    if expunged:
+        MailboxMessage.objects.filter(
+            account=state.account, folder=state.folder, uidvalidity=state.uidvalidity, uid__in=expunged
+        ).delete()
+    return bool(expunged)
+
+
+def index_bodies(imap_server: IMAP4, state: MailboxFolderState, count: int) -> int:
+    """
+    Récupère le texte du corps (MAILBOX_SEARCH_BODY_BYTES premiers octets) de
+    jusqu'à `count` messages en cache qui ne l'ont pas encore, les plus récents
+    d'abord, et recalcule leur index. Le dossier doit être sélectionné.
+
+    La synchronisation de la liste ne récupère que l'aperçu : les corps ne sont
+    transférés que lorsque le dossier est cherché, par lots, à chaque recherche.
+
+    :return: Le nombre de messages indexés.
+    """
+    messages = MailboxMessage.objects.filter(
+        account=state.account, folder=state.folder, uidvalidity=state.uidvalidity, body_text__isnull=True
+    )
+    uids = list(messages.order_by('-uid').values_list('uid', flat=True)[:count])
+    if not uids:
+        return 0
+    texts = {
+        summary['uid']: summary['body_text']
+        for summary in fetch_summaries(imap_server, ','.join(map(str, uids)), uid=True, with_text=True)
+    }
+    # Message supprimé entre-temps sur le serveur : corps vide, il n'est pas redemandé
+    indexed = [
+        MailboxMessage(pk=pk, body_text=texts.get(uid, ''), search_vector=None)
+        for pk, uid in messages.filter(uid__in=uids).values_list('pk', 'uid')
+    ]
+    MailboxMessage.objects.bulk_update(indexed, ['body_text', 'search_vector'])
+    _index(state, uids)
+    return len(indexed)
+
+
+def _page(state: MailboxFolderState, cursor: Optional[int], limit: int) -> List[MailboxMessage]:
+    queryset = MailboxMessage.objects.filter(
+        account=state.account, folder=state.folder, uidvalidity=state.uidvalidity
+    )
+    if not state.complete and state.lowest_uid:
+        # Messages plus anciens mis en cache par une recherche : hors de l'intervalle continu, pas listés
+        queryset = queryset.filter(uid__gte=state.lowest_uid)
+    if cursor is not None:
+        queryset = queryset.filter(uid__lt=cursor)
+    return list(queryset.defer('search_vector', 'body_text').order_by('-uid')[:limit + 1])
+
+
+def list_messages(imap_server: IMAP4, account: str, folder: str = 'INBOX',
+                  cursor: Optional[int] = None, limit: Optional[int] = None) -> Tuple[List[MailboxMessage], Optional[int]]:
+    """
+    Synchronise le dossier puis sert une page de messages depuis le cache,
+    du plus récent au plus ancien.
+
+    :param cursor: UID à partir duquel (exclu) lister les messages plus anciens.
+    :return: Le tuple (messages, curseur de la page suivante ou None).
+    """
+    limit = limit or settings.MAILBOX_PAGE_SIZE
+    state = sync_folder(imap_server, account, folder)
+    messages = _page(state, cursor, limit)
+    if len(messages) <= limit and not state.complete:
+        backfill(imap_server, state, max(limit + 1 - len(messages), settings.MAILBOX_PAGE_SIZE))
+        messages = _page(state, cursor, limit)
+    if refresh_flags(imap_server, state, messages[:limit]):
+        # Des messages de la page ont été supprimés sur le serveur
+        messages = _page(state, cursor, limit)
+        refresh_flags(imap_server, state, messages[:limit])
+    next_cursor = messages[limit - 1].uid if len(messages) > limit else None
+    messages = messages[:limit]
+    return messages, next_cursor
+
+
+def _imap_search_older(imap_server: IMAP4, state: MailboxFolderState, query: str) -> List[int]:
+    """
+    Recherche côté serveur (UID SEARCH TEXT) parmi les messages plus anciens que le cache.
+    """
+    if state.complete or state.lowest_uid <= 1:
+        return []
+    criteria = f'UID 1:{state.lowest_uid - 1}'
+    if query.isascii():
+        quoted = '"' + query.replace('\\', '\\\\').replace('"', '\\"') + '"'
+        result, data = imap_server.uid('SEARCH', None, criteria, 'TEXT', quoted)
+    else:
+        # Texte non ASCII : envoyé en littéral UTF-8, à la fin de la commande
+        imap_server.literal = query.encode('utf-8')
+        result, data = imap_server.uid('SEARCH', 'CHARSET', 'UTF-8', criteria, 'TEXT')
+    if result != 'OK':
+        raise IMAP4.error(f"UID SEARCH failed: {data}")
+    return [int(uid) for uid in data[0].split() if int(uid) < state.lowest_uid]
+
+
+def search_messages(imap_server: IMAP4, account: str, query: str, folder: str = 'INBOX',
+                    limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Recherche plein texte dans un dossier, du plus récent au plus ancien.
+
+    Les messages en cache sont cherchés dans l'index Postgres (GIN), qui couvre
+    les MAILBOX_SEARCH_BODY_BYTES premiers octets du corps. Chaque recherche
+    commence par indexer le corps de MAILBOX_SEARCH_INDEX_BATCH messages qui ne
+    l'ont pas encore été (voir index_bodies) ; les autres ne sont cherchés que
+    sur leur sujet, leur expéditeur et leur aperçu. Si la page n'est pas
+    remplie et que des messages plus anciens ne sont pas en cache, la recherche
+    est complétée par un UID SEARCH sur le serveur IMAP ; les messages trouvés
+    sont ajoutés au cache et à l'index, sans être listés par list_messages tant
+    que `backfill` ne les a pas atteints.
+    """
+    limit = limit or settings.MAILBOX_PAGE_SIZE
+    state = sync_folder(imap_server, account, folder)
+    index_bodies(imap_server, state, settings.MAILBOX_SEARCH_INDEX_BATCH)
+    matches = MailboxMessage.objects.filter(
+        account=account, folder=folder, uidvalidity=state.uidvalidity,
+        search_vector=SearchQuery(query, search_type='websearch', config=settings.MAILBOX_SEARCH_CONFIG),
+    ).defer('search_vector', 'body_text').order_by('-uid')[:limit]
+    results = [message.to_dict() for message in matches]
+    if len(results) < limit:
+        found = {result['uid'] for result in results}
+        older = [uid for uid in _imap_search_older(imap_server, state, query) if uid not in found]
+        older = older[-(limit - len(results)):]
+        if older:
+            summaries = fetch_summaries(imap_server, ','.join(map(str, older)), uid=True, with_text=True)
+            _insert(state, [summary for summary in summaries if summary['uid']])
+            for summary in reversed(summaries):
+                summary['id'] = str(summary['uid'])
+                del summary['body_text']
+                results.append(summary)
+    return results
+
+
+def get_message(imap_server: IMAP4, account: str, uid: int, folder: str = 'INBOX') -> Dict[str, Any]:
+    """
+    Retourne le contenu d'un message, depuis le cache mémoire si possible : un
+    UID n'identifie un message de façon stable que pour une UIDVALIDITY donnée.
+    """
+    _, uidvalidity, _ = select_folder(imap_server, folder)
+    key = (account, folder, uidvalidity, uid)
+    message = _parsed_messages.get(key)
+    if message is None:
+        message = fetch_message(imap_server, uid)
+        _parsed_messages.set(key, message)
+    return message
+
+
+def _folder_overview(imap_config: Dict[str, Any], folder: str, limit: int) -> Dict[str, Any]:
+    # Exécuté dans un thread du pool : sa propre session IMAP et sa propre connexion base de données
+    try:
+        def operation(imap_server):
+            counts = folder_status(imap_server, folder)
+            messages, next_cursor = list_messages(imap_server, account_key(imap_config), folder, None, limit)
+            return {
+                'name': folder,
+                **counts,
+                'emails': [message.to_dict() for message in messages],
+                'next_cursor': next_cursor,
+            }
+        return with_imap_session(imap_config, operation)
+    except IMAP4.error as exc:
+        logger.error(f"IMAP error on folder {folder}: {exc}")
+        return {'name': folder, 'error': str(exc)}
+    except (OSError, ConnectionPoolTimeoutException) as exc:
+        # Serveur injoignable, délai dépassé ou pool saturé : seul ce dossier est signalé indisponible
+        logger.error(f"IMAP connection failed on folder {folder}: {exc!r}")
+        return {'name': folder, 'error': str(exc) or exc.__class__.__name__}
+    finally:
+        connections.close_all()
+
+
+def folders_overview(imap_config: Dict[str, Any], folders: Optional[List[str]] = None,
+                     limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Synchronise et liste plusieurs dossiers en parallèle, avec leurs compteurs
+    (messages, non lus) lus par STATUS.
+
+    Une session IMAP ne sélectionne qu'un dossier à la fois : chaque dossier est
+    traité par un thread avec sa propre session du pool, au plus
+    IMAP_POOL_MAX_SIZE à la fois. La durée totale est donc celle du dossier le
+    plus lent plutôt que la somme. Sans liste, tous les dossiers du compte (LIST).
+    """
+    limit = limit or settings.MAILBOX_PAGE_SIZE
+    if not folders:
+        folders = with_imap_session(imap_config, list_folders)
+    if not folders:
+        return []
+    workers = min(len(folders), imap_pool.max_size)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='mailbox-folders') as executor:
+        return list(executor.map(lambda folder: _folder_overview(imap_config, folder, limit), folders))
@@ -0,0 +1,152 @@
+import asyncio
+import multiprocessing
+import resource
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from mailapp.connections import open_smtp
+from mailapp.mailer import AsyncMailer
+from mailapp.throttle import host_throttles
+
+
+class FakeSMTPServer:
+    """
+    Serveurs SMTP locaux qui acceptent tout, chaque réponse étant retardée de
+    `latency` secondes pour simuler des relais lents. Chaque relais écoute sur
+    sa propre adresse de loopback (127.0.0.1, 127.0.0.2...) : les envois sont
+    donc régulés par un throttle par relais, comme en production. Tourne dans
+    un processus séparé pour ne pas disputer le GIL aux clients mesurés.
+    """
+
+    def __init__(self, latency: float, hosts: int):
+        self.latency = latency
+        self.hosts = [f'127.0.0.{index + 1}' for index in range(hosts)]
+        self.ports = {}
+        self._received = multiprocessing.Value('i', 0)
+        self._process = None
+
+    @property
+    def received(self) -> int:
+        return self._received.value
+
+    async def _reply(self, writer, line: bytes):
+        await asyncio.sleep(self.latency)
+        writer.write(line)
+        await writer.drain()
+
+    async def _handle(self, reader, writer):
+        try:
+            await self._reply(writer, b'220 bench ESMTP\r\n')
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command = line[:4].upper()
+                if command == b'EHLO':
+                    await self._reply(writer, b'250-bench\r\n250 AUTH PLAIN LOGIN\r\n')
+                elif command == b'AUTH':
+                    await self._reply(writer, b'235 Authentication successful\r\n')
+                elif command == b'DATA':
+                    await self._reply(writer, b'354 End data with <CR><LF>.<CR><LF>\r\n')
+                    while (await reader.readline()) not in (b'.\r\n', b''):
+                        pass
+                    with self._received.get_lock():
+                        self._received.value += 1
+                    await self._reply(writer, b'250 Queued\r\n')
+                elif command == b'QUIT':
+                    await self._reply(writer, b'221 Bye\r\n')
+                    break
+                else:
+                    await self._reply(writer, b'250 OK\r\n')
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _serve(self, ports):
+        server = await asyncio.start_server(self._handle, self.hosts, 0, backlog=4096)
+        ports.put(dict(sock.getsockname()[:2] for sock in server.sockets))
+        await server.serve_forever()
+
+    def _run(self, ports):
+        asyncio.run(self._serve(ports))
+
+    def start(self):
+        ports = multiprocessing.Queue()
+        self._process = multiprocessing.Process(target=self._run, args=(ports,), daemon=True)
+        self._process.start()
+        self.ports = ports.get()
+
+    def stop(self):
+        self._process.terminate()
+
+
+class Command(BaseCommand):
+    help = ("Compare les envois SMTP synchrones (smtplib, un thread par conversation) et asynchrones "
+            "(client asyncio, un seul thread) vers plusieurs relais locaux lents, dans les mêmes limites "
+            "par relais (SMTP_MAX_CONNECTIONS_PER_HOST, SMTP_HOST_MAX_RATE) que send_outbox.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=4000, help="Nombre d'emails envoyés par chaque mode")
+        parser.add_argument('--hosts', type=int, default=50, help="Nombre de relais SMTP simulés")
+        parser.add_argument('--latency', type=float, default=0.05,
+                            help="Délai (secondes) avant chaque réponse du serveur")
+
+    def _report(self, mode: str, count: int, elapsed: float, extra: str = ''):
+        self.stdout.write(
+            f"{mode:<6} {count} sent in {elapsed:.2f}s ({count / elapsed:.0f} mail/s), "
+            f"max RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024} MB{extra}"
+        )
+
+    def handle(self, *args, **options):
+        server = FakeSMTPServer(options['latency'], options['hosts'])
+        server.start()
+        accounts = [
+            {'smtp_server': host, 'smtp_port': port, 'smtp_user': 'bench@example.com', 'smtp_passwd': 'bench',
+             'is_tls': False}
+            for host, port in server.ports.items()
+        ]
+        mailer = AsyncMailer()
+        count = options['messages']
+        messages = []
+        for index in range(count):
+            smtp_auth = accounts[index % len(accounts)]
+            recipient = f'user{index}@example.com'
+            messages.append((smtp_auth, recipient,
+                             mailer._build_message(smtp_auth, 'Bench', recipient, 'Benchmark', '<p>Hello</p>')))
+        # Autant de threads que de conversations possibles : le mode synchrone n'est pas bridé par son pool
+        threads = len(accounts) * settings.SMTP_MAX_CONNECTIONS_PER_HOST
+        self.stdout.write(
+            f"{count} messages to {len(accounts)} relays, at most {settings.SMTP_MAX_CONNECTIONS_PER_HOST} "
+            f"sessions and {settings.SMTP_HOST_MAX_RATE:g} mail/s per relay, "
+            f"{options['latency'] * 1000:.0f} ms per server reply"
+        )
+
+        # Mode asynchrone mesuré en premier : le RSS maximum ne fait que croître
+        async def send_async():
+            await asyncio.gather(*(
+                mailer.send_message(smtp_auth, message, recipient) for smtp_auth, recipient, message in messages
+            ))
+
+        started = time.monotonic()
+        asyncio.run(send_async())
+        self._report('async', count, time.monotonic() - started, ', 1 thread')
+
+        def send_sync(item):
+            smtp_auth, recipient, message = item
+            with host_throttles.get(smtp_auth['smtp_server']).slot():
+                session = open_smtp(smtp_auth)
+                try:
+                    session.sendmail(smtp_auth['smtp_user'], [recipient], message.as_bytes())
+                finally:
+                    session.quit()
+
+        # Seaux de jetons pleins pour le second mode
+        host_throttles.clear()
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            list(executor.map(send_sync, messages))
+        self._report('sync', count, time.monotonic() - started, f', {threads} threads')
+        self.stdout.write(f"Server received {server.received} message(s)")
+        server.stop()
@@ -0,0 +1,62 @@
+import asyncio
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from mailapp.outbox import aprocess_batch, process_batch, requeue_dead
+
+
+class Command(BaseCommand):
+    help = "Envoie les emails de la file d'envoi (outbox). Plusieurs workers peuvent tourner en parallèle."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help="Nombre d'emails réservés par lot (OUTBOX_BATCH_SIZE, OUTBOX_ASYNC_BATCH_SIZE avec --async)")
+        parser.add_argument('--poll-interval', type=float, default=settings.OUTBOX_POLL_INTERVAL,
+                            help="Attente (secondes) quand la file est vide")
+        parser.add_argument('--once', action='store_true',
+                            help="Vide la file puis s'arrête au lieu de rester en attente")
+        parser.add_argument('--requeue-dead', action='store_true',
+                            help="Remet en file les emails abandonnés après OUTBOX_MAX_ATTEMPTS tentatives")
+        parser.add_argument('--async', action='store_true', dest='use_async',
+                            help="Envoie chaque lot en parallèle avec le client SMTP asyncio (un seul thread)")
+
+    def _write_report(self, report):
+        self.stdout.write(f"{report['claimed']} claimed, {report['sent']} sent, {report['failed']} failed, "
+                          f"{report['retried']} retried, {report['dead']} dead")
+
+    def _run(self, batch_size: int, options):
+        while True:
+            report = process_batch(batch_size)
+            if report['claimed']:
+                self._write_report(report)
+                continue
+            if options['once']:
+                break
+            time.sleep(options['poll_interval'])
+
+    async def _arun(self, batch_size: int, options):
+        while True:
+            report = await aprocess_batch(batch_size)
+            if report['claimed']:
+                self._write_report(report)
+                continue
+            if options['once']:
+                break
+            await asyncio.sleep(options['poll_interval'])
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size is None:
+            batch_size = settings.OUTBOX_ASYNC_BATCH_SIZE if options['use_async'] else settings.OUTBOX_BATCH_SIZE
+        if options['requeue_dead']:
+            self.stdout.write(f"{requeue_dead()} dead email(s) requeued")
+        mode = 'async' if options['use_async'] else 'sync'
+        self.stdout.write(f"Outbox worker started (batch size {batch_size}, {mode})")
+        try:
+            if options['use_async']:
+                asyncio.run(self._arun(batch_size, options))
+            else:
+                self._run(batch_size, options)
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write("Outbox worker stopped")
@@ -0,0 +1,275 @@
+import csv
+import io
+import json
+import logging
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+from django.conf import settings
+from django.db import connection, transaction
+from .exceptions import InvalidTargetsException
+from .models import Mail
+from .validation import normalize_email, filter_valid
+
+logger = logging.getLogger(__name__)
+
+# Nombre d'exemples de lignes invalides renvoyés dans le rapport
+MAX_REPORTED_INVALID = 20
+
+_STAGING_TABLE = 'mailapp_mail_import'
+_DELIMITERS = (',', ';', '\t')
+
+
+def _decode_lines(lines: Iterable[bytes]) -> Iterator[str]:
+    # Lignes du corps de requête, décodées une à une (BOM UTF-8 éventuel retiré)
+    first = True
+    for line in lines:
+        text = line.decode('utf-8', errors='replace')
+        if first:
+            text = text.lstrip('\ufeff')
+            first = False
+        yield text
+
+
+def _chain(first: str, rest: Iterator[str]) -> Iterator[str]:
+    yield first
+    yield from rest
+
+
+def parse_recipients(lines: Iterable[bytes]) -> Iterator[Tuple[Optional[str], Dict[str, Any], str]]:
+    """
+    Lit un fichier de destinataires ligne par ligne, sans le charger en mémoire.
+
+    Formats acceptés : une adresse par ligne, ou un CSV (séparateur , ; ou
+    tabulation) dont l'entête contient une colonne `email` ; les autres colonnes
+    deviennent les variables de template du destinataire. Un CSV sans entête
+    `email` est lu en prenant la première colonne.
+
+    :return: Un itérateur de (adresse normalisée ou None si invalide, variables, ligne brute).
+    """
+    text_lines = _decode_lines(lines)
+    header_line = next((line for line in text_lines if line.strip()), None)
+    if header_line is None:
+        return
+    delimiter = next((candidate for candidate in _DELIMITERS if candidate in header_line), None)
+    if delimiter is None:
+        rows = ([line.strip()] for line in _chain(header_line, text_lines))
+        columns = None
+    else:
+        header = next(csv.reader([header_line], delimiter=delimiter))
+        lowered = [column.strip().lower() for column in header]
+        if 'email' in lowered:
+            columns = [column.strip() for column in header]
+            email_index = lowered.index('email')
+            rows = csv.reader(text_lines, delimiter=delimiter)
+        else:
+            columns = None
+            rows = csv.reader(_chain(header_line, text_lines), delimiter=delimiter)
+
+    for row in rows:
+        if not row or not any(cell.strip() for cell in row):
+            continue
+        if columns is None:
+            yield normalize_email(row[0]), {}, row[0]
+            continue
+        raw = row[email_index] if email_index < len(row) else ''
+        variables = {
+            column: value for column, value in zip(columns, row)
+            if column and column.lower() != 'email' and value != ''
+        }
+        yield normalize_email(raw), variables, raw
+
+
+def _copy_escape(value: str) -> str:
+    # Format texte de COPY : antislash, tabulation et fins de ligne échappés
+    return (value.replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+def _copy_into_staging(cursor, buffer: io.StringIO):
+    """
+    Charge un paquet de lignes dans la table temporaire avec COPY FROM STDIN
+    (psycopg2 : copy_expert, psycopg 3 : cursor.copy).
+    """
+    buffer.seek(0)
+    sql = f'COPY {_STAGING_TABLE} (email, variables) FROM STDIN'
+    raw_cursor = cursor.cursor
+    if hasattr(raw_cursor, 'copy_expert'):
+        raw_cursor.copy_expert(sql, buffer)
+    else:
+        with raw_cursor.copy(sql) as copy:
+            copy.write(buffer.getvalue())
+
+
+def _flush(cursor, campaign_id: int, pending: List[Tuple[str, str]], report: Dict[str, Any]):
+    """
+    Insère le paquet en attente dans la table Mail, en écartant les adresses dont
+    le domaine n'existe pas et en ignorant celles déjà présentes dans la campagne
+    ou dans le paquet. Met à jour le rapport d'import.
+    """
+    _, rejected = filter_valid({email for email, _ in pending})
+    if rejected:
+        rejected = set(rejected)
+        kept = [row for row in pending if row[0] not in rejected]
+        report['invalid'] += len(pending) - len(kept)
+        samples = report['invalid_samples']
+        samples.extend(sorted(rejected)[:MAX_REPORTED_INVALID - len(samples)])
+        pending = kept
+    buffer = io.StringIO()
+    for email, variables in pending:
+        buffer.write(_copy_escape(email) + '\t' + _copy_escape(variables) + '\n')
+    _copy_into_staging(cursor, buffer)
+    table = Mail._meta.db_table
+    cursor.execute(
+        f'INSERT INTO {table} (campaign_id, email, variables, added_at) '
+        f'SELECT DISTINCT ON (email) %s, email, variables, now() FROM {_STAGING_TABLE} '
+        f'ON CONFLICT (campaign_id, email) DO NOTHING',
+        [campaign_id]
+    )
+    inserted = cursor.rowcount
+    cursor.execute(f'TRUNCATE {_STAGING_TABLE}')
+    report['accepted'] += inserted
+    report['duplicates'] += len(pending) - inserted
+
+
+def import_recipients(campaign_id: int, lines: Iterable[bytes], chunk_size: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Importe en flux les destinataires d'une campagne.
+
+    Les lignes sont validées et normalisées au fil de la lecture, puis chargées
+    par paquets de `chunk_size` via COPY dans une table temporaire, d'où un
+    INSERT ... ON CONFLICT DO NOTHING les ajoute à la campagne : un doublon ne
+    fait plus échouer l'import, et la mémoire utilisée ne dépend que de la taille
+    d'un paquet. Les domaines de chaque paquet sont vérifiés une seule fois
+    (voir validation.filter_valid). L'import est atomique.
+
+    :return: Le rapport {'accepted', 'duplicates', 'invalid', 'invalid_samples'}.
+    """
+    chunk_size = chunk_size or settings.CAMPAIGN_IMPORT_CHUNK_SIZE
+    report: Dict[str, Any] = {'accepted': 0, 'duplicates': 0, 'invalid': 0, 'invalid_samples': []}
+    invalid_samples: List[str] = report['invalid_samples']
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f'CREATE TEMPORARY TABLE IF NOT EXISTS {_STAGING_TABLE} '
+            f'(email varchar(255), variables jsonb) ON COMMIT DROP'
+        )
+        pending: List[Tuple[str, str]] = []
+        for email, variables, raw in parse_recipients(lines):
+            if email is None:
+                report['invalid'] += 1
+                if len(invalid_samples) < MAX_REPORTED_INVALID:
+                    invalid_samples.append(raw.strip()[:255])
+                continue
+            pending.append((email, json.dumps(variables)))
+            if len(pending) >= chunk_size:
+                _flush(cursor, campaign_id, pending, report)
+                pending = []
+        if pending:
+            _flush(cursor, campaign_id, pending, report)
+
+    logger.info(f"Imported recipients into campaign {campaign_id}: {report['accepted']} accepted, "
+                f"{report['duplicates']} duplicates, {report['invalid']} invalid")
+    return report
+
+
+def normalize_targets(targets: Iterable[Any], check_domains: bool = True) -> Tuple[Dict[str, Dict[str, Any]], List[str]]:
+    """
+    Normalise une liste de cibles (adresses ou objets {"email": ..., <variable>: ...}).
+    Avec `check_domains`, les adresses dont le domaine n'existe pas sont aussi invalides.
+
+    :return: Le tuple ({adresse: variables}, adresses invalides).
+    """
+    valid: Dict[str, Dict[str, Any]] = {}
+    invalid: List[str] = []
+    for target in targets:
+        if isinstance(target, dict):
+            variables = {key: value for key, value in target.items() if key != 'email'}
+            raw = str(target.get('email', ''))
+        else:
+            variables, raw = {}, str(target)
+        email = normalize_email(raw)
+        if email is None:
+            invalid.append(raw)
+        else:
+            valid[email] = variables
+    if check_domains and valid:
+        _, rejected = filter_valid(valid)
+        for email in rejected:
+            del valid[email]
+        invalid.extend(rejected)
+    return valid, invalid
+
+
+def _chunks(items: List[Any], size: int) -> Iterator[List[Any]]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _insert_members(cursor, campaign_id: int, members: Dict[str, Dict[str, Any]]) -> int:
+    # INSERT ensembliste depuis deux tableaux (unnest), les adresses déjà présentes sont ignorées
+    table = Mail._meta.db_table
+    inserted = 0
+    for chunk in _chunks(list(members.items()), settings.CAMPAIGN_IMPORT_CHUNK_SIZE):
+        cursor.execute(
+            f'INSERT INTO {table} (campaign_id, email, variables, added_at) '
+            f'SELECT %s, email, variables::jsonb, now() FROM unnest(%s::varchar[], %s::text[]) AS t(email, variables) '
+            f'ON CONFLICT (campaign_id, email) DO NOTHING',
+            [campaign_id, [email for email, _ in chunk], [json.dumps(variables) for _, variables in chunk]]
+        )
+        inserted += cursor.rowcount
+    return inserted
+
+
+def apply_membership_delta(campaign_id: int, add: Iterable[Any] = (), remove: Iterable[Any] = ()) -> Dict[str, Any]:
+    """
+    Ajoute et retire des emails cibles d'une campagne en SQL ensembliste
+    (DELETE ... = ANY, INSERT ... ON CONFLICT DO NOTHING), sans charger les
+    membres existants : le coût dépend de la taille du changement, pas de la liste.
+    Les suppressions sont appliquées avant les ajouts.
+
+    :return: Le rapport {'added', 'removed', 'invalid'}.
+    """
+    to_add, invalid = normalize_targets(add)
+    to_remove, invalid_removed = normalize_targets(remove, check_domains=False)
+    table = Mail._meta.db_table
+    removed = 0
+    with transaction.atomic(), connection.cursor() as cursor:
+        for chunk in _chunks(list(to_remove), settings.CAMPAIGN_IMPORT_CHUNK_SIZE):
+            cursor.execute(
+                f'DELETE FROM {table} WHERE campaign_id = %s AND email = ANY(%s::varchar[])',
+                [campaign_id, chunk]
+            )
+            removed += cursor.rowcount
+        added = _insert_members(cursor, campaign_id, to_add)
+    return {'added': added, 'removed': removed, 'invalid': invalid + invalid_removed}
+
+
+def replace_members(campaign_id: int, targets: Iterable[Any]) -> Dict[str, Any]:
+    """
+    Remplace la liste complète des emails cibles d'une campagne : les absents de
+    `targets` sont supprimés, les nouveaux insérés, les autres laissés en place.
+
+    Une liste vide ou sans aucune adresse valide lève InvalidTargetsException
+    sans rien supprimer : vider une campagne passe par apply_membership_delta.
+
+    Seule la syntaxe décide des membres gardés : un domaine jugé inexistant
+    (réponse DNS erronée, résolveur mal configuré) empêche l'ajout d'une
+    adresse, jamais la suppression d'un membre existant.
+
+    :return: Le rapport {'added', 'removed', 'invalid'}.
+    """
+    members, invalid = normalize_targets(targets, check_domains=False)
+    if not members:
+        raise InvalidTargetsException(invalid)
+    _, rejected = filter_valid(members)
+    invalid.extend(rejected)
+    rejected = set(rejected)
+    insertable = {email: variables for email, variables in members.items() if email not in rejected}
+    table = Mail._meta.db_table
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {table} WHERE campaign_id = %s AND NOT (email = ANY(%s::varchar[]))',
+            [campaign_id, list(members)]
+        )
+        removed = cursor.rowcount
+        added = _insert_members(cursor, campaign_id, insertable)
+    return {'added': added, 'removed': removed, 'invalid': invalid}
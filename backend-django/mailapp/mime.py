@@ -0,0 +1,101 @@
+import time
+import uuid
+from email.base64mime import body_encode
+from email.header import Header
+from email.utils import formataddr, formatdate
+from typing import Any, Dict, List, Optional
+from .templating import CompiledTemplate
+
+CRLF = b'\r\n'
+
+
+def encode_header(value: str) -> bytes:
+    """
+    Encode (RFC 2047 si nécessaire) et replie une valeur d'entête.
+    """
+    charset = 'us-ascii' if value.isascii() else 'utf-8'
+    return Header(value, charset=charset).encode(linesep='\r\n').encode('ascii')
+
+
+def encode_part(text: str, subtype: str) -> bytes:
+    """
+    Sérialise une partie text/<subtype> en UTF-8 encodé en base64, entêtes compris.
+    """
+    return (
+        b'Content-Type: text/' + subtype.encode('ascii') + b'; charset="utf-8"' + CRLF
+        + b'MIME-Version: 1.0' + CRLF
+        + b'Content-Transfer-Encoding: base64' + CRLF
+        + CRLF
+        + body_encode(text.encode('utf-8'), eol='\r\n').encode('ascii')
+    )
+
+
+class PreparedMessage:
+    """
+    Message de campagne pré-sérialisé.
+
+    Les entêtes communs et, pour un corps sans variable, les parties MIME encodées
+    sont produits une seule fois en octets ; pour chaque destinataire on ne
+    produit plus que To, Message-ID et Date (et le sujet ou le corps s'ils
+    contiennent des variables). Le résultat se passe tel quel à SMTP.sendmail,
+    sans repasser par email.generator.
+    """
+
+    def __init__(self, smtp_auth: Dict[str, Any], sender_name: str, template: CompiledTemplate,
+                 is_html: bool, text_template: Optional[CompiledTemplate] = None):
+        self.template = template
+        self.subtype = 'html' if is_html else 'plain'
+        # Version texte brut d'un corps HTML, envoyée en première alternative
+        self.text_template = text_template if is_html else None
+        self.msgid_domain = smtp_auth['smtp_server'].encode('idna')
+        self.boundary = f"==============={uuid.uuid4().hex}=="
+        self._subject_static = not template.subject_variables
+        self._body_static = not template.body_variables
+
+        common = [b'From: ' + encode_header(formataddr((sender_name, smtp_auth['smtp_user']), charset='utf-8'))]
+        if self._subject_static:
+            common.append(b'Subject: ' + encode_header(template.subject))
+        common.append(b'Content-Type: multipart/alternative; boundary="' + self.boundary.encode('ascii') + b'"')
+        common.append(b'MIME-Version: 1.0')
+        self._common_headers = CRLF.join(common) + CRLF
+        self._body = self._encode_body({}) if self._body_static else None
+        self._date = (0, b'')
+
+    def _encode_body(self, context: Dict[str, Any]) -> bytes:
+        # Corps multipart/alternative complet, séparateurs compris
+        boundary = b'--' + self.boundary.encode('ascii')
+        chunks: List[bytes] = [CRLF]
+        for part in self._parts(context):
+            chunks.append(boundary + CRLF + part + CRLF)
+        chunks.append(boundary + b'--' + CRLF)
+        return b''.join(chunks)
+
+    def _parts(self, context: Dict[str, Any]) -> List[bytes]:
+        # Du moins fidèle au plus fidèle, comme l'attend multipart/alternative
+        parts = []
+        if self.text_template is not None:
+            parts.append(encode_part(self.text_template.render_body(context), 'plain'))
+        parts.append(encode_part(self.template.render_body(context), self.subtype))
+        return parts
+
+    def _date_header(self) -> bytes:
+        # formatdate a une résolution d'une seconde : on réutilise la valeur dans la même seconde
+        now = int(time.time())
+        if self._date[0] != now:
+            self._date = (now, formatdate(now, localtime=True).encode('ascii'))
+        return self._date[1]
+
+    def render(self, recipient: str, context: Dict[str, Any]) -> bytes:
+        """
+        Produit le message complet, en octets, pour un destinataire.
+        """
+        headers = [
+            b'To: ' + recipient.encode('utf-8'),
+            b'Message-ID: <' + str(uuid.uuid4()).encode('ascii') + b'@' + self.msgid_domain + b'>',
+            b'Date: ' + self._date_header(),
+        ]
+        if not self._subject_static:
+            headers.append(b'Subject: ' + encode_header(self.template.render_subject(context)))
+        body = self._body if self._body_static else self._encode_body(context)
+        return CRLF.join(headers) + CRLF + self._common_headers + body
+
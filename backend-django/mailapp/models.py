@@ -1,6 +1,10 @@
 from django.db import models
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import EmailValidator, RegexValidator
 from django.utils.timezone import now
+from .validation import EMAIL_REGEX
+from .credentials import unseal
 
 class CampaignMail(models.Model):
     """
@@ -49,7 +53,7 @@ class Mail(models.Model):
         validators=[
             EmailValidator(),
             RegexValidator(
-                regex=r'^[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}$',
+                regex=EMAIL_REGEX,
                 message="Format d'email invalide"
             )
         ]
@@ -59,6 +63,13 @@ class Mail(models.Model):
         auto_now_add=True,
         verbose_name="Date d'ajout"
     )
+
+    variables = models.JSONField(
+        default=dict,
+        blank=True,
+        verbose_name="Variables du destinataire",
+        help_text="Valeurs des variables {{ nom }} des templates pour ce destinataire"
+    )
     
 
     class Meta:
@@ -73,9 +84,9 @@ class Mail(models.Model):
     def to_dict(self):
         return {
             'id': self.id,
-            'campaign_id': self.campaign.id,
-            'campaign_name': self.campaign.name,
+            'campaign_id': self.campaign_id,
             'email': self.email,
+            'variables': self.variables,
             'added_at': self.added_at.isoformat(),
         }
 
@@ -112,4 +123,271 @@ class Template(models.Model):
             'template_name': self.template_name,
             'subject': self.subject,
             'modified': self.date_ts.strftime("%Y-%m-%d")
-        }
\ No newline at end of file
+        }
+
+class Email(models.Model):
+    """
+    Modèle représentant un email de la file d'envoi (outbox).
+    Les emails sont écrits par l'API puis envoyés par les workers `send_outbox`.
+    Un échec temporaire replanifie l'envoi à `next_attempt_at` ; après
+    OUTBOX_MAX_ATTEMPTS tentatives l'email passe en `dead` (file des rejets).
+
+    Le mot de passe SMTP n'est pas dans `smtp_auth` : il est chiffré dans
+    `smtp_secret` (voir credentials.seal) et effacé dès que l'email est envoyé
+    ou en échec définitif. Un email `dead` le garde pour pouvoir être remis en file.
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_SENDING = 'sending'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+    STATUS_DEAD = 'dead'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'En attente'),
+        (STATUS_SENDING, 'En cours d\'envoi'),
+        (STATUS_SENT, 'Envoyé'),
+        (STATUS_FAILED, 'Échec'),
+        (STATUS_DEAD, 'Abandonné après plusieurs tentatives'),
+    ]
+
+    sender = models.CharField(max_length=255, verbose_name="Nom de l'expéditeur")
+    recipient = models.EmailField(max_length=255, verbose_name="Destinataire")
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.EmailField(null=True, blank=True)
+    smtp_auth = models.JSONField(verbose_name="Paramètres SMTP (sans mot de passe)")
+    smtp_secret = models.TextField(blank=True, default='', verbose_name="Mot de passe SMTP chiffré")
+
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    error = models.TextField(blank=True, default='')
+    smtp_code = models.PositiveSmallIntegerField(null=True, blank=True, verbose_name="Dernier code de réponse SMTP")
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name="Tentatives d'envoi")
+    next_attempt_at = models.DateTimeField(default=now, verbose_name="Prochaine tentative")
+    created_at = models.DateTimeField(auto_now_add=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    timestamp_sent = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Email en file d'envoi"
+        verbose_name_plural = "Emails en file d'envoi"
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['status', 'id'], name='email_status_idx'),
+            # Emails dus : une seule requête par plage sur next_attempt_at
+            models.Index(fields=['status', 'next_attempt_at'], name='email_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.recipient} ({self.status})"
+
+    def to_email_obj(self):
+        """
+        Reconstruit les données attendues par Mailer.send_mail, mot de passe déchiffré.
+        Lève ValueError si le mot de passe n'est plus disponible.
+        """
+        return {
+            'smtp_auth': {**self.smtp_auth, 'smtp_passwd': unseal(self.smtp_secret)},
+            'recipient': self.recipient,
+            'sender': self.sender,
+            'subject': self.subject,
+            'body': self.body,
+        }
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'recipient': self.recipient,
+            'subject': self.subject,
+            'status': self.status,
+            'error': self.error,
+            'smtp_code': self.smtp_code,
+            'attempts': self.attempts,
+            'next_attempt_at': self.next_attempt_at.isoformat() if self.status == self.STATUS_PENDING else None,
+            'created_at': self.created_at.isoformat(),
+            'timestamp_sent': self.timestamp_sent.isoformat() if self.timestamp_sent else None,
+        }
+
+class MailboxFolderState(models.Model):
+    """
+    État de synchronisation d'un dossier IMAP mis en cache localement.
+    Les messages d'UID compris entre `lowest_uid` et `highest_uid` sont en cache ;
+    `complete` indique qu'aucun message plus ancien n'existe sur le serveur.
+    """
+    account = models.CharField(max_length=255, verbose_name="Compte IMAP")
+    folder = models.CharField(max_length=255, verbose_name="Dossier")
+    uidvalidity = models.BigIntegerField()
+    highest_uid = models.BigIntegerField(default=0)
+    lowest_uid = models.BigIntegerField(default=0)
+    complete = models.BooleanField(default=False)
+    synced_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "État de dossier IMAP"
+        verbose_name_plural = "États de dossiers IMAP"
+        unique_together = ('account', 'folder')
+
+    def __str__(self):
+        return f"{self.account} {self.folder} (UIDVALIDITY {self.uidvalidity})"
+
+class MailboxMessage(models.Model):
+    """
+    Entêtes et aperçu d'un message IMAP, identifié par (compte, dossier, UIDVALIDITY, UID).
+    """
+    account = models.CharField(max_length=255, verbose_name="Compte IMAP")
+    folder = models.CharField(max_length=255, verbose_name="Dossier")
+    uidvalidity = models.BigIntegerField()
+    uid = models.BigIntegerField()
+    subject = models.TextField(blank=True, default='')
+    sender = models.TextField(blank=True, default='')
+    date = models.CharField(max_length=255, blank=True, default='')
+    seen = models.BooleanField(default=False)
+    preview = models.TextField(blank=True, default='')
+    # Texte du corps (MAILBOX_SEARCH_BODY_BYTES premiers octets), pour la recherche seulement ;
+    # None tant qu'il n'a pas été récupéré (voir mailsync.index_bodies)
+    body_text = models.TextField(null=True, blank=True)
+    fetched_at = models.DateTimeField(auto_now_add=True)
+    # Index plein texte du sujet, de l'expéditeur et du texte du corps (de l'aperçu à défaut)
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    class Meta:
+        verbose_name = "Message IMAP en cache"
+        verbose_name_plural = "Messages IMAP en cache"
+        ordering = ['-uid']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['account', 'folder', 'uidvalidity', 'uid'],
+                name='mailbox_message_uid_uniq'
+            ),
+        ]
+        indexes = [
+            GinIndex(fields=['search_vector'], name='mailbox_message_search_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.account} {self.folder} #{self.uid}"
+
+    def to_dict(self):
+        return {
+            'id': str(self.uid),
+            'uid': self.uid,
+            'subject': self.subject,
+            'sender': self.sender,
+            'date': self.date,
+            'seen': self.seen,
+            'body': self.preview,
+        }
+
+class Suppression(models.Model):
+    """
+    Adresse à ne plus jamais contacter (rebond définitif, désinscription, plainte).
+    L'adresse est stockée en minuscules.
+    """
+    REASON_BOUNCE = 'bounce'
+    REASON_UNSUBSCRIBE = 'unsubscribe'
+    REASON_COMPLAINT = 'complaint'
+    REASON_MANUAL = 'manual'
+    REASON_CHOICES = [
+        (REASON_BOUNCE, 'Rebond définitif'),
+        (REASON_UNSUBSCRIBE, 'Désinscription'),
+        (REASON_COMPLAINT, 'Plainte'),
+        (REASON_MANUAL, 'Ajout manuel'),
+    ]
+
+    email = models.CharField(max_length=255, unique=True, verbose_name="Adresse email")
+    reason = models.CharField(max_length=16, choices=REASON_CHOICES, default=REASON_MANUAL)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Adresse exclue"
+        verbose_name_plural = "Adresses exclues"
+        ordering = ['id']
+
+    def __str__(self):
+        return f"{self.email} ({self.reason})"
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'email': self.email,
+            'reason': self.reason,
+            'created_at': self.created_at.isoformat(),
+        }
+
+class DeliveryRecord(models.Model):
+    """
+    Résultat d'un envoi, un par message (voir deliverylog.DeliveryLog qui les
+    écrit par lots). Journal en ajout seul : les lignes sont conservées si la
+    campagne ou le template sont supprimés, d'où l'absence de contrainte de clé étrangère.
+    """
+    STATUS_SENT = 'sent'
+    STATUS_DEFERRED = 'deferred'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_SENT, 'Envoyé'),
+        (STATUS_DEFERRED, 'Différé'),
+        (STATUS_FAILED, 'Échec'),
+    ]
+
+    recipient = models.CharField(max_length=255, verbose_name="Destinataire")
+    campaign = models.ForeignKey(
+        CampaignMail, null=True, blank=True, on_delete=models.DO_NOTHING,
+        db_constraint=False, related_name='+'
+    )
+    template = models.ForeignKey(
+        Template, null=True, blank=True, on_delete=models.DO_NOTHING,
+        db_constraint=False, related_name='+'
+    )
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES)
+    smtp_code = models.PositiveSmallIntegerField(null=True, blank=True, verbose_name="Code de réponse SMTP")
+    latency_ms = models.PositiveIntegerField(null=True, blank=True, verbose_name="Durée de la transaction SMTP")
+    attempts = models.PositiveSmallIntegerField(default=1)
+    created_at = models.DateTimeField(default=now)
+
+    class Meta:
+        verbose_name = "Résultat d'envoi"
+        verbose_name_plural = "Résultats d'envoi"
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['campaign', 'id'], name='delivery_campaign_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.recipient} ({self.status})"
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'recipient': self.recipient,
+            'campaign_id': self.campaign_id,
+            'template_id': self.template_id,
+            'status': self.status,
+            'smtp_code': self.smtp_code,
+            'latency_ms': self.latency_ms,
+            'attempts': self.attempts,
+            'created_at': self.created_at.isoformat(),
+        }
+
+class CampaignStats(models.Model):
+    """
+    Compteurs d'envoi d'une campagne, incrémentés à chaque écriture d'un lot de
+    DeliveryRecord : les statistiques se lisent sans parcourir le journal.
+    """
+    campaign = models.OneToOneField(
+        CampaignMail, primary_key=True, on_delete=models.CASCADE, related_name='stats'
+    )
+    sent = models.BigIntegerField(default=0)
+    deferred = models.BigIntegerField(default=0)
+    failed = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Statistiques de campagne"
+        verbose_name_plural = "Statistiques de campagnes"
+
+    def to_dict(self):
+        return {
+            'campaign_id': self.campaign_id,
+            'sent': self.sent,
+            'deferred': self.deferred,
+            'failed': self.failed,
+            'updated_at': self.updated_at.isoformat(),
+        }
@@ -0,0 +1,284 @@
+import asyncio
+import logging
+import random
+from collections import defaultdict
+from datetime import timedelta
+from itertools import groupby
+from typing import Any, Dict, List, Optional
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils.timezone import now
+from .credentials import seal
+from .exceptions import SendMailException, TransientSendException
+from .mailer import AsyncMailer, Mailer
+from .models import Email
+
+logger = logging.getLogger(__name__)
+
+
+def _new_email(email_obj: Dict[str, Any]) -> Email:
+    # Le mot de passe n'est jamais écrit en clair : il est chiffré à part dans smtp_secret
+    smtp_auth = dict(email_obj['smtp_auth'])
+    password = smtp_auth.pop('smtp_passwd')
+    return Email(
+        sender=email_obj['sender'],
+        recipient=email_obj['recipient'],
+        subject=email_obj['subject'],
+        body=email_obj['body'],
+        from_email=smtp_auth['smtp_user'],
+        smtp_auth=smtp_auth,
+        smtp_secret=seal(password)
+    )
+
+
+def enqueue(email_obj: Dict[str, Any]) -> Email:
+    """
+    Ajoute un email validé (données d'EmailObjSerializer) à la file d'envoi.
+
+    :param email_obj: Les données validées de l'email.
+    :return: L'instance Email créée, en attente d'envoi.
+    """
+    email = _new_email(email_obj)
+    email.save()
+    return email
+
+
+async def aenqueue(email_obj: Dict[str, Any]) -> Email:
+    """
+    Équivalent asynchrone de enqueue, pour les vues servies en ASGI.
+    """
+    email = _new_email(email_obj)
+    await email.asave()
+    return email
+
+
+def retry_delay(attempts: int) -> float:
+    """
+    Délai avant la tentative suivante : backoff exponentiel (OUTBOX_RETRY_BASE_SECONDS
+    doublé à chaque tentative, borné par OUTBOX_RETRY_MAX_SECONDS) avec une gigue
+    aléatoire, pour que les emails refusés ensemble ne soient pas retentés ensemble.
+
+    :param attempts: Le nombre de tentatives déjà faites.
+    """
+    delay = min(settings.OUTBOX_RETRY_MAX_SECONDS, settings.OUTBOX_RETRY_BASE_SECONDS * 2 ** (attempts - 1))
+    return random.uniform(delay / 2, delay)
+
+
+def claim_batch(batch_size: int) -> List[Email]:
+    """
+    Réserve un lot d'emails à envoyer pour le worker courant.
+
+    Seuls les emails dus (`next_attempt_at` passé) sont lus, par une requête de
+    plage sur l'index (status, next_attempt_at) : les retentatives planifiées
+    plus tard ne sont pas parcourues. Les lignes sont verrouillées avec
+    `SELECT ... FOR UPDATE SKIP LOCKED` : plusieurs workers peuvent vider la file
+    en parallèle sans jamais réserver la même ligne. Les emails restés en cours
+    d'envoi au-delà de OUTBOX_LEASE_SECONDS (worker arrêté en plein envoi) sont
+    de nouveau réservables : la réservation est donc prolongée avant chaque
+    envoi du lot (voir _renew_lease), le bail ne couvrant qu'un seul envoi.
+    """
+    claimed_at = now()
+    lease_expired = claimed_at - timedelta(seconds=settings.OUTBOX_LEASE_SECONDS)
+    with transaction.atomic():
+        emails = list(
+            Email.objects.select_for_update(skip_locked=True)
+            .filter(Q(status=Email.STATUS_PENDING, next_attempt_at__lte=claimed_at)
+                    | Q(status=Email.STATUS_SENDING, claimed_at__lt=lease_expired))
+            .order_by('next_attempt_at', 'id')[:batch_size]
+        )
+        if emails:
+            # La tentative est comptée dès la réservation : un worker arrêté en plein envoi l'a consommée
+            Email.objects.filter(id__in=[email.id for email in emails]).update(
+                status=Email.STATUS_SENDING, claimed_at=claimed_at, attempts=F('attempts') + 1
+            )
+            for email in emails:
+                email.attempts += 1
+                email.claimed_at = claimed_at
+    return emails
+
+
+def _owned(email: Email):
+    # La ligne tant qu'elle est réservée par ce worker : claimed_at sert de jeton de réservation
+    return Email.objects.filter(id=email.id, claimed_at=email.claimed_at)
+
+
+def _renew_lease(email: Email) -> bool:
+    """
+    Prolonge la réservation d'un email juste avant son envoi.
+
+    :return: False si le bail a expiré et qu'un autre worker a repris l'email : il ne doit pas être envoyé.
+    """
+    renewed_at = now()
+    if not _owned(email).filter(status=Email.STATUS_SENDING).update(claimed_at=renewed_at):
+        logger.warning(f"Email {email.id} was claimed by another worker after its lease expired, skipped")
+        return False
+    email.claimed_at = renewed_at
+    return True
+
+
+def _smtp_account(email: Email):
+    smtp_auth = email.smtp_auth
+    return smtp_auth['smtp_server'], smtp_auth['smtp_port'], smtp_auth['smtp_user']
+
+
+def _record_failure(email: Email, exc: SendMailException, report: Dict[str, int]):
+    # 4xx et coupures réseau : replanifié tant qu'il reste des tentatives ; 5xx : échec définitif
+    error = str(exc) or 'Send failure'
+    smtp_code = getattr(exc, 'smtp_code', None)
+    if not isinstance(exc, TransientSendException):
+        _owned(email).update(status=Email.STATUS_FAILED, error=error, smtp_code=smtp_code, smtp_secret='')
+        report['failed'] += 1
+    elif email.attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+        _owned(email).update(status=Email.STATUS_DEAD, error=error, smtp_code=smtp_code)
+        logger.warning(f"Email {email.id} moved to dead letters after {email.attempts} attempt(s): {error}")
+        report['dead'] += 1
+    else:
+        next_attempt_at = now() + timedelta(seconds=retry_delay(email.attempts))
+        _owned(email).update(
+            status=Email.STATUS_PENDING, error=error, smtp_code=smtp_code, next_attempt_at=next_attempt_at
+        )
+        report['retried'] += 1
+
+
+def _is_host_error(exc: SendMailException) -> bool:
+    # Coupure réseau ou 421 : le relais refuse la session, inutile de le recontacter pendant ce lot
+    return isinstance(exc, TransientSendException) and getattr(exc, 'smtp_code', None) in (None, 421)
+
+
+def _postpone(email: Email, report: Dict[str, int]):
+    # Email non tenté (relais indisponible) : replanifié sans perdre de tentative
+    _owned(email).update(
+        status=Email.STATUS_PENDING, attempts=F('attempts') - 1,
+        next_attempt_at=now() + timedelta(seconds=retry_delay(1))
+    )
+    report['retried'] += 1
+
+
+def _prepare(email: Email, report: Dict[str, int]) -> Optional[Dict[str, Any]]:
+    # Prolonge la réservation et reconstruit les données d'envoi ; None si l'email ne doit pas être envoyé
+    if not _renew_lease(email):
+        return None
+    try:
+        return email.to_email_obj()
+    except ValueError as exc:
+        # Mot de passe illisible (clé OUTBOX_SECRET_KEY changée) : aucune tentative ne pourra aboutir
+        _owned(email).update(status=Email.STATUS_FAILED, error=str(exc), smtp_secret='')
+        report['failed'] += 1
+        return None
+
+
+def _record_sent(email: Email, report: Dict[str, int]):
+    _owned(email).update(status=Email.STATUS_SENT, timestamp_sent=now(), error='', smtp_code=None, smtp_secret='')
+    report['sent'] += 1
+
+
+def deliver(emails: List[Email]) -> Dict[str, int]:
+    """
+    Envoie un lot d'emails réservés et enregistre le résultat de chacun.
+    Les emails (premiers envois comme retentatives) sont regroupés par compte
+    SMTP : ceux d'un même relais s'enchaînent sur la même session du pool.
+    Un relais qui coupe la connexion ou répond 421 fait replanifier le reste de
+    son groupe sans le recontacter ; ces emails ne perdent pas de tentative.
+    Un email dont la réservation a été reprise par un autre worker est ignoré.
+    """
+    mailer = Mailer()
+    report = {'sent': 0, 'failed': 0, 'retried': 0, 'dead': 0}
+    for _, group in groupby(sorted(emails, key=_smtp_account), key=_smtp_account):
+        host_error = None
+        for email in group:
+            if host_error is not None:
+                _postpone(email, report)
+                continue
+            email_obj = _prepare(email, report)
+            if email_obj is None:
+                continue
+            try:
+                mailer.send_mail(email_obj=email_obj, attempts=email.attempts)
+            except SendMailException as exc:
+                _record_failure(email, exc, report)
+                if _is_host_error(exc):
+                    host_error = exc
+                continue
+            _record_sent(email, report)
+    return report
+
+
+async def adeliver(emails: List[Email]) -> Dict[str, int]:
+    """
+    Équivalent asynchrone de deliver (send_outbox --async) : les emails du lot
+    sont envoyés en parallèle par AsyncMailer, une conversation SMTP par email,
+    dans la limite de SMTP_MAX_CONNECTIONS_PER_HOST par compte et du throttle de
+    chaque relais. Un seul thread mène ainsi des centaines de conversations vers
+    des relais différents ; les écritures en base passent par sync_to_async.
+
+    La réservation d'un email n'est prolongée qu'une fois sa place obtenue, juste
+    avant son envoi. Après une coupure ou un 421, les emails du compte pas encore
+    tentés sont replanifiés, comme dans deliver.
+    """
+    mailer = AsyncMailer()
+    report = {'sent': 0, 'failed': 0, 'retried': 0, 'dead': 0}
+    semaphores = defaultdict(lambda: asyncio.Semaphore(settings.SMTP_MAX_CONNECTIONS_PER_HOST))
+    host_errors = {}
+
+    async def send_one(email: Email):
+        account = _smtp_account(email)
+        async with semaphores[account]:
+            if account in host_errors:
+                await sync_to_async(_postpone)(email, report)
+                return
+            email_obj = await sync_to_async(_prepare)(email, report)
+            if email_obj is None:
+                return
+            try:
+                await mailer.send_mail(email_obj=email_obj, attempts=email.attempts)
+            except SendMailException as exc:
+                await sync_to_async(_record_failure)(email, exc, report)
+                if _is_host_error(exc):
+                    host_errors.setdefault(account, exc)
+                return
+            await sync_to_async(_record_sent)(email, report)
+
+    await asyncio.gather(*(send_one(email) for email in emails))
+    return report
+
+
+def requeue_dead() -> int:
+    """
+    Remet dans la file les emails abandonnés (status dead), avec un compteur de tentatives à zéro.
+    Les emails dead gardent leur mot de passe chiffré, ils peuvent donc être renvoyés.
+
+    :return: Le nombre d'emails remis en file.
+    """
+    return Email.objects.filter(status=Email.STATUS_DEAD).update(
+        status=Email.STATUS_PENDING, attempts=0, next_attempt_at=now()
+    )
+
+
+def process_batch(batch_size: int) -> Dict[str, int]:
+    """
+    Réserve puis envoie un lot d'emails.
+
+    :return: Un résumé {'claimed', 'sent', 'failed', 'retried', 'dead'}.
+    """
+    emails = claim_batch(batch_size)
+    if not emails:
+        return {'claimed': 0, 'sent': 0, 'failed': 0, 'retried': 0, 'dead': 0}
+    report = deliver(emails)
+    logger.info(f"Outbox batch processed: {len(emails)} claimed, {report['sent']} sent, {report['failed']} failed, "
+                f"{report['retried']} retried, {report['dead']} dead")
+    return {'claimed': len(emails), **report}
+
+
+async def aprocess_batch(batch_size: int) -> Dict[str, int]:
+    """
+    Équivalent asynchrone de process_batch, les envois du lot étant faits par adeliver.
+    """
+    emails = await sync_to_async(claim_batch)(batch_size)
+    if not emails:
+        return {'claimed': 0, 'sent': 0, 'failed': 0, 'retried': 0, 'dead': 0}
+    report = await adeliver(emails)
+    logger.info(f"Outbox batch processed: {len(emails)} claimed, {report['sent']} sent, {report['failed']} failed, "
+                f"{report['retried']} retried, {report['dead']} dead")
+    return {'claimed': len(emails), **report}
@@ -0,0 +1,151 @@
+import hashlib
+import logging
+import smtplib
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+from django.conf import settings
+from .cache import LRUCache
+from .tls import starttls, tls_sessions
+
+logger = logging.getLogger(__name__)
+
+# Tests réussis récents, par empreinte des identifiants ; les échecs ne sont pas gardés
+_probe_cache = LRUCache(maxsize=settings.SMTP_PROBE_CACHE_SIZE, ttl=settings.SMTP_PROBE_CACHE_TTL)
+
+
+def credentials_key(smtp_auth: Dict[str, Any]) -> str:
+    """
+    Empreinte d'un profil SMTP (serveur, port, TLS, utilisateur et mot de passe) :
+    le mot de passe n'est jamais gardé en clair dans le cache.
+    """
+    raw = '\0'.join([
+        smtp_auth['smtp_server'], str(smtp_auth['smtp_port']), str(bool(smtp_auth['is_tls'])),
+        smtp_auth['smtp_user'], smtp_auth['smtp_passwd'],
+    ])
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def cached_probe(smtp_auth: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Résultat d'un test réussi il y a moins de SMTP_PROBE_CACHE_TTL secondes, ou None"""
+    return _probe_cache.get(credentials_key(smtp_auth))
+
+
+def remember_probe(smtp_auth: Dict[str, Any], result: Optional[Dict[str, Any]] = None):
+    _probe_cache.set(credentials_key(smtp_auth), result or {'ok': True, 'phase': None, 'error': None, 'timings_ms': {}})
+
+
+def forget_probe(smtp_auth: Dict[str, Any]):
+    _probe_cache.pop(credentials_key(smtp_auth))
+
+
+class _ConnectedSMTP(smtplib.SMTP):
+    # Session smtplib montée sur une socket déjà ouverte, pour mesurer la connexion TCP à part
+    def __init__(self, sock: socket.socket, timeout: float):
+        self._connected_sock = sock
+        super().__init__(timeout=timeout)
+
+    def _get_socket(self, host, port, timeout):
+        return self._connected_sock
+
+
+def _elapsed_ms(started: float) -> float:
+    return round((time.monotonic() - started) * 1000, 1)
+
+
+def probe_smtp(smtp_auth: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Teste un profil SMTP phase par phase, avec les délais SMTP_CONNECT_TIMEOUT et
+    SMTP_READ_TIMEOUT : résolution DNS, connexion TCP (jusqu'à la bannière),
+    STARTTLS si demandé, puis authentification.
+
+    :return: {'ok', 'phase' (phase en échec ou None), 'error', 'timings_ms' {'dns', 'tcp', 'tls', 'auth'}}.
+    """
+    host, port = smtp_auth['smtp_server'], smtp_auth['smtp_port']
+    timings: Dict[str, float] = {}
+    result: Dict[str, Any] = {'ok': False, 'phase': 'dns', 'error': None, 'timings_ms': timings}
+    server = None
+    try:
+        started = time.monotonic()
+        addresses = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        timings['dns'] = _elapsed_ms(started)
+
+        result['phase'] = 'tcp'
+        started = time.monotonic()
+        sock, error = None, None
+        for family, socktype, proto, _, address in addresses:
+            sock = socket.socket(family, socktype, proto)
+            sock.settimeout(settings.SMTP_CONNECT_TIMEOUT)
+            try:
+                sock.connect(address)
+                error = None
+                break
+            except OSError as exc:
+                sock.close()
+                error = exc
+        if error is not None:
+            raise error
+        sock.settimeout(settings.SMTP_READ_TIMEOUT)
+        server = _ConnectedSMTP(sock, timeout=settings.SMTP_READ_TIMEOUT)
+        code, message = server.connect(host, port)
+        if code != 220:
+            raise smtplib.SMTPConnectError(code, message)
+        server.ehlo()
+        timings['tcp'] = _elapsed_ms(started)
+
+        if smtp_auth['is_tls']:
+            result['phase'] = 'tls'
+            started = time.monotonic()
+            starttls(server, host, port)
+            server.ehlo()
+            timings['tls'] = _elapsed_ms(started)
+
+        result['phase'] = 'auth'
+        started = time.monotonic()
+        server.login(smtp_auth['smtp_user'], smtp_auth['smtp_passwd'])
+        timings['auth'] = _elapsed_ms(started)
+        if smtp_auth['is_tls']:
+            tls_sessions.store(host, port, server.sock)
+
+        result.update(ok=True, phase=None)
+    except Exception as exc:
+        result['error'] = str(exc) or exc.__class__.__name__
+        logger.warning(f"SMTP probe of {host}:{port} failed during {result['phase']}: {result['error']}")
+    finally:
+        if server is not None:
+            try:
+                server.quit()
+            except Exception:
+                server.close()
+    return result
+
+
+def probe_many(profiles: List[Dict[str, Any]], use_cache: bool = True) -> List[Dict[str, Any]]:
+    """
+    Teste plusieurs profils SMTP en parallèle (au plus SMTP_PROBE_WORKERS à la
+    fois). Un profil testé avec succès il y a moins de SMTP_PROBE_CACHE_TTL
+    secondes n'est pas recontacté.
+
+    :return: Pour chaque profil, dans l'ordre : le résultat de probe_smtp avec
+        `smtp_server`, `smtp_port`, `smtp_user` et `cached`.
+    """
+    def probe(smtp_auth):
+        cached = cached_probe(smtp_auth) if use_cache else None
+        if cached is not None:
+            return {**cached, 'cached': True}
+        result = probe_smtp(smtp_auth)
+        if result['ok']:
+            remember_probe(smtp_auth, result)
+        return {**result, 'cached': False}
+
+    if not profiles:
+        return []
+    workers = min(len(profiles), settings.SMTP_PROBE_WORKERS)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='smtp-probe') as executor:
+        results = list(executor.map(probe, profiles))
+    return [
+        {'smtp_server': smtp_auth['smtp_server'], 'smtp_port': smtp_auth['smtp_port'],
+         'smtp_user': smtp_auth['smtp_user'], **result}
+        for smtp_auth, result in zip(profiles, results)
+    ]
@@ -0,0 +1,142 @@
+import logging
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
+from django.conf import settings
+from django.db import connections
+from .connections import smtp_pool
+from .mailer import Mailer, MAX_REPORTED_FAILURES
+from .templating import CompiledTemplate
+from .suppression import suppression_list
+from .throttle import rate_limiter_for
+
+logger = logging.getLogger(__name__)
+
+# Marqueur de fin de file pour les workers
+_DONE = object()
+
+
+class ParallelCampaignSender:
+    """
+    Envoie une campagne sur plusieurs sessions SMTP en parallèle.
+
+    Chaque worker du pool de threads emprunte sa propre session (voir
+    Mailer.send_campaign) et consomme les destinataires depuis une file commune,
+    alimentée par le thread appelant : les itérateurs de queryset restent ainsi
+    lus sur la connexion base de données du thread qui les a créés.
+
+    Le nombre de sessions est borné par `concurrency`, par la taille du pool SMTP
+    du compte et par SMTP_MAX_CONNECTIONS_PER_HOST ; à l'intérieur de ces bornes,
+    le throttle adaptatif du relais (voir throttle.HostThrottle) régule les
+    transactions simultanées et le débit. Le débit du compte est en plus limité
+    par un seau de jetons partagé.
+    """
+
+    def __init__(self, mailer: Optional[Mailer] = None, concurrency: Optional[int] = None,
+                 rate_limit: Optional[float] = None):
+        self.mailer = mailer or Mailer()
+        self.concurrency = concurrency or settings.CAMPAIGN_DEFAULT_CONCURRENCY
+        self.rate_limit = rate_limit
+
+    def _workers(self) -> int:
+        return max(1, min(self.concurrency, smtp_pool.max_size, settings.SMTP_MAX_CONNECTIONS_PER_HOST))
+
+    def _drain(self, recipients: queue.Queue) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        while True:
+            recipient = recipients.get()
+            if recipient is _DONE:
+                return
+            yield recipient
+
+    def _run_worker(self, smtp_auth, sender_name: str, template: CompiledTemplate,
+                    recipients: queue.Queue, rate_limiter, report: Dict[str, Any], log_ids: Dict[str, Any]):
+        try:
+            self.mailer.send_campaign(
+                smtp_auth, sender_name, template,
+                recipients=self._drain(recipients),
+                rate_limiter=rate_limiter,
+                report=report,
+                **log_ids
+            )
+        finally:
+            # Connexion base éventuellement ouverte par ce thread (liste d'exclusion, rebonds)
+            connections.close_all()
+
+    def send(self, smtp_auth, sender_name: str, template: CompiledTemplate,
+             recipients: Iterable[Tuple[str, Dict[str, Any]]], campaign_id: Optional[int] = None,
+             template_id: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Envoie le template à tous les destinataires (couples adresse, variables).
+        `campaign_id` et `template_id` sont reportés dans le journal des envois.
+
+        :return: Un résumé {'sent', 'failed', 'deferred', 'suppressed', 'failures', 'unsent', 'workers', 'elapsed_seconds', 'throughput'}.
+        """
+        # Chargée depuis le thread appelant, la liste d'exclusion est ensuite lue en mémoire par les workers
+        suppression_list.refresh()
+        workers = self._workers()
+        rate_limiter = rate_limiter_for(smtp_auth, self.rate_limit)
+        pending = queue.Queue(maxsize=workers * 100)
+        reports = [{} for _ in range(workers)]
+        started = time.monotonic()
+
+        def put(item) -> bool:
+            # Attend une place dans la file tant qu'au moins un worker est actif
+            while True:
+                try:
+                    pending.put(item, timeout=0.5)
+                    return True
+                except queue.Full:
+                    if all(future.done() for future in futures):
+                        return False
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='campaign-sender') as executor:
+            futures = [
+                executor.submit(self._run_worker, smtp_auth, sender_name, template,
+                                pending, rate_limiter, reports[index],
+                                {'campaign_id': campaign_id, 'template_id': template_id})
+                for index in range(workers)
+            ]
+            unsent = 0
+            recipients = iter(recipients)
+            # Tous les workers arrêtés (authentification refusée...) : la file n'est plus alimentée
+            stopped = False
+            for recipient in recipients:
+                if not put(recipient):
+                    unsent += 1
+                    stopped = True
+                    break
+            if not stopped:
+                for _ in futures:
+                    if not put(_DONE):
+                        break
+
+        errors = [future.exception() for future in futures if future.exception() is not None]
+        elapsed = time.monotonic() - started
+        report = {'sent': 0, 'failed': 0, 'deferred': 0, 'suppressed': 0, 'failures': []}
+        for worker_report in reports:
+            report['sent'] += worker_report.get('sent', 0)
+            report['failed'] += worker_report.get('failed', 0)
+            report['deferred'] += worker_report.get('deferred', 0)
+            report['suppressed'] += worker_report.get('suppressed', 0)
+            report['failures'].extend(worker_report.get('failures', []))
+        report['failures'] = report['failures'][:MAX_REPORTED_FAILURES]
+
+        if errors and report['sent'] == 0:
+            # Aucun worker n'a pu envoyer : on remonte l'erreur (connexion, authentification...)
+            raise errors[0]
+        if stopped:
+            unsent += sum(1 for _ in recipients)
+        if errors:
+            # Les destinataires restés dans la file ou en cours d'envoi ne sont pas partis
+            while not pending.empty():
+                if pending.get_nowait() is not _DONE:
+                    unsent += 1
+            logger.warning(f"{len(errors)} campaign worker(s) aborted, {unsent} recipient(s) left unsent")
+        report['unsent'] = unsent
+        report['workers'] = workers
+        report['elapsed_seconds'] = round(elapsed, 3)
+        report['throughput'] = round(report['sent'] / elapsed, 2) if elapsed > 0 else 0.0
+        logger.info(f"Campaign sent with {workers} worker(s): {report['sent']} sent, {report['failed']} failed "
+                    f"in {report['elapsed_seconds']}s ({report['throughput']} mail/s)")
+        return report
@@ -0,0 +1,118 @@
+import logging
+import threading
+import time
+from typing import Iterable, Optional, Set
+from django.conf import settings
+from .models import Suppression
+
+logger = logging.getLogger(__name__)
+
+# Codes SMTP de refus définitif d'un destinataire qui entraînent son exclusion
+BOUNCE_CODES = {550, 551, 553}
+
+
+def normalize(email: str) -> str:
+    return email.strip().lower()
+
+
+class SuppressionList:
+    """
+    Copie en mémoire de la table Suppression, consultée à chaque envoi sans
+    requête en base.
+
+    Chaque adresse est réduite à son empreinte 64 bits (hash de la chaîne
+    normalisée) dans un set : le test d'appartenance est en O(1) et 500 000
+    adresses tiennent en quelques dizaines de Mo. Les empreintes ne sont valables
+    que dans le processus, ce qui suffit puisqu'elles ne sont jamais persistées.
+
+    La liste est chargée au premier usage puis rafraîchie au plus toutes les
+    `refresh_interval` secondes, incrémentalement : seules les lignes d'id
+    supérieur au dernier chargé sont lues. Si le nombre de lignes ne correspond
+    plus (suppression de lignes, insertion concurrente d'un id plus petit), la
+    liste est rechargée entièrement.
+    """
+
+    def __init__(self, refresh_interval: float):
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._hashes: Set[int] = set()
+        self._last_id = 0
+        self._count = 0
+        self._refreshed_at: Optional[float] = None
+
+    @staticmethod
+    def _key(email: str) -> int:
+        return hash(normalize(email))
+
+    def _reload(self):
+        hashes = set()
+        last_id = 0
+        for row_id, email in Suppression.objects.order_by('id').values_list('id', 'email').iterator(chunk_size=10000):
+            hashes.add(self._key(email))
+            last_id = row_id
+        # Remplacement en une affectation : les lecteurs voient l'ancien ou le nouveau set
+        self._hashes, self._last_id, self._count = hashes, last_id, len(hashes)
+        logger.info(f"Suppression list loaded: {self._count} address(es)")
+
+    def refresh(self, force: bool = False):
+        """
+        Met à jour la copie locale si elle a plus de `refresh_interval` secondes.
+        """
+        if not force and self._refreshed_at is not None \
+                and time.monotonic() - self._refreshed_at < self.refresh_interval:
+            return
+        with self._lock:
+            if not force and self._refreshed_at is not None \
+                    and time.monotonic() - self._refreshed_at < self.refresh_interval:
+                return
+            if self._refreshed_at is None:
+                self._reload()
+            else:
+                new_rows = list(Suppression.objects.filter(id__gt=self._last_id)
+                                .order_by('id').values_list('id', 'email'))
+                total = Suppression.objects.count()
+                if total != self._count + len(new_rows):
+                    self._reload()
+                elif new_rows:
+                    self._hashes.update(self._key(email) for _, email in new_rows)
+                    self._last_id = new_rows[-1][0]
+                    self._count = total
+            self._refreshed_at = time.monotonic()
+
+    def is_suppressed(self, email: str) -> bool:
+        if self._refreshed_at is None:
+            self.refresh()
+        return self._key(email) in self._hashes
+
+    def add(self, emails: Iterable[str], reason: str = Suppression.REASON_MANUAL) -> int:
+        """
+        Exclut des adresses (déjà exclues : ignorées) ; elles sont aussitôt prises
+        en compte dans ce processus, les autres les verront au prochain rafraîchissement.
+
+        :return: Le nombre d'adresses traitées.
+        """
+        emails = {normalize(email) for email in emails if email and email.strip()}
+        if not emails:
+            return 0
+        Suppression.objects.bulk_create(
+            [Suppression(email=email, reason=reason) for email in emails], ignore_conflicts=True
+        )
+        self._hashes.update(self._key(email) for email in emails)
+        return len(emails)
+
+    def remove(self, emails: Iterable[str]) -> int:
+        """
+        Réautorise des adresses ; la copie locale est rechargée entièrement (les
+        empreintes ajoutées par `add` ne sont pas comptées par le rafraîchissement incrémental).
+
+        :return: Le nombre de lignes supprimées.
+        """
+        deleted, _ = Suppression.objects.filter(email__in={normalize(email) for email in emails}).delete()
+        if deleted:
+            with self._lock:
+                self._reload()
+                self._refreshed_at = time.monotonic()
+        return deleted
+
+
+suppression_list = SuppressionList(settings.SUPPRESSION_REFRESH_SECONDS)
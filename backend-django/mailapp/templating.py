@@ -0,0 +1,91 @@
+import re
+from typing import Any, Dict, Tuple
+from django.conf import settings
+from .cache import LRUCache
+
+# Variables de template : {{ email }}, {{ first_name }}...
+PLACEHOLDER_PATTERN = re.compile(r'{{\s*([A-Za-z_][A-Za-z0-9_]*)\s*}}')
+
+
+class _Context(dict):
+    # Une variable absente est rendue vide plutôt que de lever une erreur
+    def __missing__(self, key):
+        return ''
+
+
+def _to_format_string(text: str) -> Tuple[str, frozenset]:
+    """
+    Traduit un texte à variables {{ nom }} en chaîne pour str.format_map :
+    l'analyse du texte n'est faite qu'une fois, le rendu ne fait plus que de la
+    substitution en C.
+    """
+    parts = PLACEHOLDER_PATTERN.split(text)
+    chunks = []
+    for index, part in enumerate(parts):
+        if index % 2:
+            chunks.append('{' + part + '}')
+        else:
+            chunks.append(part.replace('{', '{{').replace('}', '}}'))
+    return ''.join(chunks), frozenset(parts[1::2])
+
+
+class CompiledTemplate:
+    """
+    Sujet et corps d'un template, compilés une fois pour être rendus par destinataire.
+    """
+    __slots__ = ('subject', 'body', '_subject_format', '_body_format', 'subject_variables', 'body_variables')
+
+    def __init__(self, subject: str, body: str):
+        self.subject = subject
+        self.body = body
+        self._subject_format, self.subject_variables = _to_format_string(subject)
+        self._body_format, self.body_variables = _to_format_string(body)
+
+    @property
+    def variables(self) -> frozenset:
+        return self.subject_variables | self.body_variables
+
+    def render_subject(self, context: Dict[str, Any]) -> str:
+        if not self.subject_variables:
+            return self.subject
+        return self._subject_format.format_map(_Context(context))
+
+    def render_body(self, context: Dict[str, Any]) -> str:
+        if not self.body_variables:
+            return self.body
+        return self._body_format.format_map(_Context(context))
+
+    def render(self, context: Dict[str, Any]) -> Tuple[str, str]:
+        """
+        Rend le sujet et le corps pour un destinataire.
+
+        :param context: Les variables du destinataire (au minimum 'email').
+        :return: Le tuple (sujet, corps).
+        """
+        return self.render_subject(context), self.render_body(context)
+
+
+_compiled_templates = LRUCache(maxsize=settings.TEMPLATE_CACHE_SIZE)
+
+
+def get_compiled_template(template) -> CompiledTemplate:
+    """
+    Retourne le template compilé, depuis le cache si possible. La clé inclut
+    `date_ts`, mis à jour à chaque modification : un autre processus ne peut donc
+    pas resservir une version périmée.
+
+    :param template: L'instance du modèle Template.
+    """
+    key = (template.id, template.date_ts)
+    compiled = _compiled_templates.get(key)
+    if compiled is None:
+        compiled = CompiledTemplate(template.subject, template.body)
+        _compiled_templates.set(key, compiled)
+    return compiled
+
+
+def invalidate_template(template_id: int):
+    """
+    Retire du cache toutes les versions compilées d'un template.
+    """
+    _compiled_templates.discard_where(lambda key: key[0] == template_id)
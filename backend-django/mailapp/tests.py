@@ -1,3 +1,1534 @@
-from django.test import TestCase
+import asyncio
+import base64
+import json
+import quopri
+import re
+import smtplib
+import socket
+import ssl
+import threading
+import time
+import unittest
+from contextlib import nullcontext
+from datetime import timedelta
+from imaplib import IMAP4
+from email import message_from_bytes, policy
+from types import SimpleNamespace
+from unittest import mock
+from asgiref.sync import async_to_sync
+from django.db import connection
+from django.test import AsyncRequestFactory, SimpleTestCase, TestCase, override_settings
+from django.utils.timezone import now
+from .exceptions import (
+    ConnectionPoolTimeoutException, InvalidTargetsException, PermanentSendException, RemoteServerSMTPException,
+    SMTPAuthentificationException, SuppressedRecipientException, TransientSendException
+)
+from .mailbox import aiter_stream, decode_part, fetch_attributes, fetch_summaries, list_fetch_items, stream_part, with_imap_session
+from .deliverylog import DeliveryLog
+from .connections import ConnectionPool, imap_pool, smtp_pool
+from .mailer import Mailer
+from .membership import apply_membership_delta, import_recipients, parse_recipients, replace_members
+from .mailsync import folders_overview, index_bodies, list_messages, sync_folder
+from .mime import PreparedMessage
+from .models import CampaignMail, CampaignStats, DeliveryRecord, Email, MailboxFolderState, MailboxMessage, Mail, Suppression
+from .probe import _probe_cache, probe_many, probe_smtp
+from .outbox import _record_failure, adeliver, claim_batch, deliver, retry_delay
+from .sender import ParallelCampaignSender
+from .suppression import SuppressionList
+from .templating import CompiledTemplate, get_compiled_template, invalidate_template
+from .tls import TLSSessionCache, shared_context, starttls
+from .throttle import HostThrottle, TokenBucket, host_throttles
+from .validation import AcceptAllResolver, domain_checker, normalize_email, validate_emails
+from .views import AsyncSendEmailView, AsyncTestSMTPView
 
-# Create your tests here.
+# Les mises à jour ensemblistes (unnest, = ANY) sont écrites pour Postgres
+requires_postgres = unittest.skipUnless(connection.vendor == 'postgresql', "requires PostgreSQL")
+
+
+class RejectDomainResolver:
+    # Résolveur de test : seul example.org est déclaré inexistant
+    def accepts_mail(self, domain):
+        return domain != 'example.org'
+
+
+class AcceptAllDomainsMixin:
+    # Vérification des domaines sans réseau
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(domain_checker, '_resolver', AcceptAllResolver())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        domain_checker.clear()
+        self.addCleanup(domain_checker.clear)
+
+
+class DecodePartTests(SimpleTestCase):
+    def test_truncated_base64_is_decoded(self):
+        """Une partie base64 coupée à MAILBOX_BODY_MAX_BYTES n'est pas vidée"""
+        encoded = base64.encodebytes(('Bonjour ' * 200).encode('utf-8'))
+        for cut in range(len(encoded) - 8, len(encoded)):
+            decoded = decode_part(encoded[:cut], 'base64', 'utf-8')
+            self.assertTrue(decoded.startswith('Bonjour Bonjour'), cut)
+
+    def test_quoted_printable(self):
+        self.assertEqual(decode_part(b'caf=C3=A9', 'quoted-printable', 'utf-8'), 'café')
+
+
+class FetchAttributesTests(SimpleTestCase):
+    def test_bodystructure_inside_header_literal_is_ignored(self):
+        data = [
+            (b'1 (UID 7 FLAGS (\\Seen) BODY[HEADER] {30}', b'Subject: BODYSTRUCTURE (x)\r\n\r\n'),
+            b' BODYSTRUCTURE ("text" "plain" ("charset" "utf-8") NIL NIL "base64" 120 2 NIL NIL NIL))',
+        ]
+        attributes = fetch_attributes(data)[1]
+        self.assertEqual(attributes['UID'], '7')
+        self.assertEqual(attributes['BODYSTRUCTURE'][:2], ['text', 'plain'])
+
+    def test_missing_bodystructure(self):
+        self.assertNotIn('BODYSTRUCTURE', fetch_attributes([b'1 (UID 7 FLAGS ())'])[1])
+
+
+class ReplaceMembersGuardTests(SimpleTestCase):
+    def test_empty_list_is_refused(self):
+        """Une liste vide ne vide pas la campagne"""
+        with self.assertRaises(InvalidTargetsException) as context:
+            replace_members(1, [])
+        self.assertEqual(context.exception.invalid, [])
+
+    def test_list_without_valid_address_is_refused(self):
+        with self.assertRaises(InvalidTargetsException) as context:
+            replace_members(1, ['not-an-email', 'a@'])
+        self.assertEqual(context.exception.invalid, ['not-an-email', 'a@'])
+
+
+@requires_postgres
+class MembershipTests(AcceptAllDomainsMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.campaign = CampaignMail.objects.create(name='Test')
+        Mail.objects.bulk_create([
+            Mail(campaign=self.campaign, email=email) for email in ('a@example.com', 'b@example.com')
+        ])
+
+    def members(self):
+        return set(self.campaign.mails.values_list('email', flat=True))
+
+    def test_replace_members(self):
+        report = replace_members(self.campaign.id, ['b@example.com', 'c@example.com', 'invalid'])
+        self.assertEqual(report, {'added': 1, 'removed': 1, 'invalid': ['invalid']})
+        self.assertEqual(self.members(), {'b@example.com', 'c@example.com'})
+
+    def test_replace_members_refused_keeps_members(self):
+        with self.assertRaises(InvalidTargetsException):
+            replace_members(self.campaign.id, ['invalid'])
+        self.assertEqual(self.members(), {'a@example.com', 'b@example.com'})
+
+    def test_replace_keeps_member_whose_domain_lookup_fails(self):
+        """Un domaine déclaré inexistant n'est pas ajouté, mais un membre existant n'est pas supprimé"""
+        Mail.objects.create(campaign=self.campaign, email='d@example.org')
+        with mock.patch.object(domain_checker, '_resolver', RejectDomainResolver()):
+            report = replace_members(self.campaign.id, ['a@example.com', 'd@example.org', 'e@example.org'])
+        self.assertEqual(report['removed'], 1)
+        self.assertEqual(report['added'], 0)
+        self.assertEqual(self.members(), {'a@example.com', 'd@example.org'})
+
+    def test_delta_with_empty_lists_changes_nothing(self):
+        report = apply_membership_delta(self.campaign.id, [], [])
+        self.assertEqual(report, {'added': 0, 'removed': 0, 'invalid': []})
+        self.assertEqual(self.members(), {'a@example.com', 'b@example.com'})
+
+    def test_delta(self):
+        report = apply_membership_delta(self.campaign.id, add=['c@example.com', 'a@example.com'], remove=['b@example.com'])
+        self.assertEqual(report, {'added': 1, 'removed': 1, 'invalid': []})
+        self.assertEqual(self.members(), {'a@example.com', 'c@example.com'})
+
+
+class CampaignListingTests(TestCase):
+    def setUp(self):
+        self.campaigns = [CampaignMail.objects.create(name=f'Campagne {index}') for index in range(5)]
+        Mail.objects.bulk_create([
+            Mail(campaign=campaign, email=f'user{member}@example.com')
+            for index, campaign in enumerate(self.campaigns) for member in range(index)
+        ])
+
+    def test_pages_with_counts(self):
+        """Une page de campagnes coûte une seule requête, quel que soit le nombre d'emails"""
+        with self.assertNumQueries(1):
+            response = self.client.get('/mail/campaigns/?limit=3')
+        data = response.json()
+        self.assertEqual([campaign['name'] for campaign in data['campaigns']],
+                         ['Campagne 4', 'Campagne 3', 'Campagne 2'])
+        self.assertEqual([campaign['email_count'] for campaign in data['campaigns']], [4, 3, 2])
+        self.assertNotIn('emails', data['campaigns'][0])
+        data = self.client.get(f"/mail/campaigns/?limit=3&cursor={data['next_cursor']}").json()
+        self.assertEqual([campaign['email_count'] for campaign in data['campaigns']], [1, 0])
+        self.assertIsNone(data['next_cursor'])
+
+    def test_single_campaign(self):
+        data = self.client.get(f'/mail/campaigns/{self.campaigns[3].id}/').json()
+        self.assertEqual(data['campaign']['email_count'], 3)
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get('/mail/campaigns/?cursor=abc').status_code, 400)
+
+    def test_members_pages(self):
+        url = f'/mail/campaigns/{self.campaigns[4].id}/members/'
+        pages, cursor = [], None
+        while True:
+            data = self.client.get(url, {'limit': 3, **({'cursor': cursor} if cursor else {})}).json()
+            pages.append([member['email'] for member in data['members']])
+            cursor = data['next_cursor']
+            if cursor is None:
+                break
+        self.assertEqual(pages, [['user0@example.com', 'user1@example.com', 'user2@example.com'],
+                                 ['user3@example.com']])
+
+    def test_members_of_unknown_campaign(self):
+        self.assertEqual(self.client.get('/mail/campaigns/999/members/').status_code, 404)
+
+
+class ParseRecipientsTests(SimpleTestCase):
+    def parse(self, text):
+        return list(parse_recipients(text.encode('utf-8').splitlines(keepends=True)))
+
+    def test_one_address_per_line(self):
+        self.assertEqual(self.parse('\ufeffa@Example.COM\n\n  b@example.com \nnot an address\n'), [
+            ('a@example.com', {}, 'a@Example.COM'),
+            ('b@example.com', {}, 'b@example.com'),
+            (None, {}, 'not an address'),
+        ])
+
+    def test_csv_columns_become_variables(self):
+        rows = self.parse('first_name;Email;city\nAlice;a@example.com;\nBob;b@example.com;Lyon\n')
+        self.assertEqual([(email, variables) for email, variables, _ in rows], [
+            ('a@example.com', {'first_name': 'Alice'}),
+            ('b@example.com', {'first_name': 'Bob', 'city': 'Lyon'}),
+        ])
+
+    def test_csv_without_email_header(self):
+        rows = self.parse('a@example.com,Alice\nb@example.com,Bob\n')
+        self.assertEqual([email for email, _, _ in rows], ['a@example.com', 'b@example.com'])
+
+    def test_lines_read_lazily(self):
+        """Le fichier n'est pas lu d'avance : la mémoire ne dépend pas de sa taille"""
+        read = []
+
+        def lines():
+            for index in range(1000):
+                read.append(index)
+                yield f'user{index}@example.com\n'.encode()
+
+        rows = parse_recipients(lines())
+        next(rows)
+        self.assertLess(len(read), 3)
+
+
+@requires_postgres
+class ImportRecipientsTests(AcceptAllDomainsMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.campaign = CampaignMail.objects.create(name='Campagne')
+        Mail.objects.create(campaign=self.campaign, email='existing@example.com')
+
+    def test_import(self):
+        lines = [b'email,first_name\n', b'a@example.com,Alice\n', b'existing@example.com,\n',
+                 b'a@EXAMPLE.com,Alice\n', b'invalid,\n', b'b@example.com,Bob\n']
+        report = import_recipients(self.campaign.id, lines, chunk_size=2)
+        self.assertEqual((report['accepted'], report['duplicates'], report['invalid']), (2, 2, 1))
+        self.assertEqual(report['invalid_samples'], ['invalid'])
+        self.assertEqual(
+            dict(Mail.objects.filter(campaign=self.campaign).values_list('email', 'variables')),
+            {'existing@example.com': {}, 'a@example.com': {'first_name': 'Alice'}, 'b@example.com': {'first_name': 'Bob'}},
+        )
+
+    @override_settings(EMAIL_VALIDATION_CHECK_DOMAINS=True)
+    def test_unknown_domain_rejected(self):
+        with mock.patch.object(domain_checker, '_resolver', RejectDomainResolver()):
+            report = import_recipients(self.campaign.id, [b'a@example.org\n', b'b@example.com\n'])
+        self.assertEqual((report['accepted'], report['invalid']), (1, 1))
+        self.assertEqual(report['invalid_samples'], ['a@example.org'])
+
+    def test_import_view(self):
+        response = self.client.post(f'/mail/campaigns/{self.campaign.id}/import/',
+                                    data=b'a@example.com\nb@example.com\n', content_type='text/plain')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['accepted'], 2)
+
+
+class ValidateEmailsViewTests(AcceptAllDomainsMixin, SimpleTestCase):
+    def test_check_domains_must_be_boolean(self):
+        response = self.client.post(
+            '/mail/validate/', {'emails': ['a@example.com'], 'check_domains': 'false'}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_validate(self):
+        response = self.client.post(
+            '/mail/validate/', {'emails': ['A@Example.COM', 'nope'], 'check_domains': True}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result['email'] for result in response.json()['results']], ['A@example.com', None])
+
+
+
+class NormalizeEmailTests(AcceptAllDomainsMixin, SimpleTestCase):
+    def test_normalize(self):
+        """Chevrons et point final retirés, domaine en minuscules et en IDNA, partie locale intacte"""
+        self.assertEqual(normalize_email(' <Jean.Dupont@Exemple.FR.> '), 'Jean.Dupont@exemple.fr')
+        self.assertEqual(normalize_email('jean@École.fr'), 'jean@xn--cole-9oa.fr')
+
+    def test_invalid(self):
+        for value in ('', 'jean', '@exemple.fr', 'jean@', 'jean..dupont@exemple.fr', 'jean@exemple', 'a' * 65 + '@exemple.fr'):
+            self.assertIsNone(normalize_email(value), value)
+
+    def test_validate_emails(self):
+        results = validate_emails(['A@Example.com', 'nope', 42, 'b@example.org'], check_domains=True)
+        self.assertEqual(
+            [(result['email'], result['valid'], result['reason']) for result in results],
+            [('A@example.com', True, None), (None, False, 'syntax'), (None, False, 'syntax'), ('b@example.org', True, None)],
+        )
+
+    def test_validate_emails_rejects_unknown_domain(self):
+        with mock.patch.object(domain_checker, '_resolver', RejectDomainResolver()):
+            results = validate_emails(['a@example.com', 'b@example.org'], check_domains=True)
+        self.assertEqual([result['reason'] for result in results], [None, 'domain'])
+
+
+class SuppressionListTests(TestCase):
+    def setUp(self):
+        self.suppressions = SuppressionList(refresh_interval=3600)
+
+    def test_loaded_on_first_use(self):
+        Suppression.objects.create(email='a@example.com')
+        self.assertTrue(self.suppressions.is_suppressed(' A@Example.com'))
+        self.assertFalse(self.suppressions.is_suppressed('b@example.com'))
+
+    def test_incremental_refresh(self):
+        self.suppressions.refresh()
+        Suppression.objects.create(email='a@example.com')
+        self.suppressions.refresh()
+        self.assertFalse(self.suppressions.is_suppressed('a@example.com'), "refresh_interval not elapsed")
+        self.suppressions.refresh(force=True)
+        self.assertTrue(self.suppressions.is_suppressed('a@example.com'))
+
+    def test_deleted_rows_trigger_reload(self):
+        """Une ligne supprimée hors de la liste (admin, autre processus) n'est plus exclue après le rafraîchissement"""
+        Suppression.objects.create(email='a@example.com')
+        self.suppressions.refresh()
+        Suppression.objects.filter(email='a@example.com').delete()
+        Suppression.objects.create(email='b@example.com')
+        self.suppressions.refresh(force=True)
+        self.assertFalse(self.suppressions.is_suppressed('a@example.com'))
+        self.assertTrue(self.suppressions.is_suppressed('b@example.com'))
+
+    def test_add_and_remove(self):
+        self.assertEqual(self.suppressions.add(['A@example.com', 'a@example.com ', '']), 1)
+        self.assertTrue(self.suppressions.is_suppressed('a@example.com'))
+        self.assertEqual(self.suppressions.remove(['A@Example.com']), 1)
+        self.assertFalse(self.suppressions.is_suppressed('a@example.com'))
+
+
+class DeliveryLogTests(TestCase):
+    def setUp(self):
+        self.campaign = CampaignMail.objects.create(name='Campagne')
+        # Pas d'écriture par le thread d'arrière-plan pendant le test
+        self.log = DeliveryLog(batch_size=3, flush_interval=3600 * 1000)
+
+    def record(self, status, campaign_id=None):
+        self.log.record('a@example.com', status, latency=0.25, campaign_id=campaign_id or self.campaign.id)
+
+    def test_written_by_batch(self):
+        """Les résultats sont écrits par paquets, pas à chaque envoi"""
+        self.record(DeliveryRecord.STATUS_SENT)
+        self.record(DeliveryRecord.STATUS_FAILED)
+        self.assertEqual(DeliveryRecord.objects.count(), 0)
+        self.record(DeliveryRecord.STATUS_SENT)
+        self.assertEqual(DeliveryRecord.objects.count(), 3)
+        self.assertEqual(DeliveryRecord.objects.first().latency_ms, 250)
+        stats = CampaignStats.objects.get(campaign=self.campaign)
+        self.assertEqual((stats.sent, stats.deferred, stats.failed), (2, 0, 1))
+
+    def test_counters_incremented(self):
+        CampaignStats.objects.create(campaign=self.campaign, sent=10)
+        self.record(DeliveryRecord.STATUS_DEFERRED)
+        self.record(DeliveryRecord.STATUS_SENT)
+        self.assertEqual(self.log.flush(), 2)
+        self.assertEqual(self.log.flush(), 0)
+        stats = CampaignStats.objects.get(campaign=self.campaign)
+        self.assertEqual((stats.sent, stats.deferred, stats.failed), (11, 1, 0))
+
+    def test_stats_view_includes_buffered_records(self):
+        self.record(DeliveryRecord.STATUS_SENT)
+        with mock.patch('mailapp.views.delivery_log', self.log):
+            data = self.client.get(f'/mail/campaigns/{self.campaign.id}/stats/').json()
+        self.assertEqual((data['sent'], data['deferred'], data['failed']), (1, 0, 0))
+
+    def test_stats_view_without_sends(self):
+        # Compteurs lus directement : le journal des envois n'est pas parcouru
+        with mock.patch('mailapp.views.delivery_log', self.log), self.assertNumQueries(2):
+            data = self.client.get(f'/mail/campaigns/{self.campaign.id}/stats/').json()
+        self.assertEqual((data['sent'], data['updated_at']), (0, None))
+        self.assertEqual(self.client.get('/mail/campaigns/999/stats/').status_code, 404)
+
+
+class SendMailSuppressionTests(TestCase):
+    def test_address_suppressed_after_start_is_not_mailed(self):
+        """Un worker de longue durée voit les exclusions ajoutées par un autre processus"""
+        suppressions = SuppressionList(refresh_interval=0)
+        suppressions.refresh()
+        Suppression.objects.create(email='a@example.com')
+        email_obj = {
+            'sender': 'Test', 'recipient': 'a@example.com', 'subject': 'Sujet', 'body': 'Corps',
+            'smtp_auth': {'smtp_server': 'smtp.example.com', 'smtp_port': 587, 'smtp_user': 'user', 'smtp_password': 'secret'},
+        }
+        with mock.patch('mailapp.mailer.suppression_list', suppressions), \
+                mock.patch('mailapp.mailer.smtp_pool.connection') as connection_mock:
+            with self.assertRaises(SuppressedRecipientException):
+                Mailer().send_mail(email_obj)
+        connection_mock.assert_not_called()
+
+
+@override_settings(OUTBOX_RETRY_BASE_SECONDS=60, OUTBOX_RETRY_MAX_SECONDS=3600, OUTBOX_MAX_ATTEMPTS=3)
+class RetryTests(TestCase):
+    def test_retry_delay_bounds(self):
+        for attempts, delay in ((1, 60), (2, 120), (3, 240), (20, 3600)):
+            for _ in range(20):
+                self.assertTrue(delay / 2 <= retry_delay(attempts) <= delay, attempts)
+
+    def record_failure(self, exc, attempts):
+        email = Email.objects.create(
+            sender='Test', recipient='a@example.com', subject='Sujet', body='Corps',
+            smtp_auth={'smtp_server': 'smtp.example.com', 'smtp_user': 'user'}, smtp_secret='plain:secret',
+            status=Email.STATUS_SENDING, attempts=attempts,
+        )
+        report = {'sent': 0, 'failed': 0, 'retried': 0, 'dead': 0}
+        _record_failure(email, exc, report)
+        email.refresh_from_db()
+        return email, report
+
+    def test_permanent_failure(self):
+        email, report = self.record_failure(PermanentSendException('Mailbox unavailable', smtp_code=550), attempts=1)
+        self.assertEqual((email.status, email.smtp_code, email.smtp_secret), (Email.STATUS_FAILED, 550, ''))
+        self.assertEqual(report['failed'], 1)
+
+    def test_transient_failure_is_rescheduled(self):
+        started = now()
+        email, report = self.record_failure(TransientSendException('Try again later', smtp_code=451), attempts=2)
+        self.assertEqual((email.status, email.smtp_code), (Email.STATUS_PENDING, 451))
+        self.assertTrue(started + timedelta(seconds=60) <= email.next_attempt_at <= now() + timedelta(seconds=120))
+        self.assertEqual(report['retried'], 1)
+
+    def test_last_attempt_goes_to_dead_letters(self):
+        """Les rejets gardent le mot de passe chiffré pour pouvoir être remis en file"""
+        email, report = self.record_failure(TransientSendException('Try again later', smtp_code=451), attempts=3)
+        self.assertEqual((email.status, email.smtp_secret), (Email.STATUS_DEAD, 'plain:secret'))
+        self.assertEqual(report['dead'], 1)
+
+
+class FakeSMTP:
+    # Session smtplib sans réseau : les destinataires en unknown@ sont refusés (550)
+    def __init__(self, host, port, timeout=None):
+        self.host, self.port, self.timeout = host, port, timeout
+        self.sock = mock.Mock()
+        self.messages = []
+        self.logins = 0
+        self.closed = False
+        self.drop_next = False
+
+    def login(self, user, password):
+        if password == 'wrong':
+            raise smtplib.SMTPAuthenticationError(535, b'Authentication failed')
+        self.logins += 1
+
+    def noop(self):
+        if self.closed:
+            raise smtplib.SMTPServerDisconnected('Connection unexpectedly closed')
+        return 250, b'OK'
+
+    def sendmail(self, from_addr, to_addrs, msg):
+        if self.drop_next:
+            self.closed = True
+            raise smtplib.SMTPServerDisconnected('Connection unexpectedly closed')
+        if to_addrs[0].startswith('unknown@'):
+            raise smtplib.SMTPRecipientsRefused({to_addrs[0]: (550, b'No such user')})
+        self.messages.append((to_addrs, msg))
+        return {}
+
+    def send_message(self, msg):
+        return self.sendmail(msg['From'], [msg['To']], msg.as_bytes())
+
+    def quit(self):
+        self.closed = True
+
+    close = quit
+
+
+class FakeSMTPMixin:
+    # Sessions SMTP du pool remplacées par des FakeSMTP, listées dans self.sessions
+    smtp_auth = {'smtp_server': 'smtp.example.com', 'smtp_port': 587, 'is_tls': False,
+                 'smtp_user': 'user@example.com', 'smtp_passwd': 'secret'}
+
+    def setUp(self):
+        super().setUp()
+        self.sessions = []
+
+        def connect(host, port, timeout=None):
+            session = FakeSMTP(host, port, timeout)
+            self.sessions.append(session)
+            return session
+
+        for target, value in (('mailapp.connections.smtplib.SMTP', connect),
+                              ('mailapp.mailer.delivery_log', mock.Mock())):
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        smtp_pool.clear()
+        self.addCleanup(smtp_pool.clear)
+        self.addCleanup(host_throttles.clear)
+
+
+class FakePool(ConnectionPool):
+    # Pool de test : les connexions sont des dictionnaires, `alive` faux simule une coupure
+    def __init__(self, **kwargs):
+        super().__init__(**{'max_size': 2, 'idle_timeout': 60, 'acquire_timeout': 0.1, **kwargs})
+        self.opened = []
+
+    def _key(self, params):
+        return params['host']
+
+    def _connect(self, params):
+        conn = {'alive': True, 'closed': False}
+        self.opened.append(conn)
+        return conn
+
+    def _is_alive(self, conn):
+        return conn['alive']
+
+    def _close(self, conn):
+        conn['closed'] = True
+
+
+class ConnectionPoolTests(SimpleTestCase):
+    params = {'host': 'smtp.example.com'}
+
+    def test_released_connection_is_reused(self):
+        pool = FakePool()
+        with pool.connection(self.params) as pooled:
+            first = pooled.conn
+        with pool.connection(self.params) as pooled:
+            self.assertIs(pooled.conn, first)
+        self.assertEqual(len(pool.opened), 1)
+
+    def test_connections_are_not_shared_between_keys(self):
+        pool = FakePool()
+        with pool.connection(self.params), pool.connection({'host': 'smtp.example.org'}):
+            pass
+        self.assertEqual(len(pool.opened), 2)
+
+    def test_acquire_times_out_when_pool_is_full(self):
+        pool = FakePool()
+        borrowed = [pool.acquire(self.params), pool.acquire(self.params)]
+        with self.assertRaises(ConnectionPoolTimeoutException):
+            pool.acquire(self.params)
+        pool.release(borrowed[0])
+        self.assertIs(pool.acquire(self.params).conn, borrowed[0].conn)
+
+    def test_dead_connection_is_replaced(self):
+        pool = FakePool()
+        with pool.connection(self.params) as pooled:
+            pooled.conn['alive'] = False
+        with pool.connection(self.params) as pooled:
+            self.assertTrue(pooled.conn['alive'])
+        self.assertTrue(pool.opened[0]['closed'])
+        self.assertEqual(len(pool.opened), 2)
+
+    def test_idle_connection_expires(self):
+        pool = FakePool(idle_timeout=0)
+        with pool.connection(self.params):
+            pass
+        time.sleep(0.01)
+        with pool.connection(self.params):
+            pass
+        self.assertEqual(len(pool.opened), 2)
+        self.assertTrue(pool.opened[0]['closed'])
+
+    def test_network_error_discards_connection(self):
+        """Une coupure réseau dans le bloc ferme la connexion et libère sa place"""
+        pool = FakePool(max_size=1)
+        with self.assertRaises(ConnectionResetError):
+            with pool.connection(self.params):
+                raise ConnectionResetError()
+        self.assertTrue(pool.opened[0]['closed'])
+        with pool.connection(self.params) as pooled:
+            self.assertIs(pooled.conn, pool.opened[1])
+
+    def test_failed_connect_frees_its_place(self):
+        pool = FakePool(max_size=1)
+        with mock.patch.object(pool, '_connect', side_effect=OSError('Connection refused')):
+            with self.assertRaises(OSError):
+                pool.acquire(self.params)
+        with pool.connection(self.params):
+            pass
+
+
+class SMTPConnectionPoolTests(FakeSMTPMixin, SimpleTestCase):
+    def test_other_password_gets_its_own_session(self):
+        """Une session n'est jamais resservie avec d'autres identifiants"""
+        with smtp_pool.connection(self.smtp_auth):
+            pass
+        with smtp_pool.connection({**self.smtp_auth, 'smtp_passwd': 'other'}):
+            pass
+        with smtp_pool.connection(self.smtp_auth):
+            pass
+        self.assertEqual(len(self.sessions), 2)
+
+    @override_settings(SMTP_CONNECT_TIMEOUT=3, SMTP_READ_TIMEOUT=7)
+    def test_timeouts(self):
+        with smtp_pool.connection(self.smtp_auth):
+            pass
+        self.assertEqual(self.sessions[0].timeout, 3)
+        self.sessions[0].sock.settimeout.assert_called_once_with(7)
+
+    def test_smtp_error_keeps_session(self):
+        # Un refus avec code de réponse laisse la session utilisable
+        with self.assertRaises(smtplib.SMTPRecipientsRefused):
+            with smtp_pool.connection(self.smtp_auth) as pooled:
+                pooled.conn.sendmail('user@example.com', ['unknown@example.com'], b'')
+        with smtp_pool.connection(self.smtp_auth):
+            pass
+        self.assertEqual(len(self.sessions), 1)
+
+
+class SendCampaignTests(FakeSMTPMixin, TestCase):
+    def send(self, recipients, **kwargs):
+        template = CompiledTemplate('Bonjour {{ name }}', 'Corps pour {{ email }}')
+        return Mailer().send_campaign(self.smtp_auth, 'Test', template,
+                                      ((recipient, {'name': 'Alice'}) for recipient in recipients), **kwargs)
+
+    def test_campaign_sent_over_one_session(self):
+        """Une seule connexion et une seule authentification pour toute la campagne"""
+        report = self.send([f'user{index}@example.com' for index in range(5)])
+        self.assertEqual((report['sent'], report['failed']), (5, 0))
+        self.assertEqual(len(self.sessions), 1)
+        self.assertEqual((self.sessions[0].logins, len(self.sessions[0].messages)), (1, 5))
+        to_addrs, message = self.sessions[0].messages[0]
+        self.assertEqual(to_addrs, ['user0@example.com'])
+        self.assertIn(b'To: user0@example.com', message)
+        self.assertIn(b'Subject: Bonjour Alice', message)
+
+    def test_session_returned_to_pool(self):
+        self.send(['a@example.com'])
+        self.send(['b@example.com'])
+        self.assertEqual(len(self.sessions), 1, "the second campaign reuses the pooled session")
+        self.assertFalse(self.sessions[0].closed)
+
+    def test_refused_recipient_does_not_abort_campaign(self):
+        report = self.send(['a@example.com', 'unknown@example.com', 'b@example.com'])
+        self.assertEqual((report['sent'], report['failed']), (2, 1))
+        self.assertEqual(report['failures'][0]['smtp_code'], 550)
+        self.assertEqual(len(self.sessions), 1)
+
+    def test_reconnect_every(self):
+        report = self.send([f'user{index}@example.com' for index in range(5)], reconnect_every=2)
+        self.assertEqual(report['sent'], 5)
+        self.assertEqual([len(session.messages) for session in self.sessions], [2, 2, 1])
+
+    def test_dropped_session_is_reopened(self):
+        """Relais qui coupe la connexion : la session est rouverte et le message retenté une fois"""
+        recipients = iter(['a@example.com', 'b@example.com', 'c@example.com'])
+
+        def recipients_dropping_after_first():
+            yield next(recipients)
+            self.sessions[0].drop_next = True
+            yield from recipients
+
+        report = self.send(recipients_dropping_after_first())
+        self.assertEqual(report['sent'], 3)
+        self.assertEqual([len(session.messages) for session in self.sessions], [1, 2])
+
+
+class TokenBucketTests(SimpleTestCase):
+    def test_burst_then_wait(self):
+        bucket = TokenBucket(rate=2)
+        self.assertEqual((bucket.try_acquire(), bucket.try_acquire()), (0, 0))
+        self.assertAlmostEqual(bucket.try_acquire(), 0.5, delta=0.05)
+
+    def test_zero_rate_is_unlimited(self):
+        bucket = TokenBucket(rate=0)
+        self.assertEqual([bucket.try_acquire() for _ in range(100)], [0] * 100)
+
+
+@override_settings(AIMD_DECREASE_FACTOR=0.5, AIMD_INCREASE_EVERY=3, AIMD_RATE_STEP=1, AIMD_COOLDOWN=60)
+class HostThrottleTests(SimpleTestCase):
+    def setUp(self):
+        self.throttle = HostThrottle('smtp.example.com', max_concurrency=8, max_rate=10, min_rate=2)
+
+    def state(self):
+        return self.throttle.concurrency, self.throttle.rate
+
+    def test_throttle_codes_halve_concurrency_and_rate(self):
+        self.throttle.record_failure(451, transient=True)
+        self.assertEqual(self.state(), (4, 5))
+        self.assertEqual(self.throttle.deferred, 1)
+
+    def test_burst_of_refusals_counts_once(self):
+        """Les refus reçus pendant AIMD_COOLDOWN ne réduisent pas une seconde fois"""
+        for _ in range(5):
+            self.throttle.record_failure(421, transient=True)
+        self.assertEqual(self.state(), (4, 5))
+
+    @override_settings(AIMD_COOLDOWN=0)
+    def test_rate_floor(self):
+        for _ in range(10):
+            self.throttle.record_failure(421, transient=True)
+        self.assertEqual(self.state(), (1, 2))
+
+    def test_other_failures_do_not_throttle(self):
+        self.throttle.record_failure(450, transient=True)
+        self.throttle.record_failure(550, transient=False)
+        self.throttle.record_failure(None, transient=True)
+        self.assertEqual(self.state(), (8, 10))
+        self.assertEqual((self.throttle.deferred, self.throttle.failed), (2, 1))
+
+    def test_additive_increase(self):
+        self.throttle.record_failure(421, transient=True)
+        for _ in range(5):
+            self.throttle.record_success()
+        self.assertEqual(self.state(), (5, 6))
+        self.throttle.record_failure(450, transient=True)
+        self.throttle.record_success()
+        self.assertEqual(self.state(), (6, 7), "a non-throttling deferral keeps the success streak")
+
+    def test_increase_capped(self):
+        for _ in range(30):
+            self.throttle.record_success()
+        self.assertEqual(self.state(), (8, 10))
+
+    def test_slot_limits_concurrency(self):
+        throttle = HostThrottle('smtp.example.com', max_concurrency=2, max_rate=0, min_rate=0)
+        active, peak = [0], [0]
+        lock = threading.Lock()
+
+        def send():
+            with throttle.slot():
+                with lock:
+                    active[0] += 1
+                    peak[0] = max(peak[0], active[0])
+                time.sleep(0.02)
+                with lock:
+                    active[0] -= 1
+
+        threads = [threading.Thread(target=send) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(peak[0], 2)
+        self.assertEqual(throttle.to_dict()['active'], 0)
+
+
+class CompiledTemplateTests(SimpleTestCase):
+    def test_render(self):
+        template = CompiledTemplate('Bonjour {{ first_name }}', '<p>{{email}} / {{ first_name }}</p>')
+        self.assertEqual(template.variables, {'first_name', 'email'})
+        self.assertEqual(template.render({'first_name': 'Alice', 'email': 'a@example.com'}),
+                         ('Bonjour Alice', '<p>a@example.com / Alice</p>'))
+
+    def test_missing_variable_rendered_empty(self):
+        self.assertEqual(CompiledTemplate('Sujet', 'Bonjour {{ first_name }}!').render_body({}), 'Bonjour !')
+
+    def test_literal_braces_kept(self):
+        """Les accolades du CSS ou d'un JSON ne sont pas prises pour des variables"""
+        body = '<style>p { color: red }</style>{x} {{ email }} {{ not a variable }}'
+        self.assertEqual(CompiledTemplate('Sujet', body).render_body({'email': 'a@example.com'}),
+                         '<style>p { color: red }</style>{x} a@example.com {{ not a variable }}')
+
+    def test_template_without_variables(self):
+        template = CompiledTemplate('Sujet', 'Corps')
+        self.assertIs(template.render_body({'email': 'a@example.com'}), template.body)
+
+
+class CompiledTemplateCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.template = SimpleNamespace(id=4242, date_ts=1000, subject='Sujet', body='Bonjour {{ email }}')
+        self.addCleanup(invalidate_template, self.template.id)
+
+    def test_compiled_once(self):
+        self.assertIs(get_compiled_template(self.template), get_compiled_template(self.template))
+
+    def test_modified_template_recompiled(self):
+        compiled = get_compiled_template(self.template)
+        self.template.date_ts, self.template.body = 1001, 'Bonsoir {{ email }}'
+        self.assertIsNot(get_compiled_template(self.template), compiled)
+        self.assertEqual(get_compiled_template(self.template).render_body({'email': 'a'}), 'Bonsoir a')
+
+    def test_invalidate(self):
+        compiled = get_compiled_template(self.template)
+        invalidate_template(self.template.id)
+        self.assertIsNot(get_compiled_template(self.template), compiled)
+
+
+class PreparedMessageTests(SimpleTestCase):
+    smtp_auth = {'smtp_server': 'smtp.example.com', 'smtp_user': 'user@example.com'}
+
+    def render(self, template, recipient='a@example.com', context=None, **kwargs):
+        prepared = PreparedMessage(self.smtp_auth, 'Équipe', template, is_html=False, **kwargs)
+        return message_from_bytes(prepared.render(recipient, context or {}), policy=policy.default)
+
+    def test_headers(self):
+        message = self.render(CompiledTemplate('Réunion', 'Corps'))
+        self.assertEqual(message['To'], 'a@example.com')
+        self.assertEqual(message['Subject'], 'Réunion')
+        self.assertEqual(message['From'].addresses[0].display_name, 'Équipe')
+        self.assertEqual(message['From'].addresses[0].addr_spec, 'user@example.com')
+        self.assertTrue(message['Message-ID'].endswith('@smtp.example.com>'))
+        self.assertIsNotNone(message['Date'].datetime)
+        self.assertEqual(message.get_content_type(), 'multipart/alternative')
+        self.assertEqual(message.get_body(('plain',)).get_content(), 'Corps')
+
+    def test_per_recipient_headers(self):
+        """Seuls To, Message-ID et Date changent d'un destinataire à l'autre"""
+        prepared = PreparedMessage(self.smtp_auth, 'Test', CompiledTemplate('Sujet', 'Corps'), is_html=False)
+        first, second = prepared.render('a@example.com', {}), prepared.render('b@example.com', {})
+        first, second = message_from_bytes(first), message_from_bytes(second)
+        self.assertEqual((first['To'], second['To']), ('a@example.com', 'b@example.com'))
+        self.assertNotEqual(first['Message-ID'], second['Message-ID'])
+        self.assertEqual(first.get_payload(0).get_payload(), second.get_payload(0).get_payload())
+
+    def test_variables_in_subject_and_body(self):
+        message = self.render(CompiledTemplate('Bonjour {{ name }}', 'Cher {{ name }}, {{ email }}'),
+                              context={'name': 'Zoé', 'email': 'a@example.com'})
+        self.assertEqual(message['Subject'], 'Bonjour Zoé')
+        self.assertEqual(message.get_body(('plain',)).get_content(), 'Cher Zoé, a@example.com')
+
+    def test_html_with_text_alternative(self):
+        prepared = PreparedMessage(self.smtp_auth, 'Test', CompiledTemplate('Sujet', '<p>Bonjour {{ name }}</p>'),
+                                   is_html=True, text_template=CompiledTemplate('Sujet', 'Bonjour {{ name }}'))
+        message = message_from_bytes(prepared.render('a@example.com', {'name': 'Alice'}), policy=policy.default)
+        self.assertEqual([part.get_content_type() for part in message.iter_parts()], ['text/plain', 'text/html'])
+        self.assertEqual(message.get_body(('plain',)).get_content(), 'Bonjour Alice')
+        self.assertEqual(message.get_body(('html',)).get_content(), '<p>Bonjour Alice</p>')
+
+
+class MultipartAlternativeTests(SimpleTestCase):
+    smtp_auth = {'smtp_server': 'smtp.example.com', 'smtp_user': 'user@example.com'}
+
+    def test_html_body_gets_text_alternative(self):
+        body = '<html><head><style>p { color: red }</style></head><body><p>Bonjour</p><script>x()</script></body></html>'
+        message = Mailer()._build_message(self.smtp_auth, 'Test', 'a@example.com', 'Sujet', body)
+        self.assertEqual([part.get_content_type() for part in message.get_payload()], ['text/plain', 'text/html'])
+        self.assertEqual(message.get_payload(0).get_payload(decode=True).decode(), 'Bonjour')
+
+    def test_plain_body(self):
+        message = Mailer()._build_message(self.smtp_auth, 'Test', 'a@example.com', 'Sujet', 'Bonjour')
+        self.assertEqual([part.get_content_type() for part in message.get_payload()], ['text/plain'])
+
+    def test_text_version_cached_per_body(self):
+        """La conversion BeautifulSoup n'est faite qu'une fois par corps distinct"""
+        mailer = Mailer()
+        body = f'<p>Corps {time.monotonic_ns()}</p>'
+        with mock.patch.object(mailer, '_convert_html_to_text', wraps=mailer._convert_html_to_text) as convert:
+            for _ in range(3):
+                self.assertEqual(mailer._analyse_body(body), (True, body[3:-4]))
+            self.assertEqual(mailer._analyse_body(body + ' '), (True, body[3:-4]))
+        self.assertEqual(convert.call_count, 2)
+
+
+class HTMLCampaignTests(FakeSMTPMixin, TestCase):
+    def test_text_alternative_rendered_per_recipient(self):
+        template = CompiledTemplate('Sujet', '<p>Bonjour <b>{{ name }}</b></p>')
+        Mailer().send_campaign(self.smtp_auth, 'Test', template, [('a@example.com', {'name': 'Alice'})])
+        message = message_from_bytes(self.sessions[0].messages[0][1], policy=policy.default)
+        self.assertEqual(message.get_body(('plain',)).get_content().split(), ['Bonjour', 'Alice'])
+        self.assertEqual(message.get_body(('html',)).get_content(), '<p>Bonjour <b>Alice</b></p>')
+
+
+class SMTPProbeCacheTests(FakeSMTPMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        _probe_cache.clear()
+        self.addCleanup(_probe_cache.clear)
+
+    def test_connection_cached(self):
+        """Des identifiants validés récemment ne sont pas retestés sur le serveur"""
+        with mock.patch.object(smtp_pool, 'acquire', wraps=smtp_pool.acquire) as acquire:
+            for _ in range(3):
+                response = self.client.post('/mail/testsmtp/', self.smtp_auth, content_type='application/json')
+                self.assertEqual(response.json(), {'ack': True})
+        self.assertEqual(acquire.call_count, 1)
+
+    def test_failed_authentication_not_cached(self):
+        for _ in range(2):
+            response = self.client.post('/mail/testsmtp/', {**self.smtp_auth, 'smtp_passwd': 'wrong'},
+                                        content_type='application/json')
+            self.assertEqual(response.json()['reason'], 'Bad authentication username/password')
+        self.assertEqual(len(self.sessions), 2)
+
+    def test_probe_many(self):
+        profiles = [{**self.smtp_auth, 'smtp_user': f'user{index}@example.com'} for index in range(3)]
+
+        def probe_smtp(smtp_auth):
+            ok = smtp_auth['smtp_user'] != 'user1@example.com'
+            return {'ok': ok, 'phase': None if ok else 'auth', 'error': None, 'timings_ms': {}}
+
+        with mock.patch('mailapp.probe.probe_smtp', side_effect=probe_smtp) as probe:
+            first = probe_many(profiles)
+            second = probe_many(profiles)
+            self.assertEqual(probe.call_count, 4, "only the failed profile is probed again")
+            probe_many(profiles, use_cache=False)
+            self.assertEqual(probe.call_count, 7)
+        self.assertEqual([(result['smtp_user'], result['ok'], result['cached']) for result in first],
+                         [('user0@example.com', True, False), ('user1@example.com', False, False),
+                          ('user2@example.com', True, False)])
+        self.assertEqual([result['cached'] for result in second], [True, False, True])
+
+    def test_probe_reports_failed_phase(self):
+        with mock.patch('mailapp.probe.socket.getaddrinfo', side_effect=socket.gaierror('Name or service not known')):
+            result = probe_smtp(self.smtp_auth)
+        self.assertEqual((result['ok'], result['phase'], result['error']), (False, 'dns', 'Name or service not known'))
+        # Port local sans serveur à l'écoute : connexion refusée
+        with socket.socket() as listener:
+            listener.bind(('127.0.0.1', 0))
+            port = listener.getsockname()[1]
+        result = probe_smtp({**self.smtp_auth, 'smtp_server': '127.0.0.1', 'smtp_port': port})
+        self.assertEqual((result['ok'], result['phase']), (False, 'tcp'))
+        self.assertIn('dns', result['timings_ms'])
+
+
+def fake_tls_session(age=0, lifetime=300, has_ticket=True):
+    # Session TLS (ssl.SSLSession) créée il y a `age` secondes
+    return SimpleNamespace(time=int(time.time()) - age, timeout=lifetime, has_ticket=has_ticket, id=b'')
+
+
+class TLSSessionCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.cache = TLSSessionCache(maxsize=10)
+
+    def test_store_and_get(self):
+        session = fake_tls_session()
+        self.cache.store('smtp.example.com', 587, SimpleNamespace(session=session))
+        self.assertIs(self.cache.get('smtp.example.com', 587), session)
+        self.assertIsNone(self.cache.get('smtp.example.com', 465))
+
+    def test_session_without_ticket_or_id_ignored(self):
+        self.cache.store('smtp.example.com', 587, SimpleNamespace(session=fake_tls_session(has_ticket=False)))
+        self.cache.store('smtp.example.com', 587, SimpleNamespace(session=None))
+        self.assertIsNone(self.cache.get('smtp.example.com', 587))
+
+    def test_expired_session_not_offered(self):
+        self.cache.store('smtp.example.com', 587, SimpleNamespace(session=fake_tls_session(age=400)))
+        self.assertIsNone(self.cache.get('smtp.example.com', 587))
+
+    def test_snapshot(self):
+        for resumed, seconds in ((False, 0.1), (False, 0.3), (True, 0.05), (True, 0.05)):
+            self.cache.record_handshake('smtp.example.com', 587, resumed, seconds)
+        self.assertEqual(self.cache.snapshot(), [{
+            'host': 'smtp.example.com', 'port': 587, 'full_handshakes': 2, 'resumed_handshakes': 2,
+            'avg_full_ms': 200.0, 'avg_resumed_ms': 50.0, 'saved_ms': 300.0,
+        }])
+
+    def test_shared_context(self):
+        context = shared_context()
+        self.assertIs(shared_context(), context)
+        self.assertEqual(context.minimum_version, ssl.TLSVersion.TLSv1_2)
+        self.assertEqual(context.verify_mode, ssl.CERT_REQUIRED)
+
+    def test_starttls_refused(self):
+        server = mock.Mock()
+        server.has_extn.return_value = False
+        with self.assertRaises(smtplib.SMTPNotSupportedError):
+            starttls(server, 'smtp.example.com', 587)
+        server.has_extn.return_value = True
+        server.docmd.return_value = (454, b'TLS not available')
+        with self.assertRaises(smtplib.SMTPResponseException):
+            starttls(server, 'smtp.example.com', 587)
+
+
+class FailingMailer:
+    # Mailer de test : chaque worker envoie `sent_before_failure` messages puis perd son authentification
+    def __init__(self, sent_before_failure=0):
+        self.sent_before_failure = sent_before_failure
+
+    def send_campaign(self, smtp_auth, sender_name, template, recipients, rate_limiter=None, report=None, **log_ids):
+        for _ in range(self.sent_before_failure):
+            next(recipients)
+            report['sent'] = report.get('sent', 0) + 1
+        raise SMTPAuthentificationException('Authentication failed')
+
+
+class ParallelCampaignSenderTests(TestCase):
+    smtp_auth = {'smtp_server': 'smtp.example.com', 'smtp_port': 587, 'smtp_user': 'user', 'smtp_password': 'secret'}
+    recipients = [(f'user{index}@example.com', {}) for index in range(230)]
+
+    def send(self, mailer):
+        started = time.monotonic()
+        sender = ParallelCampaignSender(mailer=mailer, concurrency=2)
+        try:
+            return sender.send(self.smtp_auth, 'Test', CompiledTemplate('Sujet', 'Corps'), self.recipients)
+        finally:
+            self.assertLess(time.monotonic() - started, 2, "feeding must stop once every worker has died")
+
+    def test_error_raised_when_every_worker_fails(self):
+        with self.assertRaises(SMTPAuthentificationException):
+            self.send(FailingMailer())
+
+    def test_unsent_counted_when_workers_die(self):
+        report = self.send(FailingMailer(sent_before_failure=5))
+        self.assertEqual(report['sent'], 10)
+        self.assertEqual(report['sent'] + report['unsent'], len(self.recipients))
+
+
+class ParallelCampaignSessionsTests(FakeSMTPMixin, TestCase):
+    def test_recipients_spread_over_sessions(self):
+        recipients = [(f'user{index}@example.com', {}) for index in range(60)]
+        sender = ParallelCampaignSender(concurrency=3)
+        report = sender.send(self.smtp_auth, 'Test', CompiledTemplate('Sujet', 'Corps'), iter(recipients))
+        self.assertEqual((report['sent'], report['unsent'], report['workers']), (60, 0, 3))
+        self.assertLessEqual(len(self.sessions), 3)
+        sent_to = sorted(to_addrs[0] for session in self.sessions for to_addrs, _ in session.messages)
+        self.assertEqual(sent_to, sorted(recipient for recipient, _ in recipients))
+
+    @override_settings(SMTP_MAX_CONNECTIONS_PER_HOST=2)
+    def test_workers_capped_per_host(self):
+        self.assertEqual(ParallelCampaignSender(concurrency=20)._workers(), 2)
+
+
+class OutboxLeaseTests(TestCase):
+    def setUp(self):
+        self.email = Email.objects.create(
+            sender='Test', recipient='a@example.com', subject='Sujet', body='Corps',
+            smtp_auth={'smtp_server': 'smtp.example.com', 'smtp_port': 587, 'smtp_user': 'user'},
+            smtp_secret='plain:secret',
+        )
+        patcher = mock.patch('mailapp.outbox.Mailer')
+        self.mailer = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+
+    def test_claim(self):
+        emails = claim_batch(10)
+        self.assertEqual([email.id for email in emails], [self.email.id])
+        self.email.refresh_from_db()
+        self.assertEqual((self.email.status, self.email.attempts), (Email.STATUS_SENDING, 1))
+        self.assertEqual(emails[0].claimed_at, self.email.claimed_at)
+        self.assertEqual(claim_batch(10), [], "a claimed email is not claimed again while its lease runs")
+
+    @override_settings(OUTBOX_LEASE_SECONDS=300)
+    def test_expired_lease_is_claimed_again(self):
+        Email.objects.filter(id=self.email.id).update(
+            status=Email.STATUS_SENDING, claimed_at=now() - timedelta(seconds=301)
+        )
+        self.assertEqual([email.id for email in claim_batch(10)], [self.email.id])
+
+    def test_lease_renewed_before_send(self):
+        emails = claim_batch(10)
+        claimed_at = emails[0].claimed_at
+
+        def send_mail(email_obj, attempts):
+            self.assertGreater(Email.objects.get(id=self.email.id).claimed_at, claimed_at)
+
+        self.mailer.send_mail.side_effect = send_mail
+        self.assertEqual(deliver(emails)['sent'], 1)
+        self.email.refresh_from_db()
+        self.assertEqual((self.email.status, self.email.smtp_secret), (Email.STATUS_SENT, ''))
+
+    def test_email_claimed_by_another_worker_is_not_sent(self):
+        """Bail expiré pendant le lot : l'email repris par un autre worker n'est pas envoyé deux fois"""
+        emails = claim_batch(10)
+        taken_over_at = now() + timedelta(seconds=1)
+        Email.objects.filter(id=self.email.id).update(claimed_at=taken_over_at, attempts=2)
+        report = deliver(emails)
+        self.mailer.send_mail.assert_not_called()
+        self.assertEqual(report['sent'], 0)
+        self.email.refresh_from_db()
+        self.assertEqual((self.email.status, self.email.claimed_at), (Email.STATUS_SENDING, taken_over_at))
+
+
+class AsyncDeliverTests(TestCase):
+    def setUp(self):
+        for recipient in ('a@example.com', 'b@example.com', 'c@example.com'):
+            Email.objects.create(
+                sender='Test', recipient=recipient, subject='Sujet', body='Corps',
+                smtp_auth={'smtp_server': 'smtp.example.com', 'smtp_port': 587, 'smtp_user': 'user'},
+                smtp_secret='plain:secret',
+            )
+        patcher = mock.patch('mailapp.outbox.AsyncMailer')
+        self.mailer = patcher.start().return_value
+        self.mailer.send_mail = mock.AsyncMock()
+        self.addCleanup(patcher.stop)
+
+    def test_batch_sent(self):
+        report = async_to_sync(adeliver)(claim_batch(10))
+        self.assertEqual(report['sent'], 3)
+        self.assertEqual(self.mailer.send_mail.await_count, 3)
+        self.assertEqual(Email.objects.filter(status=Email.STATUS_SENT, smtp_secret='').count(), 3)
+
+    @override_settings(SMTP_MAX_CONNECTIONS_PER_HOST=1)
+    def test_host_error_postpones_untried_emails(self):
+        """Après un 421, les emails du compte pas encore tentés sont replanifiés sans perdre de tentative"""
+        self.mailer.send_mail.side_effect = TransientSendException('Too many connections', smtp_code=421)
+        report = async_to_sync(adeliver)(claim_batch(10))
+        self.assertEqual(self.mailer.send_mail.await_count, 1)
+        self.assertEqual(report['retried'], 3)
+        self.assertEqual(
+            sorted(Email.objects.values_list('status', 'attempts')),
+            [(Email.STATUS_PENDING, 0), (Email.STATUS_PENDING, 0), (Email.STATUS_PENDING, 1)],
+        )
+
+
+def fetch_item(sequence, uid, flags, header, text):
+    # Réponse FETCH d'un message telle que renvoyée par imaplib (fragments et littéraux)
+    return [
+        (f'{sequence} (UID {uid} FLAGS ({flags}) BODY[HEADER.FIELDS (SUBJECT FROM)] {{{len(header)}}}'.encode(), header),
+        (f' BODY[TEXT]<0> {{{len(text)}}}'.encode(), text),
+        b')',
+    ]
+
+
+class FetchSummariesTests(SimpleTestCase):
+    header = b'Subject: =?utf-8?q?R=C3=A9union?=\r\nFrom: Alice <a@example.com>\r\n\r\n'
+
+    def test_one_fetch_for_the_whole_page(self):
+        imap_server = mock.Mock()
+        imap_server.fetch.return_value = ('OK', [
+            *fetch_item(2, 12, '', b'Subject: Second\r\n\r\n', b'Deuxieme message'),
+            *fetch_item(1, 11, '\\Seen', self.header, b'Premier   message\r\ncoupe au milie'),
+        ])
+        summaries = fetch_summaries(imap_server, '1:2')
+        imap_server.fetch.assert_called_once_with('1:2', list_fetch_items())
+        self.assertEqual([summary['uid'] for summary in summaries], [11, 12])
+        self.assertEqual(summaries[0]['subject'], 'Réunion')
+        self.assertEqual(summaries[0]['sender'], 'Alice <a@example.com>')
+        self.assertEqual(summaries[0]['body'], 'Premier message coupe au milie')
+        self.assertEqual((summaries[0]['seen'], summaries[1]['seen']), (True, False))
+
+    def test_uid_fetch_with_text(self):
+        imap_server = mock.Mock()
+        imap_server.uid.return_value = ('OK', fetch_item(1, 11, '', self.header, b'Corps complet'))
+        summaries = fetch_summaries(imap_server, '11', uid=True, with_text=True)
+        self.assertEqual(imap_server.uid.call_args.args[:2], ('FETCH', '11'))
+        self.assertEqual(summaries[0]['body_text'], 'Corps complet')
+
+    def test_fetch_items_do_not_download_whole_message(self):
+        items = list_fetch_items(512)
+        self.assertIn('BODY.PEEK[TEXT]<0.512>', items)
+        self.assertNotIn('RFC822', items)
+
+    def test_failed_fetch(self):
+        imap_server = mock.Mock()
+        imap_server.fetch.return_value = ('NO', [b'Invalid message set'])
+        with self.assertRaises(IMAP4.error):
+            fetch_summaries(imap_server, '1:2')
+
+
+@override_settings(MAILBOX_PART_CHUNK_BYTES=100)
+class StreamPartTests(SimpleTestCase):
+    content = bytes(range(256)) * 4
+
+    def stream(self, encoded, encoding):
+        imap_server = mock.Mock()
+
+        def uid(command, message_set, items):
+            offset, size = map(int, re.search(r'<(\d+)\.(\d+)>', items).groups())
+            chunk = encoded[offset:offset + size]
+            return 'OK', [(f'1 (UID 7 BODY[2]<{offset}> {{{len(chunk)}}}'.encode(), chunk), b')']
+
+        imap_server.uid.side_effect = uid
+        info = {'part': '2', 'content_type': 'application/pdf', 'encoding': encoding, 'size': len(encoded)}
+        with mock.patch('mailapp.mailbox.imap_pool.connection', return_value=nullcontext(SimpleNamespace(conn=imap_server))), \
+                mock.patch('mailapp.mailbox.select_folder'), \
+                mock.patch('mailapp.mailbox._fetch_structure', return_value=({}, [info])):
+            stream = stream_part({}, 7, '2')
+            self.assertEqual(next(stream), info)
+            chunks = list(stream)
+        return chunks, imap_server.uid.call_count
+
+    def test_base64_decoded_chunk_by_chunk(self):
+        """Les morceaux de 100 octets coupent les quanta base64 et les fins de ligne"""
+        encoded = base64.encodebytes(self.content)
+        chunks, fetches = self.stream(encoded, 'base64')
+        self.assertEqual(b''.join(chunks), self.content)
+        self.assertEqual(fetches, len(encoded) // 100 + 1)
+        self.assertGreater(len(chunks), 1)
+
+    def test_quoted_printable(self):
+        encoded = quopri.encodestring(self.content)
+        chunks, _ = self.stream(encoded, 'quoted-printable')
+        self.assertEqual(b''.join(chunks), self.content)
+
+    def test_unencoded(self):
+        chunks, fetches = self.stream(self.content, '8bit')
+        self.assertEqual(b''.join(chunks), self.content)
+        self.assertEqual(fetches, 11)
+
+
+class AsyncViewsTests(TestCase):
+    smtp_auth = {'smtp_server': 'smtp.example.com', 'smtp_port': 587, 'is_tls': True,
+                 'smtp_user': 'user@example.com', 'smtp_passwd': 'secret'}
+
+    async def post(self, view, data):
+        request = AsyncRequestFactory().post('/mail/send/', data=json.dumps(data), content_type='application/json')
+        response = await view.as_view()(request)
+        return response.status_code, json.loads(response.content)
+
+    async def test_send_enqueues(self):
+        status_code, data = await self.post(AsyncSendEmailView, {
+            'smtp_auth': self.smtp_auth, 'recipient': 'a@example.com', 'sender': 'Test',
+            'subject': 'Sujet', 'body': 'Corps',
+        })
+        self.assertEqual(status_code, 202)
+        email = await Email.objects.aget(id=data['id'])
+        self.assertEqual((email.status, email.recipient), (Email.STATUS_PENDING, 'a@example.com'))
+        self.assertNotIn('smtp_passwd', email.smtp_auth)
+
+    async def test_send_invalid(self):
+        status_code, data = await self.post(AsyncSendEmailView, {'recipient': 'not an address'})
+        self.assertEqual(status_code, 400)
+        self.assertIn('recipient', data)
+        self.assertFalse(await Email.objects.aexists())
+
+    async def test_body_must_be_object(self):
+        status_code, _ = await self.post(AsyncSendEmailView, ['a@example.com'])
+        self.assertEqual(status_code, 400)
+
+    async def test_smtp_probe(self):
+        with mock.patch('mailapp.views.AsyncMailer.test_connection', mock.AsyncMock()) as test_connection:
+            status_code, data = await self.post(AsyncTestSMTPView, self.smtp_auth)
+            self.assertEqual((status_code, data), (200, {'ack': True}))
+            test_connection.side_effect = SMTPAuthentificationException()
+            status_code, data = await self.post(AsyncTestSMTPView, self.smtp_auth)
+            self.assertEqual((status_code, data['reason']), (400, 'Bad authentication username/password'))
+            test_connection.side_effect = RemoteServerSMTPException()
+            status_code, data = await self.post(AsyncTestSMTPView, self.smtp_auth)
+            self.assertEqual((status_code, data['reason']), (400, 'Bad SMTP server configuration (domain/port)'))
+
+
+class AsyncHostThrottleTests(SimpleTestCase):
+    def setUp(self):
+        self.throttle = HostThrottle('smtp.example.com', max_concurrency=2, max_rate=0, min_rate=0)
+        self.active, self.peak = 0, 0
+
+    async def send(self, duration=0.01):
+        async with self.throttle.aslot():
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+            await asyncio.sleep(duration)
+            self.active -= 1
+
+    async def test_aslot_limits_concurrency(self):
+        await asyncio.gather(*(self.send() for _ in range(6)))
+        self.assertEqual(self.peak, 2)
+        self.assertEqual(self.throttle.to_dict()['active'], 0)
+
+    async def test_cancelled_waiter_passes_slot_on(self):
+        """Une coroutine annulée pendant son attente ne garde pas de place"""
+        holders = [asyncio.ensure_future(self.send(0.05)) for _ in range(2)]
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(self.send())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.gather(*holders)
+        await asyncio.wait_for(self.send(), timeout=1)
+        self.assertTrue(waiter.cancelled())
+        self.assertEqual(self.throttle.to_dict()['active'], 0)
+
+    async def test_slots_shared_with_threads(self):
+        # Une place prise par un envoi synchrone compte aussi pour les coroutines
+        with self.throttle.slot(), self.throttle.slot():
+            task = asyncio.ensure_future(self.send())
+            await asyncio.sleep(0.02)
+            self.assertFalse(task.done())
+        await asyncio.wait_for(task, timeout=1)
+
+
+class MailboxPartViewTests(SimpleTestCase):
+    url = '/mail/mailbox/7/parts/2/?imap_server=imap.example.com&imap_port=993&username=user&password=secret'
+
+    def setUp(self):
+        self.read = []
+        self.closed = False
+
+        def stream_part(imap_config, uid, part, folder):
+            yield {'content_type': 'application/pdf', 'filename': 'doc.pdf', 'encoding': 'base64', 'size': 12}
+            try:
+                for chunk in (b'abc', b'def', b'ghi'):
+                    self.read.append(chunk)
+                    yield chunk
+            finally:
+                self.closed = True
+
+        patcher = mock.patch('mailapp.views.stream_part', stream_part)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_asgi_response_streams_chunk_by_chunk(self):
+        """En ASGI, la pièce jointe n'est pas lue entièrement en mémoire avant l'envoi"""
+        response = await self.async_client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_async)
+        content = aiter(response.streaming_content)
+        self.assertEqual(await anext(content), b'abc')
+        self.assertEqual(self.read, [b'abc'])
+        self.assertEqual(await anext(content), b'def')
+        self.assertEqual(self.read, [b'abc', b'def'])
+
+    async def test_asgi_response_content(self):
+        response = await self.async_client.get(self.url)
+        self.assertEqual(b''.join([chunk async for chunk in response.streaming_content]), b'abcdefghi')
+        self.assertTrue(self.closed)
+
+    async def test_abandoned_download_closes_stream(self):
+        """Client déconnecté : le générateur est fermé et la session IMAP rendue au pool"""
+        from .views import stream_part
+        stream = stream_part({}, 7, '2', 'INBOX')
+        next(stream)
+        chunks = aiter_stream(stream)
+        self.assertEqual(await anext(chunks), b'abc')
+        await chunks.aclose()
+        self.assertTrue(self.closed)
+
+    def test_wsgi_response_content(self):
+        response = self.client.get(self.url)
+        self.assertFalse(response.is_async)
+        self.assertEqual(b''.join(response.streaming_content), b'abcdefghi')
+        self.assertIn('doc.pdf', response['Content-Disposition'])
+
+
+def fake_summary(uid, body_text=None):
+    # Résumé tel que produit par mailbox.fetch_summaries
+    summary = {'id': str(uid), 'uid': uid, 'subject': f'Sujet {uid}', 'sender': 'a@example.com',
+               'date': None, 'seen': False, 'body': f'Aperçu {uid}'}
+    if body_text is not None:
+        summary['body_text'] = body_text
+    return summary
+
+
+@override_settings(MAILBOX_INITIAL_SYNC=120)
+class MailboxSyncTests(TestCase):
+    account = 'user@imap.example.com:993'
+
+    def setUp(self):
+        patchers = {target: mock.patch(f'mailapp.mailsync.{target}')
+                    for target in ('select_folder', 'fetch_summaries', '_index', 'refresh_flags')}
+        for target, patcher in patchers.items():
+            setattr(self, target, patcher.start())
+            self.addCleanup(patcher.stop)
+        self.refresh_flags.return_value = False
+
+    def cached_uids(self):
+        return sorted(MailboxMessage.objects.values_list('uid', flat=True))
+
+    def test_initial_sync_fetches_newest_messages_only(self):
+        self.select_folder.return_value = (300, 7, 301)
+        self.fetch_summaries.return_value = [fake_summary(uid) for uid in range(181, 301)]
+        state = sync_folder(mock.Mock(), self.account)
+        self.assertEqual(self.fetch_summaries.call_args.args[1], '181:300')
+        self.assertEqual((state.lowest_uid, state.highest_uid, state.complete), (181, 300, False))
+
+    def test_incremental_sync_fetches_new_uids_only(self):
+        MailboxFolderState.objects.create(account=self.account, folder='INBOX', uidvalidity=7,
+                                          highest_uid=300, lowest_uid=1, complete=True)
+        self.select_folder.return_value = (302, 7, 303)
+        # "301:*" renvoie aussi le dernier message connu quand il n'y en a pas de nouveau
+        self.fetch_summaries.return_value = [fake_summary(uid) for uid in (300, 301, 302)]
+        state = sync_folder(mock.Mock(), self.account)
+        self.assertEqual(self.fetch_summaries.call_args.args[1:], ('301:*',))
+        self.assertTrue(self.fetch_summaries.call_args.kwargs['uid'])
+        self.assertEqual(state.highest_uid, 302)
+        self.assertEqual(self.cached_uids(), [301, 302])
+
+    def test_nothing_new(self):
+        """UIDNEXT inchangé : aucune commande FETCH"""
+        MailboxFolderState.objects.create(account=self.account, folder='INBOX', uidvalidity=7,
+                                          highest_uid=300, lowest_uid=1, complete=True)
+        self.select_folder.return_value = (300, 7, 301)
+        sync_folder(mock.Mock(), self.account)
+        self.fetch_summaries.assert_not_called()
+
+    def test_uidvalidity_change_drops_cache(self):
+        state = MailboxFolderState.objects.create(account=self.account, folder='INBOX', uidvalidity=7,
+                                                  highest_uid=2, lowest_uid=1, complete=True)
+        MailboxMessage.objects.bulk_create([
+            MailboxMessage(account=self.account, folder='INBOX', uidvalidity=7, uid=uid) for uid in (1, 2)
+        ])
+        self.select_folder.return_value = (1, 8, 2)
+        self.fetch_summaries.return_value = [fake_summary(1)]
+        new_state = sync_folder(mock.Mock(), self.account)
+        self.assertNotEqual(new_state.pk, state.pk)
+        self.assertEqual(new_state.uidvalidity, 8)
+        self.assertEqual(list(MailboxMessage.objects.values_list('uidvalidity', 'uid')), [(8, 1)])
+
+    def test_pages_follow_uid_cursor(self):
+        self.select_folder.return_value = (5, 7, 6)
+        self.fetch_summaries.return_value = [fake_summary(uid) for uid in range(1, 6)]
+        pages, cursor = [], None
+        while True:
+            messages, cursor = list_messages(mock.Mock(), self.account, cursor=cursor, limit=2)
+            pages.append([message.uid for message in messages])
+            if cursor is None:
+                break
+        self.assertEqual(pages, [[5, 4], [3, 2], [1]])
+        self.assertEqual(self.fetch_summaries.call_count, 1, "later pages are served from the cache")
+
+
+class MailboxBodyIndexTests(TestCase):
+    def setUp(self):
+        for target, value in (('select_folder', mock.Mock(return_value=(3, 7, 4))), ('_index', mock.Mock())):
+            patcher = mock.patch(f'mailapp.mailsync.{target}', value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch('mailapp.mailsync.fetch_summaries')
+        self.fetch_summaries = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_listing_sync_fetches_previews_only(self):
+        """La synchronisation de la liste ne transfère pas les corps"""
+        self.fetch_summaries.return_value = [fake_summary(uid) for uid in (1, 2, 3)]
+        state = sync_folder(mock.Mock(), 'user@imap.example.com:993', 'INBOX')
+        self.assertFalse(self.fetch_summaries.call_args.kwargs.get('with_text', False))
+        self.assertEqual(state.highest_uid, 3)
+        self.assertEqual(MailboxMessage.objects.filter(body_text__isnull=True).count(), 3)
+
+    def test_index_bodies_newest_first(self):
+        state = MailboxFolderState.objects.create(account='user@imap.example.com:993', folder='INBOX',
+                                                  uidvalidity=7, highest_uid=3, lowest_uid=1)
+        MailboxMessage.objects.bulk_create([
+            MailboxMessage(account=state.account, folder='INBOX', uidvalidity=7, uid=uid, preview=f'Aperçu {uid}')
+            for uid in (1, 2, 3)
+        ])
+        # Le message 2 a été supprimé du serveur entre-temps
+        self.fetch_summaries.return_value = [fake_summary(3, body_text='Corps complet 3')]
+        self.assertEqual(index_bodies(mock.Mock(), state, 2), 2)
+        self.assertEqual(self.fetch_summaries.call_args.args[1], '3,2')
+        self.assertTrue(self.fetch_summaries.call_args.kwargs['with_text'])
+        self.assertEqual(
+            dict(MailboxMessage.objects.values_list('uid', 'body_text')), {1: None, 2: '', 3: 'Corps complet 3'}
+        )
+        self.fetch_summaries.return_value = [fake_summary(1, body_text='Corps complet 1')]
+        self.assertEqual(index_bodies(mock.Mock(), state, 2), 1)
+        self.assertEqual(index_bodies(mock.Mock(), state, 2), 0)
+
+
+class IMAPSessionTests(SimpleTestCase):
+    imap_config = {'imap_server': 'imap.example.com', 'imap_port': 993, 'username': 'user',
+                   'password': 'secret', 'use_ssl': True}
+
+    def setUp(self):
+        self.sessions = []
+
+        def open_imap(imap_config):
+            session = mock.Mock()
+            session.noop.return_value = ('OK', [b'NOOP completed'])
+            self.sessions.append(session)
+            return session
+
+        patcher = mock.patch('mailapp.connections.open_imap', open_imap)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        imap_pool.clear()
+        self.addCleanup(imap_pool.clear)
+
+    def test_session_reused_across_requests(self):
+        """Les requêtes successives ne refont pas de LOGIN"""
+        for _ in range(3):
+            with_imap_session(self.imap_config, lambda imap_server: imap_server.select('INBOX'))
+        self.assertEqual(len(self.sessions), 1)
+        self.assertEqual(self.sessions[0].select.call_count, 3)
+
+    def test_other_credentials_get_their_own_session(self):
+        with_imap_session(self.imap_config, lambda imap_server: None)
+        with_imap_session({**self.imap_config, 'password': 'other'}, lambda imap_server: None)
+        self.assertEqual(len(self.sessions), 2)
+
+    def test_dropped_session_is_reopened(self):
+        def operation(imap_server):
+            if imap_server is self.sessions[0]:
+                raise IMAP4.abort('socket error: EOF')
+            return 'OK'
+
+        self.assertEqual(with_imap_session(self.imap_config, operation), 'OK')
+        self.assertEqual(len(self.sessions), 2)
+        self.sessions[0].logout.assert_called_once()
+
+    def test_dead_idle_session_is_replaced(self):
+        with_imap_session(self.imap_config, lambda imap_server: None)
+        self.sessions[0].noop.side_effect = IMAP4.abort('socket error: EOF')
+        with_imap_session(self.imap_config, lambda imap_server: None)
+        self.assertEqual(len(self.sessions), 2)
+
+    def test_command_error_keeps_session(self):
+        # Un refus (NO/BAD) laisse la session dans le pool
+        def operation(imap_server):
+            raise IMAP4.error('SELECT failed: mailbox does not exist')
+
+        with self.assertRaises(IMAP4.error):
+            with_imap_session(self.imap_config, operation)
+        with_imap_session(self.imap_config, lambda imap_server: None)
+        self.assertEqual(len(self.sessions), 1)
+
+
+class FoldersOverviewTests(SimpleTestCase):
+    imap_config = {'imap_server': 'imap.example.com', 'imap_port': 993, 'username': 'user', 'password': 'secret'}
+
+    def test_connection_errors_only_affect_their_folder(self):
+        """Un dossier injoignable est signalé indisponible sans faire échouer les autres"""
+        errors = {
+            'Archives': socket.timeout('timed out'),
+            'Sent': ConnectionPoolTimeoutException('No pooled connection available before timeout'),
+            'Junk': ConnectionResetError(),
+        }
+
+        def folder_status(imap_server, folder):
+            if folder in errors:
+                raise errors[folder]
+            return {'messages': 0, 'unseen': 0}
+
+        with mock.patch('mailapp.mailsync.with_imap_session', lambda imap_config, operation: operation(mock.Mock())), \
+                mock.patch('mailapp.mailsync.folder_status', folder_status), \
+                mock.patch('mailapp.mailsync.list_messages', return_value=([], None)):
+            folders = folders_overview(self.imap_config, ['INBOX', 'Archives', 'Sent', 'Junk'])
+        self.assertEqual(
+            [(folder['name'], folder.get('error')) for folder in folders],
+            [('INBOX', None), ('Archives', 'timed out'),
+             ('Sent', 'No pooled connection available before timeout'), ('Junk', 'ConnectionResetError')],
+        )
+
+    def patch_imap(self, folder_status, folders=('INBOX', 'Sent', 'Archives')):
+        for target, value in (('with_imap_session', lambda imap_config, operation: operation(mock.Mock())),
+                              ('folder_status', folder_status),
+                              ('list_folders', mock.Mock(return_value=list(folders))),
+                              ('list_messages', mock.Mock(return_value=([], None)))):
+            patcher = mock.patch(f'mailapp.mailsync.{target}', value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    @mock.patch.object(imap_pool, 'max_size', 3)
+    def test_folders_synced_in_parallel(self):
+        """Chaque dossier a son thread : les trois attendent ensemble à la barrière"""
+        barrier = threading.Barrier(3, timeout=5)
+
+        def folder_status(imap_server, folder):
+            barrier.wait()
+            return {'messages': len(folder), 'unseen': 0}
+
+        self.patch_imap(folder_status)
+        folders = folders_overview(self.imap_config)
+        self.assertEqual([(folder['name'], folder['messages']) for folder in folders],
+                         [('INBOX', 5), ('Sent', 4), ('Archives', 8)])
+
+    @mock.patch.object(imap_pool, 'max_size', 2)
+    def test_threads_capped_by_pool_size(self):
+        active, peak = [0], [0]
+        lock = threading.Lock()
+
+        def folder_status(imap_server, folder):
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            time.sleep(0.02)
+            with lock:
+                active[0] -= 1
+            return {'messages': 0, 'unseen': 0}
+
+        self.patch_imap(folder_status, folders=[f'Dossier {index}' for index in range(6)])
+        self.assertEqual(len(folders_overview(self.imap_config)), 6)
+        self.assertEqual(peak[0], 2)
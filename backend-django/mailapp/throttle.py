@@ -0,0 +1,284 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Dict, Hashable, Iterator, List, Optional
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Limiteur de débit à seau de jetons, partagé entre threads.
+
+    Le seau se remplit de `rate` jetons par seconde jusqu'à `burst` jetons ;
+    chaque envoi consomme un jeton. Un débit nul ou négatif désactive la limite.
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self._lock = threading.Lock()
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+
+    def set_rate(self, rate: float, burst: Optional[float] = None):
+        with self._lock:
+            self._refill_locked()
+            self.rate = rate
+            self.burst = burst if burst is not None else max(1.0, rate)
+            self._tokens = min(self._tokens, self.burst)
+
+    def _refill_locked(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self) -> float:
+        """
+        Consomme un jeton s'il est disponible, sans attendre.
+
+        :return: 0 si le jeton est pris, sinon l'attente (secondes) avant le prochain.
+        """
+        with self._lock:
+            if self.rate <= 0:
+                return 0
+            self._refill_locked()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self):
+        """
+        Consomme un jeton, en attendant qu'il soit disponible.
+        """
+        while True:
+            wait = self.try_acquire()
+            if not wait:
+                return
+            time.sleep(wait)
+
+    async def aacquire(self):
+        """
+        Équivalent asynchrone de acquire : l'attente ne bloque pas la boucle d'événements.
+        """
+        while True:
+            wait = self.try_acquire()
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+
+# Réponses SMTP par lesquelles un relais demande de ralentir
+THROTTLE_CODES = {421, 451}
+
+
+class HostThrottle:
+    """
+    Régulation adaptative (AIMD) des envois vers un relais SMTP.
+
+    Le throttle borne le nombre de transactions SMTP simultanées vers le relais
+    (`concurrency`) et son débit (`rate`, messages/seconde). Sur une réponse
+    421/451, les deux sont divisés par AIMD_DECREASE_FACTOR (au plus une fois
+    par AIMD_COOLDOWN secondes, une rafale de refus ne compte qu'une fois) ;
+    après AIMD_INCREASE_EVERY succès consécutifs, ils remontent d'un pas.
+
+    Les envois synchrones (threads, `slot`) et asynchrones (coroutines, `aslot`)
+    partagent les mêmes limites : une place libérée réveille un thread en attente
+    et la plus ancienne coroutine en attente.
+    """
+
+    def __init__(self, host: str, max_concurrency: int, max_rate: float, min_rate: float):
+        self.host = host
+        self.max_concurrency = max_concurrency
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.concurrency = max_concurrency
+        self.bucket = TokenBucket(max_rate)
+        self._cond = threading.Condition()
+        self._active = 0
+        self._async_waiters = deque()  # (boucle, future) des coroutines en attente d'une place
+        self._successes = 0
+        self._last_decrease = 0.0
+        self.sent = 0
+        self.deferred = 0
+        self.failed = 0
+
+    @property
+    def rate(self) -> float:
+        return self.bucket.rate
+
+    @contextmanager
+    def slot(self) -> Iterator[None]:
+        """
+        Réserve une transaction SMTP vers le relais : attend qu'une place se
+        libère sous la limite de concurrence courante, puis un jeton de débit.
+        """
+        with self._cond:
+            while self._active >= self.concurrency:
+                self._cond.wait()
+            self._active += 1
+        try:
+            self.bucket.acquire()
+            yield
+        finally:
+            self._release()
+
+    @asynccontextmanager
+    async def aslot(self) -> AsyncIterator[None]:
+        """
+        Équivalent asynchrone de slot : la coroutine attend sa place sans bloquer
+        la boucle d'événements.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._cond:
+                if self._active < self.concurrency:
+                    self._active += 1
+                    break
+                waiter = loop.create_future()
+                self._async_waiters.append((loop, waiter))
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                # Réveillée puis annulée : le réveil revient à la suivante
+                if waiter.done() and not waiter.cancelled():
+                    with self._cond:
+                        self._wake_locked()
+                raise
+        try:
+            await self.bucket.aacquire()
+            yield
+        finally:
+            self._release()
+
+    def _release(self):
+        with self._cond:
+            self._active -= 1
+            self._wake_locked()
+
+    def _wake_locked(self):
+        # Appelé avec self._cond : une place s'est libérée
+        self._cond.notify()
+        while self._async_waiters:
+            loop, waiter = self._async_waiters.popleft()
+            try:
+                loop.call_soon_threadsafe(self._resolve_waiter, waiter)
+                return
+            except RuntimeError:  # boucle fermée
+                continue
+
+    def _resolve_waiter(self, waiter: asyncio.Future):
+        # Exécuté dans la boucle de la coroutine en attente
+        if waiter.done():
+            # Coroutine annulée entre-temps : la place revient à la suivante
+            with self._cond:
+                self._wake_locked()
+        else:
+            waiter.set_result(None)
+
+    def record_success(self):
+        with self._cond:
+            self.sent += 1
+            self._successes += 1
+            if self._successes < settings.AIMD_INCREASE_EVERY:
+                return
+            self._successes = 0
+            if self.concurrency < self.max_concurrency:
+                self.concurrency += 1
+                self._wake_locked()
+            if self.max_rate <= 0:
+                return
+            rate = min(self.max_rate, self.bucket.rate + settings.AIMD_RATE_STEP)
+        if rate != self.bucket.rate:
+            self.bucket.set_rate(rate)
+
+    def record_failure(self, smtp_code: Optional[int], transient: bool):
+        with self._cond:
+            if not transient:
+                self.failed += 1
+                return
+            self.deferred += 1
+            if smtp_code not in THROTTLE_CODES:
+                return
+            self._successes = 0
+            now = time.monotonic()
+            if now - self._last_decrease < settings.AIMD_COOLDOWN:
+                return
+            self._last_decrease = now
+            self.concurrency = max(1, int(self.concurrency * settings.AIMD_DECREASE_FACTOR))
+            # Un débit maximal nul désactive la régulation du débit (seule la concurrence s'adapte)
+            rate = max(self.min_rate, self.bucket.rate * settings.AIMD_DECREASE_FACTOR) if self.max_rate > 0 else 0
+        if rate:
+            self.bucket.set_rate(rate)
+        logger.warning(f"SMTP host {self.host} deferred with {smtp_code}: throttling to "
+                       f"{self.concurrency} concurrent transaction(s) and {rate:.2f} mail/s")
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                'host': self.host,
+                'rate': round(self.bucket.rate, 3),
+                'max_rate': self.max_rate,
+                'concurrency': self.concurrency,
+                'max_concurrency': self.max_concurrency,
+                'active': self._active,
+                'sent': self.sent,
+                'deferred': self.deferred,
+                'failed': self.failed,
+            }
+
+
+class HostThrottleRegistry:
+    """
+    Throttles des relais SMTP, partagés par tous les envois du processus.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._throttles: Dict[str, HostThrottle] = {}
+
+    def get(self, host: str) -> HostThrottle:
+        with self._lock:
+            throttle = self._throttles.get(host)
+            if throttle is None:
+                throttle = self._throttles[host] = HostThrottle(
+                    host,
+                    max_concurrency=settings.SMTP_MAX_CONNECTIONS_PER_HOST,
+                    max_rate=settings.SMTP_HOST_MAX_RATE,
+                    min_rate=settings.SMTP_HOST_MIN_RATE
+                )
+            return throttle
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            throttles = list(self._throttles.values())
+        return [throttle.to_dict() for throttle in throttles]
+
+    def clear(self):
+        with self._lock:
+            self._throttles.clear()
+
+
+_buckets: Dict[Hashable, TokenBucket] = defaultdict(lambda: TokenBucket(settings.SMTP_RATE_LIMIT))
+_buckets_lock = threading.Lock()
+
+
+def rate_limiter_for(smtp_auth: Dict[str, Any], rate: Optional[float] = None) -> TokenBucket:
+    """
+    Retourne le seau de jetons du compte SMTP (serveur, utilisateur), partagé par
+    tous les envois du processus. `rate` (messages/seconde) met à jour son débit.
+    """
+    key = (smtp_auth['smtp_server'], smtp_auth['smtp_user'])
+    with _buckets_lock:
+        bucket = _buckets[key]
+    if rate is not None and rate != bucket.rate:
+        bucket.set_rate(rate)
+    return bucket
+
+
+host_throttles = HostThrottleRegistry()
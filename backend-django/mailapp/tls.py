@@ -0,0 +1,121 @@
+import smtplib
+import ssl
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+from django.conf import settings
+from .cache import LRUCache
+
+_context: Optional[ssl.SSLContext] = None
+_context_lock = threading.Lock()
+
+
+def shared_context() -> ssl.SSLContext:
+    """
+    Contexte TLS client partagé par le processus : le magasin de certificats
+    (système ou SMTP_TLS_CA_FILE) n'est chargé qu'une fois, et les sessions TLS
+    qu'il produit peuvent être reprises par les connexions suivantes.
+    """
+    global _context
+    if _context is None:
+        with _context_lock:
+            if _context is None:
+                context = ssl.create_default_context(cafile=settings.SMTP_TLS_CA_FILE)
+                context.minimum_version = ssl.TLSVersion.TLSv1_2
+                _context = context
+    return _context
+
+
+class TLSSessionCache:
+    """
+    Dernière session TLS obtenue de chaque relais (serveur, port), reprise à la
+    connexion suivante (ticket de session) : la poignée de main abrégée évite
+    l'échange de clés et la vérification du certificat.
+
+    Tient aussi, par relais, le compte des poignées de main complètes et reprises
+    et leur durée, d'où une estimation du temps économisé par la reprise.
+    """
+
+    def __init__(self, maxsize: int):
+        self._sessions = LRUCache(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self._stats: Dict[Tuple[str, int], Dict[str, float]] = defaultdict(
+            lambda: {'full': 0, 'resumed': 0, 'full_seconds': 0.0, 'resumed_seconds': 0.0}
+        )
+
+    def get(self, host: str, port: int) -> Optional[ssl.SSLSession]:
+        session = self._sessions.get((host, port))
+        # Session expirée selon la durée de vie annoncée par le serveur : inutile de la proposer
+        if session is not None and session.time + session.timeout < time.time():
+            self._sessions.pop((host, port))
+            return None
+        return session
+
+    def store(self, host: str, port: int, sock: Any):
+        session = getattr(sock, 'session', None)
+        if session is not None and (session.has_ticket or session.id):
+            self._sessions.set((host, port), session)
+
+    def record_handshake(self, host: str, port: int, resumed: bool, seconds: float):
+        with self._lock:
+            stats = self._stats[(host, port)]
+            kind = 'resumed' if resumed else 'full'
+            stats[kind] += 1
+            stats[f'{kind}_seconds'] += seconds
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            items = [(key, dict(stats)) for key, stats in self._stats.items()]
+        snapshot = []
+        for (host, port), stats in items:
+            full_ms = stats['full_seconds'] * 1000 / stats['full'] if stats['full'] else None
+            resumed_ms = stats['resumed_seconds'] * 1000 / stats['resumed'] if stats['resumed'] else None
+            # Poignées de main reprises comptées au coût moyen d'une poignée de main complète
+            saved_ms = (
+                max(0.0, (full_ms - resumed_ms) * stats['resumed'])
+                if full_ms is not None and resumed_ms is not None else 0.0
+            )
+            snapshot.append({
+                'host': host,
+                'port': port,
+                'full_handshakes': stats['full'],
+                'resumed_handshakes': stats['resumed'],
+                'avg_full_ms': round(full_ms, 2) if full_ms is not None else None,
+                'avg_resumed_ms': round(resumed_ms, 2) if resumed_ms is not None else None,
+                'saved_ms': round(saved_ms, 1),
+            })
+        return snapshot
+
+    def clear(self):
+        self._sessions.clear()
+        with self._lock:
+            self._stats.clear()
+
+
+tls_sessions = TLSSessionCache(maxsize=settings.SMTP_TLS_SESSION_CACHE_SIZE)
+
+
+def starttls(server: smtplib.SMTP, host: str, port: int) -> Tuple[int, bytes]:
+    """
+    Équivalent de smtplib.SMTP.starttls avec le contexte partagé et la reprise
+    de la dernière session TLS du relais. La durée de la poignée de main est
+    enregistrée dans tls_sessions.
+    """
+    server.ehlo_or_helo_if_needed()
+    if not server.has_extn('starttls'):
+        raise smtplib.SMTPNotSupportedError("STARTTLS extension not supported by server.")
+    code, reply = server.docmd('STARTTLS')
+    if code != 220:
+        raise smtplib.SMTPResponseException(code, reply)
+    started = time.monotonic()
+    sock = shared_context().wrap_socket(server.sock, server_hostname=host, session=tls_sessions.get(host, port))
+    tls_sessions.record_handshake(host, port, sock.session_reused, time.monotonic() - started)
+    server.sock = sock
+    server.file = None
+    # Les extensions annoncées avant TLS ne sont plus valables (RFC 3207)
+    server.helo_resp = None
+    server.ehlo_resp = None
+    server.esmtp_features = {}
+    server.does_esmtp = False
+    return code, reply
@@ -1,6 +1,8 @@
 from django.urls import path
 from rest_framework.documentation import include_docs_urls
-from .views import SendEmailView, TestSMTPView, MailboxView, TemplateAPIView, CampaignView
+from .views import SendEmailView, TestSMTPView, MailboxView, TemplateAPIView, CampaignView, CampaignMembersView, CampaignStatsView, CampaignImportView, MailboxSearchView, MailboxMessageView, MailboxPartView, MailboxFoldersView, CampaignSendView, EmailStatusView, SMTPHostsView, SuppressionView, ValidateEmailsView, TestSMTPBatchView, \
+    AsyncSendEmailView, AsyncTestSMTPView, AsyncMailboxView
+from django.conf import settings
 from rest_framework import permissions
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
@@ -16,12 +18,29 @@ schema_view = get_schema_view(
    permission_classes=(permissions.AllowAny,),
 )
 
+# Vues asynchrones pour un service en ASGI (uvicorn), voir MAIL_ASYNC_VIEWS
+if settings.MAIL_ASYNC_VIEWS:
+    SendEmailView, TestSMTPView, MailboxView = AsyncSendEmailView, AsyncTestSMTPView, AsyncMailboxView
+
 urlpatterns = [
     path('send/', SendEmailView.as_view(), name='send-email'),  # /mail (envoie d'email)
+    re_path(r'^send/(?P<email_id>\d+)/?$', EmailStatusView.as_view(), name='send-email-status'),
     path('testsmtp/', TestSMTPView.as_view(), name='test-smtp'),  # /testsmtp (test de connexion SMTP)
+    path('testsmtp/batch/', TestSMTPBatchView.as_view(), name='test-smtp-batch'),  # test de plusieurs profils en parallèle
     re_path(r'^templates(?:/(?P<template_id>\d+))?/?$', TemplateAPIView.as_view(), name='templates'),
     re_path(r'^campaigns(?:/(?P<campaign_id>\d+))?/?$', CampaignView.as_view(), name='campaigns'),
+    re_path(r'^campaigns/(?P<campaign_id>\d+)/members/?$', CampaignMembersView.as_view(), name='campaign-members'),
+    re_path(r'^campaigns/(?P<campaign_id>\d+)/stats/?$', CampaignStatsView.as_view(), name='campaign-stats'),
+    re_path(r'^campaigns/(?P<campaign_id>\d+)/import/?$', CampaignImportView.as_view(), name='campaign-import'),
+    re_path(r'^campaigns/(?P<campaign_id>\d+)/send/?$', CampaignSendView.as_view(), name='campaign-send'),
+    path('suppressions/', SuppressionView.as_view(), name='suppressions'),
+    path('validate/', ValidateEmailsView.as_view(), name='validate-emails'),
+    path('smtp/hosts/', SMTPHostsView.as_view(), name='smtp-hosts'),
     path('mailbox/', MailboxView.as_view(), name='mailbox'),
+    path('mailbox/folders/', MailboxFoldersView.as_view(), name='mailbox-folders'),
+    path('mailbox/search/', MailboxSearchView.as_view(), name='mailbox-search'),
+    path('mailbox/<int:uid>/', MailboxMessageView.as_view(), name='mailbox-message'),
+    re_path(r'^mailbox/(?P<uid>\d+)/parts/(?P<part>\d+(?:\.\d+)*)/?$', MailboxPartView.as_view(), name='mailbox-part'),
     path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
     path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
     # tu pourras ajouter les autres routes ici au fur et à mesure
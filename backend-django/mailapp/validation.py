@@ -0,0 +1,209 @@
+import logging
+import re
+import socket
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from django.conf import settings
+from django.utils.module_loading import import_string
+from .cache import LRUCache
+
+try:
+    import dns.exception
+    import dns.resolver
+except ImportError:  # dnspython est optionnel : résolution par le système à défaut
+    dns = None
+
+logger = logging.getLogger(__name__)
+
+# Partie locale ASCII sans point initial, final ni double ; domaine en labels DNS
+# (IDNA déjà appliqué), TLD alphabétique ou punycode
+_LOCAL = r"[A-Za-z0-9%+_-]+(?:\.[A-Za-z0-9%+_-]+)*"
+_LABEL = r"[A-Za-z0-9](?:[A-Za-z0-9-]{0,61}[A-Za-z0-9])?"
+_TLD = r"(?:[A-Za-z]{2,63}|xn--[A-Za-z0-9-]{1,59})"
+EMAIL_REGEX = rf"^{_LOCAL}@(?:{_LABEL}\.)+{_TLD}$"
+EMAIL_PATTERN = re.compile(EMAIL_REGEX)
+
+# Motifs de rejet renvoyés par validate_emails
+REASON_SYNTAX = 'syntax'
+REASON_DOMAIN = 'domain'
+
+
+def normalize_email(value: str) -> Optional[str]:
+    """
+    Normalise une adresse ou retourne None si sa syntaxe est invalide.
+
+    Espaces et chevrons retirés, domaine en minuscules et converti en IDNA
+    (ex. 'élève@Exemple.FR' -> domaine ascii). La partie locale garde sa casse (RFC 5321).
+    """
+    value = value.strip().strip('<>').strip()
+    local, at, domain = value.rpartition('@')
+    if not at or not local or len(local) > 64:
+        return None
+    domain = domain.rstrip('.').lower()
+    if not domain.isascii():
+        try:
+            domain = domain.encode('idna').decode('ascii')
+        except UnicodeError:
+            return None
+    email = f'{local}@{domain}'
+    if len(domain) > 253 or len(email) > 254 or not EMAIL_PATTERN.match(email):
+        return None
+    return email
+
+
+class SocketResolver:
+    """
+    Vérifie qu'un domaine existe via le résolveur du système (A/AAAA) : un
+    domaine sans MX mais avec une adresse reçoit tout de même du courrier (RFC 5321).
+    """
+
+    def accepts_mail(self, domain: str) -> Optional[bool]:
+        """
+        :return: True/False, ou None si la réponse n'a pas pu être obtenue (ne pas rejeter).
+        """
+        try:
+            socket.getaddrinfo(domain, None)
+            return True
+        except socket.gaierror as exc:
+            if exc.errno in (socket.EAI_NONAME, getattr(socket, 'EAI_NODATA', socket.EAI_NONAME)):
+                return False
+            return None
+
+
+class DNSResolver(SocketResolver):
+    """
+    Interroge les enregistrements MX avec dnspython ; sans MX, se rabat sur les
+    adresses du domaine. Un MX nul (RFC 7505) signifie que le domaine refuse le courrier.
+    """
+
+    def __init__(self, timeout: Optional[float] = None):
+        self.timeout = timeout or settings.EMAIL_DNS_TIMEOUT
+
+    def accepts_mail(self, domain: str) -> Optional[bool]:
+        try:
+            answers = dns.resolver.resolve(domain, 'MX', lifetime=self.timeout)
+        except dns.resolver.NXDOMAIN:
+            return False
+        except dns.resolver.NoAnswer:
+            return super().accepts_mail(domain)
+        except dns.exception.DNSException:
+            return None
+        return any(str(answer.exchange) not in ('.', '') for answer in answers)
+
+
+class AcceptAllResolver:
+    """
+    Résolveur sans réseau (développement, tests) : tous les domaines sont acceptés.
+    """
+
+    def accepts_mail(self, domain: str) -> Optional[bool]:
+        return True
+
+
+def get_resolver():
+    """
+    Résolveur configuré par EMAIL_VALIDATION_RESOLVER : 'auto' (dnspython s'il
+    est installé, sinon le système) ou le chemin d'une classe à instancier.
+    """
+    path = settings.EMAIL_VALIDATION_RESOLVER
+    if path == 'auto':
+        return DNSResolver() if dns is not None else SocketResolver()
+    return import_string(path)()
+
+
+class DomainChecker:
+    """
+    Vérification des domaines par lots : chaque domaine n'est résolu qu'une fois
+    par lot, les réponses sont gardées EMAIL_DOMAIN_CACHE_TTL secondes, et les
+    domaines inconnus du cache sont résolus en parallèle.
+    """
+
+    def __init__(self, resolver=None):
+        self._resolver = resolver
+        self._cache = LRUCache(maxsize=settings.EMAIL_DOMAIN_CACHE_SIZE, ttl=settings.EMAIL_DOMAIN_CACHE_TTL)
+
+    @property
+    def resolver(self):
+        if self._resolver is None:
+            self._resolver = get_resolver()
+        return self._resolver
+
+    def _lookup(self, domain: str) -> Optional[bool]:
+        try:
+            result = self.resolver.accepts_mail(domain)
+        except Exception as exc:
+            logger.warning(f"Domain lookup failed for {domain}: {exc}")
+            return None
+        # Une absence de réponse (timeout) n'est pas mise en cache
+        if result is not None:
+            self._cache.set(domain, result)
+        return result
+
+    def check(self, domains: Iterable[str]) -> Dict[str, Optional[bool]]:
+        """
+        :return: {domaine: True (accepte le courrier), False (n'existe pas) ou None (inconnu)}.
+        """
+        results: Dict[str, Optional[bool]] = {}
+        missing = []
+        for domain in set(domains):
+            cached = self._cache.get(domain)
+            if cached is None:
+                missing.append(domain)
+            else:
+                results[domain] = cached
+        if missing:
+            workers = min(len(missing), settings.EMAIL_DNS_WORKERS)
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='domain-check') as executor:
+                results.update(zip(missing, executor.map(self._lookup, missing)))
+        return results
+
+    def clear(self):
+        self._cache.clear()
+
+
+domain_checker = DomainChecker()
+
+
+def validate_emails(addresses: Iterable[str], check_domains: Optional[bool] = None) -> List[Dict[str, Any]]:
+    """
+    Valide et normalise une liste d'adresses en une passe : syntaxe d'abord,
+    puis (si `check_domains`) existence des domaines, chacun vérifié une seule fois.
+
+    :return: Pour chaque adresse {'input', 'email' (normalisée ou None), 'valid', 'reason'}.
+    """
+    if check_domains is None:
+        check_domains = settings.EMAIL_VALIDATION_CHECK_DOMAINS
+    results = []
+    for address in addresses:
+        email = normalize_email(address) if isinstance(address, str) else None
+        results.append({
+            'input': address,
+            'email': email,
+            'valid': email is not None,
+            'reason': None if email is not None else REASON_SYNTAX,
+        })
+    if check_domains:
+        domains = domain_checker.check(result['email'].rpartition('@')[2] for result in results if result['valid'])
+        for result in results:
+            if result['valid'] and domains.get(result['email'].rpartition('@')[2]) is False:
+                result['valid'] = False
+                result['reason'] = REASON_DOMAIN
+    return results
+
+
+def filter_valid(emails: Iterable[str], check_domains: Optional[bool] = None) -> Tuple[List[str], List[str]]:
+    """
+    Sépare des adresses déjà normalisées selon l'existence de leur domaine.
+
+    :return: Le tuple (adresses acceptées, adresses dont le domaine n'existe pas).
+    """
+    emails = list(emails)
+    if check_domains is None:
+        check_domains = settings.EMAIL_VALIDATION_CHECK_DOMAINS
+    if not check_domains:
+        return emails, []
+    domains = domain_checker.check(email.rpartition('@')[2] for email in emails)
+    accepted, rejected = [], []
+    for email in emails:
+        (rejected if domains.get(email.rpartition('@')[2]) is False else accepted).append(email)
+    return accepted, rejected
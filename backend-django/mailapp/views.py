@@ -1,94 +1,206 @@
 # views.py
+import json
 import logging
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from datetime import datetime
-from .mailer import Mailer, EmailObjSerializer, AuthentificationSMTPSerializer
-from .exceptions import SMTPAuthentificationException, RemoteServerSMTPException, SendMailException
+from .mailer import Mailer, AsyncMailer, EmailObjSerializer, AuthentificationSMTPSerializer, CampaignSendSerializer
+from .exceptions import SMTPAuthentificationException, RemoteServerSMTPException, SendMailException, MessageNotFoundException, \
+    InvalidTargetsException
 from .dbservice import DBService
-from .models import Template, Mail, CampaignMail
-from django.db import transaction  # Pour les transactions atomiques
-from imaplib import IMAP4, IMAP4_SSL
-import email
-from email.header import decode_header
+from .models import Template, Mail, CampaignMail, CampaignStats, Email, Suppression
+from .deliverylog import delivery_log
+from .suppression import suppression_list
+from . import outbox
+from .sender import ParallelCampaignSender
+from .membership import import_recipients, apply_membership_delta, replace_members, normalize_targets
+from .validation import validate_emails
+from .probe import probe_many
+from .throttle import host_throttles
+from .tls import tls_sessions
+from .templating import get_compiled_template, invalidate_template
+from django.db import close_old_connections, transaction  # Pour les transactions atomiques
+from django.db.models import Count
+from django.utils import timezone
+from imaplib import IMAP4
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse, JsonResponse
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from django.utils.decorators import method_decorator
+from asgiref.sync import sync_to_async
+from django.utils.http import content_disposition_header
+from .mailbox import with_imap_session, stream_part, aiter_stream
+from .mailsync import account_key, list_messages, search_messages, get_message, folders_overview
+
+def imap_config_from_request(request):
+    """Paramètres IMAP passés en query string, ou None s'il en manque"""
+    imap_config = {
+        'imap_server': request.GET.get('imap_server'),
+        'imap_port': int(request.GET.get('imap_port') or 0),
+        'username': request.GET.get('username'),
+        'password': request.GET.get('password'),
+        'use_ssl': request.GET.get('use_ssl', 'true').lower() == 'true'
+    }
+
+    # Valider que tous les paramètres requis sont présents
+    required_params = ['imap_server', 'imap_port', 'username', 'password']
+    if not all(imap_config.get(param) for param in required_params):
+        return None
+    return imap_config
+
+
+def pagination_from_request(request, default_limit, max_limit=None):
+    """
+    Curseur et taille de page passés en query string (?cursor=&limit=).
+    Lève ValueError s'ils ne sont pas entiers.
+    """
+    cursor = int(request.GET['cursor']) if request.GET.get('cursor') else None
+    limit = int(request.GET.get('limit') or default_limit)
+    return cursor, max(1, min(limit, max_limit or settings.CAMPAIGN_MAX_PAGE_SIZE))
+
+
+def mailbox_page(imap_config, folder, cursor, limit):
+    """
+    Page de messages d'un dossier. Session IMAP du pool : seuls les messages
+    arrivés depuis la dernière synchronisation sont récupérés, la page est
+    servie depuis le cache local.
+    """
+    messages, next_cursor = with_imap_session(
+        imap_config,
+        lambda imap_server: list_messages(imap_server, account_key(imap_config), folder, cursor, limit)
+    )
+    return {
+        'emails': [message.to_dict() for message in messages],
+        'next_cursor': next_cursor
+    }
+
+
+def _mailbox_page_in_thread(imap_config, folder, cursor, limit):
+    # Thread de l'exécuteur par défaut : Django ne ferme pas sa connexion base de données en fin de requête
+    try:
+        return mailbox_page(imap_config, folder, cursor, limit)
+    finally:
+        close_old_connections()
+
+
+def campaign_summary(campaign):
+    """Résumé d'une campagne annotée avec `email_count`"""
+    return {
+        'id': campaign.id,
+        'name': campaign.name,
+        'created_at': campaign.created_at.isoformat(),
+        'email_count': campaign.email_count,
+    }
+
 
 class MailboxView(APIView):
     def get(self, request, *args, **kwargs):
         """Récupère les emails depuis le serveur IMAP distant"""
         try:
             # Récupérer les paramètres de configuration IMAP depuis la requête
-            imap_config = {
-                'imap_server': request.GET.get('imap_server'),
-                'imap_port': int(request.GET.get('imap_port')),
-                'username': request.GET.get('username'),
-                'password': request.GET.get('password'),
-                'use_ssl': request.GET.get('use_ssl', 'true').lower() == 'true'
-            }
+            imap_config = imap_config_from_request(request)
+            if imap_config is None:
+                return Response({
+                    'error': 'Missing required IMAP parameters'
+                }, status=status.HTTP_400_BAD_REQUEST)
 
-            # Valider que tous les paramètres requis sont présents
-            required_params = ['imap_server', 'imap_port', 'username', 'password']
-            if not all(imap_config.get(param) for param in required_params):
+            # Pagination par curseur : UID du dernier message de la page précédente
+            try:
+                cursor, limit = pagination_from_request(
+                    request, settings.MAILBOX_PAGE_SIZE, settings.MAILBOX_MAX_PAGE_SIZE
+                )
+            except ValueError:
+                return Response({
+                    'error': 'cursor and limit must be integers'
+                }, status=status.HTTP_400_BAD_REQUEST)
+            folder = request.GET.get('folder', 'INBOX')
+
+            return Response(mailbox_page(imap_config, folder, cursor, limit), status=status.HTTP_200_OK)
+
+        except IMAP4.error as e:
+            logging.error(f"IMAP error: {str(e)}")
+            return Response({
+                'error': 'IMAP connection failed',
+                'details': str(e)
+            }, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            logging.error(f"Unexpected error in MailboxView: {str(e)}")
+            return Response({
+                'error': 'Failed to fetch emails',
+                'details': str(e)
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class MailboxFoldersView(APIView):
+    def get(self, request, *args, **kwargs):
+        """Vue d'ensemble de plusieurs dossiers IMAP (compteurs et derniers emails), en parallèle"""
+        try:
+            imap_config = imap_config_from_request(request)
+            if imap_config is None:
                 return Response({
                     'error': 'Missing required IMAP parameters'
                 }, status=status.HTTP_400_BAD_REQUEST)
 
-            # Connexion au serveur IMAP
-            if imap_config['use_ssl']:
-                imap_server = IMAP4_SSL(imap_config['imap_server'], imap_config['imap_port'])
-            else:
-                imap_server = IMAP4(imap_config['imap_server'], imap_config['imap_port'])
+            try:
+                limit = int(request.GET.get('limit') or settings.MAILBOX_PAGE_SIZE)
+            except ValueError:
+                return Response({
+                    'error': 'limit must be an integer'
+                }, status=status.HTTP_400_BAD_REQUEST)
+            limit = max(1, min(limit, settings.MAILBOX_MAX_PAGE_SIZE))
 
-            # Login
-            imap_server.login(imap_config['username'], imap_config['password'])
+            # ?folder=INBOX&folder=Sent ; sans paramètre, tous les dossiers du compte
+            folders = folders_overview(imap_config, request.GET.getlist('folder'), limit)
 
-            # Sélectionner la boîte de réception
-            imap_server.select('INBOX')
+            return Response({
+                'folders': folders
+            }, status=status.HTTP_200_OK)
 
-            # Rechercher tous les emails
-            _, message_numbers = imap_server.search(None, 'ALL')
-            
-            # Limiter à 50 emails les plus récents pour éviter une surcharge
-            email_ids = message_numbers[0].split()[-50:]
-            
-            emails = []
-            for email_id in email_ids:
-                _, msg_data = imap_server.fetch(email_id, '(RFC822)')
-                email_body = msg_data[0][1]
-                message = email.message_from_bytes(email_body)
-
-                # Décoder le sujet
-                subject = decode_header(message["subject"])[0]
-                subject = subject[0] if isinstance(subject[0], str) else subject[0].decode()
-
-                # Décoder l'expéditeur
-                from_header = decode_header(message["from"])[0]
-                sender = from_header[0] if isinstance(from_header[0], str) else from_header[0].decode()
-
-                # Récupérer la date
-                date = message["date"]
-
-                # Récupérer le corps du message
-                body = ""
-                if message.is_multipart():
-                    for part in message.walk():
-                        if part.get_content_type() == "text/plain":
-                            body = part.get_payload(decode=True).decode()
-                            break
-                else:
-                    body = message.get_payload(decode=True).decode()
-
-                emails.append({
-                    'id': email_id.decode(),
-                    'subject': subject,
-                    'sender': sender,
-                    'date': date,
-                    'body': body
-                })
-
-            # Fermer proprement la connexion
-            imap_server.close()
-            imap_server.logout()
+        except IMAP4.error as e:
+            logging.error(f"IMAP error: {str(e)}")
+            return Response({
+                'error': 'IMAP connection failed',
+                'details': str(e)
+            }, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            logging.error(f"Unexpected error in MailboxFoldersView: {str(e)}")
+            return Response({
+                'error': 'Failed to fetch folders',
+                'details': str(e)
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class MailboxSearchView(APIView):
+    def get(self, request, *args, **kwargs):
+        """Recherche plein texte dans les emails (cache local, puis serveur IMAP)"""
+        try:
+            imap_config = imap_config_from_request(request)
+            if imap_config is None:
+                return Response({
+                    'error': 'Missing required IMAP parameters'
+                }, status=status.HTTP_400_BAD_REQUEST)
+
+            query = request.GET.get('q', '').strip()
+            if not query:
+                return Response({
+                    'error': 'Missing search query (q)'
+                }, status=status.HTTP_400_BAD_REQUEST)
+            try:
+                limit = int(request.GET.get('limit') or settings.MAILBOX_PAGE_SIZE)
+            except ValueError:
+                return Response({
+                    'error': 'limit must be an integer'
+                }, status=status.HTTP_400_BAD_REQUEST)
+            limit = max(1, min(limit, settings.MAILBOX_MAX_PAGE_SIZE))
+            folder = request.GET.get('folder', 'INBOX')
+
+            emails = with_imap_session(
+                imap_config,
+                lambda imap_server: search_messages(imap_server, account_key(imap_config), query, folder, limit)
+            )
 
             return Response({
                 'emails': emails
@@ -101,53 +213,137 @@ class MailboxView(APIView):
                 'details': str(e)
             }, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
-            logging.error(f"Unexpected error in MailboxView: {str(e)}")
+            logging.error(f"Unexpected error in MailboxSearchView: {str(e)}")
             return Response({
-                'error': 'Failed to fetch emails',
+                'error': 'Failed to search emails',
+                'details': str(e)
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class MailboxMessageView(APIView):
+    def get(self, request, uid, *args, **kwargs):
+        """Récupère le contenu d'un email et la liste de ses pièces jointes"""
+        try:
+            imap_config = imap_config_from_request(request)
+            if imap_config is None:
+                return Response({
+                    'error': 'Missing required IMAP parameters'
+                }, status=status.HTTP_400_BAD_REQUEST)
+            folder = request.GET.get('folder', 'INBOX')
+
+            message = with_imap_session(
+                imap_config,
+                lambda imap_server: get_message(imap_server, account_key(imap_config), int(uid), folder)
+            )
+
+            return Response({
+                'email': message
+            }, status=status.HTTP_200_OK)
+
+        except MessageNotFoundException:
+            return Response({
+                'error': 'Email not found'
+            }, status=status.HTTP_404_NOT_FOUND)
+        except IMAP4.error as e:
+            logging.error(f"IMAP error: {str(e)}")
+            return Response({
+                'error': 'IMAP connection failed',
+                'details': str(e)
+            }, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            logging.error(f"Unexpected error in MailboxMessageView: {str(e)}")
+            return Response({
+                'error': 'Failed to fetch email',
+                'details': str(e)
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class MailboxPartView(APIView):
+    def get(self, request, uid, part, *args, **kwargs):
+        """Télécharge une partie (pièce jointe) d'un email, en streaming"""
+        try:
+            imap_config = imap_config_from_request(request)
+            if imap_config is None:
+                return Response({
+                    'error': 'Missing required IMAP parameters'
+                }, status=status.HTTP_400_BAD_REQUEST)
+            folder = request.GET.get('folder', 'INBOX')
+
+            # Le premier élément décrit la partie ; la suite est lue pendant l'envoi de la réponse
+            stream = stream_part(imap_config, int(uid), part, folder)
+            info = next(stream)
+
+            # En ASGI, un contenu synchrone serait lu entièrement en mémoire avant l'envoi
+            if isinstance(request._request, ASGIRequest):
+                stream = aiter_stream(stream)
+            response = StreamingHttpResponse(stream, content_type=info['content_type'])
+            response['Content-Disposition'] = content_disposition_header(
+                True, info['filename'] or f"part-{part}"
+            )
+            if info['encoding'] in ('7bit', '8bit', 'binary'):
+                response['Content-Length'] = str(info['size'])
+            return response
+
+        except MessageNotFoundException:
+            return Response({
+                'error': 'Attachment not found'
+            }, status=status.HTTP_404_NOT_FOUND)
+        except IMAP4.error as e:
+            logging.error(f"IMAP error: {str(e)}")
+            return Response({
+                'error': 'IMAP connection failed',
+                'details': str(e)
+            }, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            logging.error(f"Unexpected error in MailboxPartView: {str(e)}")
+            return Response({
+                'error': 'Failed to fetch attachment',
                 'details': str(e)
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
 class CampaignView(APIView):
     def get(self, request, campaign_id=None, *args, **kwargs):
-        """Récupère une ou toutes les campagnes avec leurs emails"""
+        """Récupère une campagne ou une page de campagnes, avec leur nombre d'emails"""
         try:
+            # Le nombre d'emails est calculé par la base (COUNT), les adresses sont
+            # servies page par page par CampaignMembersView
+            campaigns = CampaignMail.objects.annotate(email_count=Count('mails'))
             if campaign_id:
-                # Récupérer une campagne spécifique avec ses emails
-                campaign = CampaignMail.objects.get(id=campaign_id)
-                emails = campaign.mail_set.values_list('email', flat=True)  # Récupère tous les emails de la campagne
-                
+                campaign = campaigns.get(id=campaign_id)
                 return Response({
-                    'campaign': {
-                        'id': campaign.id,
-                        'name': campaign.name,
-                        'created_at': campaign.created_at,
-                        'targets': list(emails)  # Conversion en liste
-                    }
+                    'campaign': campaign_summary(campaign)
                 }, status=status.HTTP_200_OK)
-            else:
-                # Récupérer toutes les campagnes avec le compte d'emails
-                campaigns = CampaignMail.objects.all().prefetch_related('mails')
-                
-                if not campaigns.exists():  # Vérifie s'il y a des campagnes
-                    logging.info("Aucune campagne trouvée dans la base de données")
-                    return Response({
-                        'campaigns': [],
-                        'message': 'Aucune campagne disponible'
-                    }, status=status.HTTP_200_OK)
-                
-                campaigns_data = []
-                
-                for campaign in campaigns:
-                    campaigns_data.append({
-                        'id': campaign.id,
-                        'name': campaign.name,
-                        'created_at': campaign.created_at.isoformat(),
-                        'emails': [mail.to_dict() for mail in campaign.mails.all()]  # Sérialisation explicite
-                    })
-                logging.info(f"Retrieved {len(campaigns_data)} campaign(s)")
-                return Response({'campaigns': campaigns_data}, status=status.HTTP_200_OK)
-                
+
+            try:
+                cursor, limit = pagination_from_request(request, settings.CAMPAIGN_PAGE_SIZE)
+            except ValueError:
+                return Response(
+                    {'detail': 'cursor et limit doivent être des entiers'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+            # Pagination par curseur sur l'id (du plus récent au plus ancien) : une seule requête par page
+            if cursor is not None:
+                campaigns = campaigns.filter(id__lt=cursor)
+            page = list(campaigns.order_by('-id')[:limit + 1])
+            next_cursor = page[limit - 1].id if len(page) > limit else None
+            page = page[:limit]
+
+            if not page and cursor is None:
+                logging.info("Aucune campagne trouvée dans la base de données")
+                return Response({
+                    'campaigns': [],
+                    'next_cursor': None,
+                    'message': 'Aucune campagne disponible'
+                }, status=status.HTTP_200_OK)
+
+            logging.info(f"Retrieved {len(page)} campaign(s)")
+            return Response({
+                'campaigns': [campaign_summary(campaign) for campaign in page],
+                'next_cursor': next_cursor
+            }, status=status.HTTP_200_OK)
+
         except CampaignMail.DoesNotExist:
             return Response(
                 {'detail': 'Campagne non trouvée'},
@@ -176,13 +372,15 @@ class CampaignView(APIView):
             # Création de la campagne
             campaign = CampaignMail.objects.create(name=data['name'])
             
-            # Préparation des emails uniques et valides
-            unique_emails = {email.strip() for email in data['emails'] if email.strip()}
+            # Préparation des emails uniques et valides ; une cible peut être une adresse
+            # ou un objet {"email": ..., <variable>: ...} portant ses variables de template
+            targets, invalid = normalize_targets(data.get('emails', []))
+            unique_emails = set(targets)
             
             # Création des emails en masse (plus efficace)
             Mail.objects.bulk_create([
-                Mail(campaign=campaign, email=email)
-                for email in unique_emails
+                Mail(campaign=campaign, email=email, variables=variables)
+                for email, variables in targets.items()
             ])
             
             # Réponse avec les données créées
@@ -190,7 +388,8 @@ class CampaignView(APIView):
                 'id': campaign.id,
                 'name': campaign.name,
                 'created_at': campaign.created_at,
-                'emails': unique_emails
+                'emails': unique_emails,
+                'invalid': invalid
             }, status=status.HTTP_201_CREATED)
             
         except ValueError as ve:
@@ -208,29 +407,71 @@ class CampaignView(APIView):
     @transaction.atomic
     def put(self, request, *args, **kwargs):
         """
-        Met à jour un target existant.
+        Renomme une campagne. Avec une liste `emails`, remplace aussi la liste complète
+        des emails cibles ; sans elle, les membres ne sont pas touchés (ajouts et
+        retraits : PATCH).
         """
         try:
             campaign_id = kwargs.get('campaign_id') 
-            if campaign_id:
-                data = request.data
-                campaign_updated = {
-                    'name': data['name']
-                }
-                updated_campaign = DBService.update(CampaignMail, campaign_id, campaign_updated)  # Met à jour le target
-                old_emails = [mail.email for mail in DBService.get_by_field(Mail, 'campaign_id', campaign_id)]
-                mails_to_add = list(set(data['emails']) - set(old_emails))
-                mails_to_delete = list(set(old_emails) - set(data['emails']))
-                if mails_to_delete:
-                    Mail.objects.filter(email__in=[Mail(email=mail, campaign=updated_campaign) for mail in mails_to_delete]).delete()
-                if mails_to_add:
-                    Mail.objects.bulk_create([Mail(email=mail, ) for mail in mails_to_add])
-                logging.info(f"Campaign updated successfully with id {campaign_id}")
-                return Response({'message': 'Campaign updated successfully', 'target': updated_campaign.to_dict()}, status=status.HTTP_200_OK)
+            if not campaign_id:
+                return Response({'detail': 'Identifiant de campagne manquant'}, status=status.HTTP_400_BAD_REQUEST)
+            data = request.data
+            if not data.get('name'):
+                return Response({'detail': 'Le nom de la campagne est obligatoire'}, status=status.HTTP_400_BAD_REQUEST)
+            emails = data.get('emails')
+            if emails is not None and not isinstance(emails, list):
+                return Response({'detail': "'emails' doit être une liste"}, status=status.HTTP_400_BAD_REQUEST)
+
+            campaign = CampaignMail.objects.select_for_update().get(id=campaign_id)
+            changes = {}
+            if emails is not None:
+                # Remplacement ensembliste en SQL : les membres existants ne sont pas chargés.
+                # Fait avant le renommage : une liste refusée ne modifie rien.
+                changes = replace_members(campaign.id, emails)
+            campaign.name = data['name']
+            campaign.save(update_fields=['name'])
+            logging.info(f"Campaign updated successfully with id {campaign_id}")
+            return Response({'message': 'Campaign updated successfully', 'target': campaign.to_dict(), **changes}, status=status.HTTP_200_OK)
+        except CampaignMail.DoesNotExist:
+            return Response({'detail': 'Campagne non trouvée'}, status=status.HTTP_404_NOT_FOUND)
+        except InvalidTargetsException as exc:
+            return Response(
+                {'detail': "Aucune adresse valide : la liste des emails n'a pas été modifiée", 'invalid': exc.invalid},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         except Exception as exc:
             logging.error(f"Exception on /targets/update endpoint for reason: {exc}")
             return Response({'detail': 'Failed to update target'}, status=status.HTTP_400_BAD_REQUEST)
 
+    def patch(self, request, campaign_id=None, *args, **kwargs):
+        """
+        Ajoute et retire des emails cibles (listes `add` et `remove`), et renomme
+        éventuellement la campagne (`name`), sans renvoyer la liste complète.
+        """
+        try:
+            if not campaign_id:
+                return Response({'detail': 'Identifiant de campagne manquant'}, status=status.HTTP_400_BAD_REQUEST)
+            data = request.data
+            add, remove = data.get('add', []), data.get('remove', [])
+            if not isinstance(add, list) or not isinstance(remove, list):
+                return Response({'detail': "'add' et 'remove' doivent être des listes"}, status=status.HTTP_400_BAD_REQUEST)
+
+            with transaction.atomic():
+                campaign = CampaignMail.objects.select_for_update().get(id=campaign_id)
+                if data.get('name'):
+                    campaign.name = data['name']
+                    campaign.save(update_fields=['name'])
+                changes = apply_membership_delta(campaign.id, add, remove)
+
+            logging.info(f"Campaign {campaign_id} members updated: +{changes['added']} -{changes['removed']}")
+            return Response({'message': 'Campaign updated successfully', 'target': campaign.to_dict(), **changes}, status=status.HTTP_200_OK)
+
+        except CampaignMail.DoesNotExist:
+            return Response({'detail': 'Campagne non trouvée'}, status=status.HTTP_404_NOT_FOUND)
+        except Exception as exc:
+            logging.error(f"Exception on /campaigns/update endpoint for reason: {exc}", exc_info=True)
+            return Response({'detail': 'Failed to update campaign'}, status=status.HTTP_400_BAD_REQUEST)
+
     def delete(self, request, campaign_id, *args, **kwargs):
         """
         Supprime un target.
@@ -246,6 +487,242 @@ class CampaignView(APIView):
             logging.error(f"Exception on /targets/remove endpoint for reason: {exc}")
             return Response({'detail': 'Failed to remove target'}, status=status.HTTP_400_BAD_REQUEST)
 
+class CampaignMembersView(APIView):
+    def get(self, request, campaign_id, *args, **kwargs):
+        """Récupère une page des emails cibles d'une campagne"""
+        try:
+            if not CampaignMail.objects.filter(id=campaign_id).exists():
+                return Response(
+                    {'detail': 'Campagne non trouvée'},
+                    status=status.HTTP_404_NOT_FOUND
+                )
+            try:
+                cursor, limit = pagination_from_request(request, settings.CAMPAIGN_MEMBERS_PAGE_SIZE)
+            except ValueError:
+                return Response(
+                    {'detail': 'cursor et limit doivent être des entiers'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+            members = Mail.objects.filter(campaign_id=campaign_id)
+            if cursor is not None:
+                members = members.filter(id__gt=cursor)
+            # values() : pas d'instance de modèle ni de jointure par ligne
+            page = list(members.order_by('id').values('id', 'email', 'variables', 'added_at')[:limit + 1])
+            next_cursor = page[limit - 1]['id'] if len(page) > limit else None
+
+            return Response({
+                'campaign_id': int(campaign_id),
+                'members': page[:limit],
+                'next_cursor': next_cursor
+            }, status=status.HTTP_200_OK)
+
+        except Exception as exc:
+            logging.error(f"Erreur lors de la récupération des emails: {exc}", exc_info=True)
+            return Response(
+                {'detail': 'Erreur serveur'},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+class CampaignStatsView(APIView):
+    def get(self, request, campaign_id, *args, **kwargs):
+        """
+        Compteurs d'envoi d'une campagne (envoyés, différés, en échec), lus sur
+        CampaignStats sans parcourir le journal des envois.
+        """
+        try:
+            if not CampaignMail.objects.filter(id=campaign_id).exists():
+                return Response(
+                    {'detail': 'Campagne non trouvée'},
+                    status=status.HTTP_404_NOT_FOUND
+                )
+            # Les résultats encore en tampon dans ce processus sont écrits d'abord
+            delivery_log.flush()
+            stats = CampaignStats.objects.filter(campaign_id=campaign_id).first()
+            if stats is None:
+                return Response({
+                    'campaign_id': int(campaign_id),
+                    'sent': 0,
+                    'deferred': 0,
+                    'failed': 0,
+                    'updated_at': None
+                }, status=status.HTTP_200_OK)
+            return Response(stats.to_dict(), status=status.HTTP_200_OK)
+
+        except Exception as exc:
+            logging.error(f"Erreur lors de la récupération des statistiques: {exc}", exc_info=True)
+            return Response(
+                {'detail': 'Erreur serveur'},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+class CampaignImportView(APIView):
+    def post(self, request, campaign_id, *args, **kwargs):
+        """
+        Importe en flux les emails cibles d'une campagne depuis le corps de la requête
+        (une adresse par ligne ou CSV avec une colonne `email`).
+        """
+        try:
+            if not CampaignMail.objects.filter(id=campaign_id).exists():
+                return Response({'detail': 'Campagne non trouvée'}, status=status.HTTP_404_NOT_FOUND)
+
+            # Le corps est lu ligne par ligne, sans passer par request.data
+            stream = request.stream
+            if stream is None:
+                return Response({'detail': 'Le fichier à importer est vide'}, status=status.HTTP_400_BAD_REQUEST)
+
+            report = import_recipients(int(campaign_id), stream)
+            return Response({'campaign_id': int(campaign_id), **report}, status=status.HTTP_200_OK)
+
+        except Exception as exc:
+            logging.error(f"Erreur import campagne: {exc}", exc_info=True)
+            return Response(
+                {'detail': "Erreur lors de l'import"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+class CampaignSendView(APIView):
+    def post(self, request, campaign_id, *args, **kwargs):
+        """
+        Envoie un template à tous les emails d'une campagne, sur une ou plusieurs sessions SMTP en parallèle.
+        """
+        try:
+            serializer = CampaignSendSerializer(data=request.data)
+            if not serializer.is_valid():
+                return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+            data = serializer.validated_data
+
+            campaign = CampaignMail.objects.get(id=campaign_id)
+            template = Template.objects.get(id=data['template_id'])
+
+            # Itération par paquets pour ne pas charger toute la liste en mémoire
+            recipients = campaign.mails.order_by('id').values_list('email', 'variables').iterator(chunk_size=2000)
+
+            campaign_sender = ParallelCampaignSender(
+                concurrency=data.get('concurrency'),
+                rate_limit=data.get('rate_limit')
+            )
+            report = campaign_sender.send(
+                smtp_auth=data['smtp_auth'],
+                sender_name=data.get('sender', template.sender),
+                template=get_compiled_template(template),
+                recipients=recipients,
+                campaign_id=campaign.id,
+                template_id=template.id
+            )
+            logging.info(f"Campaign {campaign_id} sent with template {template.id}: {report['sent']} sent, {report['failed']} failed")
+            return Response({'campaign_id': campaign.id, 'template_id': template.id, **report}, status=status.HTTP_200_OK)
+
+        except CampaignMail.DoesNotExist:
+            return Response({'detail': 'Campagne non trouvée'}, status=status.HTTP_404_NOT_FOUND)
+        except Template.DoesNotExist:
+            return Response({'detail': 'Template non trouvé'}, status=status.HTTP_404_NOT_FOUND)
+        except RemoteServerSMTPException as exc:
+            logging.error(f"Exception on /campaigns/send endpoint for reason: {exc}")
+            return Response({
+                "message": "Bad request",
+                "reason": "Bad SMTP server configuration (domain/port)"
+            }, status=status.HTTP_400_BAD_REQUEST)
+        except SMTPAuthentificationException as exc:
+            logging.error(f"Exception on /campaigns/send endpoint for reason: {exc}")
+            return Response({
+                "message": "Bad request",
+                "reason": "Bad authentication username/password"
+            }, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as exc:
+            logging.error(f"Exception on /campaigns/send endpoint for reason: {exc}")
+            return Response({
+                "message": "Bad request",
+                "reason": "An error occurred in code, please contact owner of the code"
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+
+class SMTPHostsView(APIView):
+    def get(self, request, *args, **kwargs):
+        """
+        Récupère l'état de régulation (débit, concurrence, compteurs) de chaque relais SMTP,
+        ainsi que les poignées de main TLS complètes et reprises et le temps gagné par la reprise.
+        """
+        return Response({'hosts': host_throttles.snapshot(), 'tls': tls_sessions.snapshot()}, status=status.HTTP_200_OK)
+
+
+class SuppressionView(APIView):
+    def get(self, request, *args, **kwargs):
+        """Liste paginée des adresses exclues des envois"""
+        try:
+            cursor, limit = pagination_from_request(request, settings.CAMPAIGN_MEMBERS_PAGE_SIZE)
+        except ValueError:
+            return Response({'detail': 'cursor et limit doivent être des entiers'}, status=status.HTTP_400_BAD_REQUEST)
+        suppressions = Suppression.objects.order_by('id')
+        if cursor is not None:
+            suppressions = suppressions.filter(id__gt=cursor)
+        page = list(suppressions[:limit + 1])
+        next_cursor = page[limit - 1].id if len(page) > limit else None
+        return Response({
+            'suppressions': [suppression.to_dict() for suppression in page[:limit]],
+            'next_cursor': next_cursor
+        }, status=status.HTTP_200_OK)
+
+    def post(self, request, *args, **kwargs):
+        """Exclut des adresses de tous les envois ({"emails": [...], "reason": ...})"""
+        emails = request.data.get('emails', [])
+        reason = request.data.get('reason', Suppression.REASON_MANUAL)
+        if not isinstance(emails, list) or not all(isinstance(email, str) for email in emails):
+            return Response({'detail': "'emails' doit être une liste d'adresses"}, status=status.HTTP_400_BAD_REQUEST)
+        if reason not in dict(Suppression.REASON_CHOICES):
+            return Response({'detail': 'Motif invalide'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            added = suppression_list.add(emails, reason=reason)
+            logging.info(f"{added} address(es) added to the suppression list ({reason})")
+            return Response({'suppressed': added}, status=status.HTTP_201_CREATED)
+        except Exception as exc:
+            logging.error(f"Exception on /suppressions endpoint for reason: {exc}")
+            return Response({'detail': "Erreur lors de l'ajout"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    def delete(self, request, *args, **kwargs):
+        """Réautorise des adresses ({"emails": [...]})"""
+        emails = request.data.get('emails', [])
+        if not isinstance(emails, list) or not all(isinstance(email, str) for email in emails):
+            return Response({'detail': "'emails' doit être une liste d'adresses"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            removed = suppression_list.remove(emails)
+            return Response({'removed': removed}, status=status.HTTP_200_OK)
+        except Exception as exc:
+            logging.error(f"Exception on /suppressions endpoint for reason: {exc}")
+            return Response({'detail': 'Erreur lors de la suppression'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class ValidateEmailsView(APIView):
+    def post(self, request, *args, **kwargs):
+        """
+        Valide et normalise une liste d'adresses ({"emails": [...], "check_domains": bool}) ;
+        chaque domaine n'est vérifié qu'une fois, les réponses DNS sont mises en cache.
+        """
+        emails = request.data.get('emails', [])
+        check_domains = request.data.get('check_domains', settings.EMAIL_VALIDATION_CHECK_DOMAINS)
+        if not isinstance(emails, list):
+            return Response({'detail': "'emails' doit être une liste d'adresses"}, status=status.HTTP_400_BAD_REQUEST)
+        # Un vrai booléen JSON : la chaîne "false" ne doit pas activer la vérification
+        if not isinstance(check_domains, bool):
+            return Response({'detail': "'check_domains' doit être un booléen"}, status=status.HTTP_400_BAD_REQUEST)
+        if len(emails) > settings.EMAIL_VALIDATION_MAX_BATCH:
+            return Response(
+                {'detail': f"Au plus {settings.EMAIL_VALIDATION_MAX_BATCH} adresses par appel"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            results = validate_emails(emails, check_domains=check_domains)
+            valid = sum(1 for result in results if result['valid'])
+            return Response({
+                'results': results,
+                'valid': valid,
+                'invalid': len(results) - valid
+            }, status=status.HTTP_200_OK)
+        except Exception as exc:
+            logging.error(f"Exception on /validate endpoint for reason: {exc}")
+            return Response({'detail': 'Erreur lors de la validation'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
 class TemplateAPIView(APIView):
     
     def get(self, request, template_id=None, *args, **kwargs):
@@ -313,9 +790,11 @@ class TemplateAPIView(APIView):
                 'sender': data['sender'],
                 'subject': data['subject'],
                 'from_email': data.get('from_email', ''),
-                'body': data['body']
+                'body': data['body'],
+                'date_ts': timezone.now()  # Date de modification, fait aussi partie de la clé du cache de templates compilés
             }
             updated_template = DBService.update(Template, template_id, updated_template_data)  # Met à jour le template
+            invalidate_template(updated_template.id)
             logging.info(f"Template updated successfully with id {template_id}")
             return Response({'message': 'Template updated successfully',  'template': updated_template.to_dict()}, status=status.HTTP_200_OK)
         except Exception as exc:
@@ -329,6 +808,7 @@ class TemplateAPIView(APIView):
         try:
             template_id = int(template_id)
             template_deleted = DBService.delete(Template, template_id)  # Supprime le template
+            invalidate_template(template_id)
             logging.info(f"Template removed successfully with id {template_id}")
             template_dict = template_deleted.to_dict()
             template_dict['id'] = template_id
@@ -345,26 +825,14 @@ class SendEmailView(APIView):
             serializer = EmailObjSerializer(data=request.data)
             if serializer.is_valid():  # Vérification que les données sont valides
                 data = serializer.validated_data
-                mailer = Mailer()  # Initialisation de l'objet Mailer avec la config
-                # Essayer d'envoyer l'email
-                mailer.send_mail(email_obj=data)
-                # Si tout va bien, retourner un ack=True
-                return Response({"ack": True}, status=status.HTTP_200_OK)
+                # L'email est placé dans la file d'envoi, les workers send_outbox se chargent du SMTP
+                queued_email = outbox.enqueue(data)
+                logging.info(f"Email queued with id {queued_email.id}")
+                return Response({"ack": True, "id": queued_email.id, "status": queued_email.status}, status=status.HTTP_202_ACCEPTED)
             
             # ❗ Si on est ici, c'est que les données sont invalides
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         
-        except SendMailException as exc:
-            # Gérer l'exception SendMailException
-            logging.error(f"Exception on /mail/send endpoint for reason: {exc}")
-            return Response(
-                {
-                    "message": "Bad request",
-                    "reason": "Bad format"
-                },
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
         except Exception as exc:
             # Gérer toute autre exception générique
             logging.error(f"Exception on /mail/send endpoint for reason: {exc}")
@@ -377,6 +845,18 @@ class SendEmailView(APIView):
             )
 
 
+class EmailStatusView(APIView):
+    def get(self, request, email_id, *args, **kwargs):
+        """
+        Récupère l'état d'envoi d'un email de la file d'envoi.
+        """
+        try:
+            queued_email = Email.objects.get(id=email_id)
+            return Response({'email': queued_email.to_dict()}, status=status.HTTP_200_OK)
+        except Email.DoesNotExist:
+            return Response({'detail': 'Email non trouvé'}, status=status.HTTP_404_NOT_FOUND)
+
+
 class TestSMTPView(APIView):
     def post(self, request):
         try:
@@ -427,3 +907,133 @@ class TestSMTPView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
+
+
+class TestSMTPBatchView(APIView):
+    def post(self, request):
+        """
+        Teste plusieurs profils SMTP en parallèle ({"profiles": [<paramètres SMTP>, ...]}) et
+        renvoie pour chacun le résultat et la durée de chaque phase (DNS, TCP, TLS, AUTH).
+        """
+        profiles = request.data.get('profiles')
+        if not isinstance(profiles, list) or not profiles:
+            return Response({'detail': "'profiles' doit être une liste non vide de profils SMTP"}, status=status.HTTP_400_BAD_REQUEST)
+        if len(profiles) > settings.SMTP_PROBE_MAX_BATCH:
+            return Response(
+                {'detail': f"Au plus {settings.SMTP_PROBE_MAX_BATCH} profils par appel"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        serializer = AuthentificationSMTPSerializer(data=profiles, many=True)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            results = probe_many(serializer.validated_data, use_cache=request.data.get('use_cache', True) is not False)
+            return Response({'results': results}, status=status.HTTP_200_OK)
+        except Exception as exc:
+            logging.error(f"Exception on /mail/testsmtp/batch endpoint for reason: {exc}")
+            return Response({
+                "message": "Bad request",
+                "reason": "An error occurred in code, please contact the owner of the code"
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+# Vues asynchrones, branchées à la place des vues ci-dessus quand MAIL_ASYNC_VIEWS
+# est activé (service par uvicorn via app/asgi.py). Mêmes paramètres et mêmes
+# réponses ; DRF n'exécutant pas de vues asynchrones, ce sont des vues Django.
+
+def json_body(request):
+    """Corps JSON d'une requête ; lève ValueError s'il n'est pas un objet JSON"""
+    data = json.loads(request.body or b'{}')
+    if not isinstance(data, dict):
+        raise ValueError("Le corps de la requête doit être un objet JSON")
+    return data
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncSendEmailView(View):
+    async def post(self, request):
+        try:
+            data = json_body(request)
+        except ValueError as exc:
+            return JsonResponse({'detail': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            serializer = EmailObjSerializer(data=data)
+            if not serializer.is_valid():
+                return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+            # L'email est placé dans la file d'envoi, les workers send_outbox se chargent du SMTP
+            queued_email = await outbox.aenqueue(serializer.validated_data)
+            logging.info(f"Email queued with id {queued_email.id}")
+            return JsonResponse({"ack": True, "id": queued_email.id, "status": queued_email.status}, status=status.HTTP_202_ACCEPTED)
+        except Exception as exc:
+            logging.error(f"Exception on /mail/send endpoint for reason: {exc}")
+            return JsonResponse({
+                "message": "Bad request",
+                "reason": "An error occurred in code, please contact owner of the code"
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncTestSMTPView(View):
+    async def post(self, request):
+        try:
+            data = json_body(request)
+        except ValueError as exc:
+            return JsonResponse({'detail': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            serializer = AuthentificationSMTPSerializer(data=data)
+            if not serializer.is_valid():
+                return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+            # Connexion, STARTTLS et authentification sur le client SMTP asyncio
+            await AsyncMailer().test_connection(serializer)
+            return JsonResponse({"ack": True}, status=status.HTTP_200_OK)
+        except RemoteServerSMTPException as exc:
+            logging.error(f"Exception on /mail/test-smtp endpoint for reason: {exc}")
+            return JsonResponse({
+                "message": "Bad request",
+                "reason": "Bad SMTP server configuration (domain/port)"
+            }, status=status.HTTP_400_BAD_REQUEST)
+        except SMTPAuthentificationException as exc:
+            logging.error(f"Exception on /mail/test-smtp endpoint for reason: {exc}")
+            return JsonResponse({
+                "message": "Bad request",
+                "reason": "Bad authentication username/password"
+            }, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as exc:
+            logging.error(f"Exception on /mail/test-smtp endpoint for reason: {exc}")
+            return JsonResponse({
+                "message": "Bad request",
+                "reason": "An error occurred in code, please contact the owner of the code"
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+
+class AsyncMailboxView(View):
+    async def get(self, request, *args, **kwargs):
+        """
+        Récupère les emails depuis le serveur IMAP distant.
+
+        La synchronisation IMAP alterne échanges avec le serveur et écritures
+        dans le cache local (ORM synchrone) : elle s'exécute dans un thread
+        séparé, la boucle d'événements restant libre pendant l'attente.
+        """
+        imap_config = imap_config_from_request(request)
+        if imap_config is None:
+            return JsonResponse({'error': 'Missing required IMAP parameters'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            cursor, limit = pagination_from_request(request, settings.MAILBOX_PAGE_SIZE, settings.MAILBOX_MAX_PAGE_SIZE)
+        except ValueError:
+            return JsonResponse({'error': 'cursor and limit must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+        folder = request.GET.get('folder', 'INBOX')
+        try:
+            page = await sync_to_async(_mailbox_page_in_thread, thread_sensitive=False)(imap_config, folder, cursor, limit)
+            return JsonResponse(page, status=status.HTTP_200_OK)
+        except IMAP4.error as e:
+            logging.error(f"IMAP error: {str(e)}")
+            return JsonResponse({
+                'error': 'IMAP connection failed',
+                'details': str(e)
+            }, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            logging.error(f"Unexpected error in MailboxView: {str(e)}")
+            return JsonResponse({
+                'error': 'Failed to fetch emails',
+                'details': str(e)
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -33,6 +33,6 @@ CREATE TABLE CAMPAIGN_MAIL (
 CREATE TABLE MAIL (
     id SERIAL PRIMARY KEY,
     campaign_id INTEGER REFERENCES CAMPAIGN_MAIL(id) ON DELETE CASCADE,
-    email VARCHAR(255) NOT NULL CHECK (email ~* '^[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}$'),
+    email VARCHAR(255) NOT NULL CHECK (email ~* '^[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.([A-Za-z]{2,}|xn--[A-Za-z0-9-]+)$'),
     UNIQUE(campaign_id, email)  -- Prevents duplicate emails per campaign
 );
\ No newline at end of file
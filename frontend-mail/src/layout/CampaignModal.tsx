@@ -2,12 +2,12 @@ import React from 'react';
 import { View, ScrollView, Text, StyleSheet, Platform, TextInput as RNTextInput } from 'react-native';
 import { Button, Dialog, Portal, TextInput, Snackbar, IconButton } from 'react-native-paper';
 import * as DocumentPicker from 'expo-document-picker';
-import { Campaign } from '../page/CampaignMail';
+import { Campaign, fetchCampaignEmails } from '../page/CampaignMail';
 
 interface EmailListModalProps {
   visible: boolean;
   onDismiss: () => void;
-  onSave: (name: string, emails: string[]) => void;
+  onSave: (name: string, emails: string[], initialEmails: string[]) => void;
   selectedItem?: Campaign;
 }
 
@@ -21,28 +21,43 @@ const CampaignItemModal: React.FC<EmailListModalProps> = ({
   const [emailText, setEmailText] = React.useState('');
   const [error, setError] = React.useState<string | null>(null);
   const [stats, setStats] = React.useState({ total: 0, unique: 0, duplicates: 0 });
+  const [initialEmails, setInitialEmails] = React.useState<string[]>([]);
+  const [loading, setLoading] = React.useState(false);
 
   React.useEffect(() => {
+    let cancelled = false;
+    setInitialEmails([]);
+    setLoading(false);
     if (selectedItem) {
       setName(selectedItem.name || '');
-      
-      // Handle emails from selected item
-      const emails = selectedItem.emails || [];
-      const emailList = emails.map(email => 
-        // Handle both string and object formats
-        typeof email === 'object' ? email.email : email
-      );
-      
-      const emailText = emailList.length > 0 
-        ? emailList.join('\n')
-        : '';
-      
-      handleEmailTextUpdate(emailText);
+      handleEmailTextUpdate('');
+
+      // Addresses of an existing campaign are loaded from the paginated members endpoint
+      if (selectedItem.id !== null && selectedItem.id !== undefined) {
+        setLoading(true);
+        fetchCampaignEmails(selectedItem.id)
+          .then(emails => {
+            if (cancelled) return;
+            setInitialEmails(emails);
+            handleEmailTextUpdate(emails.join('\n'));
+          })
+          .catch(error => {
+            if (cancelled) return;
+            console.error('Error loading campaign emails:', error);
+            setError('Failed to load campaign emails');
+          })
+          .finally(() => {
+            if (!cancelled) setLoading(false);
+          });
+      }
     } else {
       setName('');
       setEmailText('');
       setStats({ total: 0, unique: 0, duplicates: 0 });
     }
+    return () => {
+      cancelled = true;
+    };
   }, [selectedItem]);
 
   // Function to handle email text updates and filtering
@@ -111,6 +126,10 @@ const CampaignItemModal: React.FC<EmailListModalProps> = ({
   };
 
   const handleSave = () => {
+    if (loading) {
+      return;
+    }
+
     if (!name.trim()) {
       setError('List name is required');
       return;
@@ -135,7 +154,7 @@ const CampaignItemModal: React.FC<EmailListModalProps> = ({
       return;
     }
 
-    onSave(name, emails);
+    onSave(name, emails, initialEmails);
   };
 
   return (
@@ -215,7 +234,7 @@ const CampaignItemModal: React.FC<EmailListModalProps> = ({
 
         <Dialog.Actions>
           <Button onPress={onDismiss}>Cancel</Button>
-          <Button onPress={handleSave} mode="contained">
+          <Button onPress={handleSave} mode="contained" loading={loading} disabled={loading}>
             Save
           </Button>
         </Dialog.Actions>
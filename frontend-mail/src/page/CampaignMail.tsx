@@ -6,41 +6,57 @@ import Layout from '../layout/Layout';
 import { showToastSuccess, showToastError } from '../ToastMessage';
 import CampaignModal from '../layout/CampaignModal';
 
-interface EmailObject {
-  email: string;
-  // add other properties if they exist
-}
-
 export interface Campaign {
   id: number | null;
   name: string;
   created_at: string;
-  emails?: (string | EmailObject)[];  // Can be either strings or email objects
+  email_count: number;  // Addresses are loaded page by page from /campaigns/<id>/members/
 }
 
+// Loads every address of a campaign by following the members endpoint cursor
+export const fetchCampaignEmails = async (campaignId: number): Promise<string[]> => {
+  const emails: string[] = [];
+  let cursor: number | null = null;
+  do {
+    const query = cursor !== null ? `?cursor=${cursor}` : '';
+    const response = await fetch(`http://localhost:8000/mail/campaigns/${campaignId}/members/${query}`);
+    if (!response.ok) {
+      throw new Error('Failed to retrieve campaign emails');
+    }
+    const data = await response.json();
+    emails.push(...data.members.map((member: { email: string }) => member.email));
+    cursor = data.next_cursor;
+  } while (cursor !== null);
+  return emails;
+};
+
 const CampaignMailScreen: React.FC = () => {
   const [campaigns, setCampaigns] = useState<Campaign[]>([]);
   const [page, setPage] = useState(0);
   const [itemsPerPage, setItemsPerPage] = useState(5);
   const [modalVisible, setModalVisible] = useState(false);
   const [selectedCampaign, setSelectedCampaign] = useState<Campaign | null>(null);
+  const [nextCursor, setNextCursor] = useState<number | null>(null);
 
-  useEffect(() => {
-    const fetchCampaigns = async () => {
-      try {
-        const response = await fetch('http://localhost:8000/mail/campaigns/');
-        if (!response.ok) {
-          showToastError("Failed to retrieve campaigns");
-          return;
-        }
-        const data = await response.json();
-        setCampaigns(data.campaigns || []);
-      } catch (error) {
-        console.error("Error fetching campaigns:", error);
-        showToastError("Error fetching campaigns");
+  const fetchCampaigns = async (cursor: number | null = null) => {
+    try {
+      const query = cursor !== null ? `?cursor=${cursor}` : '';
+      const response = await fetch(`http://localhost:8000/mail/campaigns/${query}`);
+      if (!response.ok) {
+        showToastError("Failed to retrieve campaigns");
+        return;
       }
-    };
+      const data = await response.json();
+      const page = data.campaigns || [];
+      setCampaigns(prev => cursor !== null ? [...prev, ...page] : page);
+      setNextCursor(data.next_cursor ?? null);
+    } catch (error) {
+      console.error("Error fetching campaigns:", error);
+      showToastError("Error fetching campaigns");
+    }
+  };
 
+  useEffect(() => {
     fetchCampaigns();
   }, []);
 
@@ -53,7 +69,7 @@ const CampaignMailScreen: React.FC = () => {
     id: null,
     name: '',
     created_at: new Date().toISOString(),
-    emails: []
+    email_count: 0
   });
 
   const openModal = (campaign: Campaign | null) => {
@@ -66,20 +82,35 @@ const CampaignMailScreen: React.FC = () => {
     setSelectedCampaign(null);
   };
 
-  const handleSave = async (name: string, emails: string[]) => {
+  // `initialEmails` are the addresses loaded when the modal opened: an update only sends the difference
+  const handleSave = async (name: string, emails: string[], initialEmails: string[]) => {
     try {
       const isUpdate = selectedCampaign?.id !== null && selectedCampaign?.id !== undefined;
-      const method = isUpdate ? 'PUT' : 'POST';
+      const method = isUpdate ? 'PATCH' : 'POST';
       const url = isUpdate 
         ? `http://localhost:8000/mail/campaigns/${selectedCampaign.id}/`
         : 'http://localhost:8000/mail/campaigns/';
 
+      let body;
+      if (isUpdate) {
+        // The modal lowercases addresses; removals keep the stored spelling so the server can match them
+        const current = new Set(emails.map(email => email.toLowerCase()));
+        const initial = new Set(initialEmails.map(email => email.toLowerCase()));
+        body = {
+          name,
+          add: emails.filter(email => !initial.has(email.toLowerCase())),
+          remove: initialEmails.filter(email => !current.has(email.toLowerCase())),
+        };
+      } else {
+        body = { name, emails };
+      }
+
       const response = await fetch(url, {
         method,
         headers: {
           'Content-Type': 'application/json',
         },
-        body: JSON.stringify({ name, emails }),
+        body: JSON.stringify(body),
       });
 
       if (!response.ok) {
@@ -90,11 +121,20 @@ const CampaignMailScreen: React.FC = () => {
       const data = await response.json();
       
       // Créez un objet campaign complet
-      const updatedCampaign = {
-        id: data.id,
-        name: data.name,
-        created_at: data.created_at,
-        emails: data.emails 
+      const updatedCampaign = isUpdate
+        ? {
+            ...selectedCampaign,
+            name: data.target.name,
+            email_count: selectedCampaign.email_count + data.added - data.removed
+          }
+        : {
+            id: data.id,
+            name: data.name,
+            created_at: data.created_at,
+            email_count: data.emails.length
+          };
+      if (data.invalid?.length) {
+        showToastError(`Invalid emails ignored: ${data.invalid.join(', ')}`);
       }
       setCampaigns(prev => {
         if (isUpdate) {
@@ -142,6 +182,7 @@ const CampaignMailScreen: React.FC = () => {
           <DataTable.Header>
             <DataTable.Title>Name</DataTable.Title>
             <DataTable.Title>Created At</DataTable.Title>
+            <DataTable.Title numeric>Emails</DataTable.Title>
             <DataTable.Title>Actions</DataTable.Title>
           </DataTable.Header>
 
@@ -149,6 +190,7 @@ const CampaignMailScreen: React.FC = () => {
             <DataTable.Row key={campaign.id || 'new'}>
               <DataTable.Cell>{campaign.name}</DataTable.Cell>
               <DataTable.Cell>{new Date(campaign.created_at).toLocaleDateString()}</DataTable.Cell>
+              <DataTable.Cell numeric>{campaign.email_count}</DataTable.Cell>
               <DataTable.Cell>
                 <View style={{ flexDirection: 'row', justifyContent: 'space-between', marginBottom: 8 }}>
                   <Button 
@@ -185,6 +227,17 @@ const CampaignMailScreen: React.FC = () => {
           />
         </DataTable>
 
+        {nextCursor !== null && (
+          <Button 
+            icon="chevron-down" 
+            mode="text" 
+            onPress={() => fetchCampaigns(nextCursor)}
+            style={styles.addButton}
+          >
+            Load more campaigns
+          </Button>
+        )}
+
         <Button 
           icon="plus" 
           mode="text" 